@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from dat_export import collapse_rows, write_dat_file
+from dat_import import load_dat_protocol, read_dat_file
+from protocol_cache import CompiledProtocol, normalize_config
+
+# Parse throughput of dat_import.read_dat_file on multi-megabyte .dat files
+# written by dat_export, next to np.loadtxt on the same tables, and a check
+# that the loaded protocol matches the compiled one it was written from.
+# Run with: python bench_dat_import.py [largest number of trains]
+
+
+def make_config(trains):
+    return normalize_config({
+        "waveform": "Biphasic",
+        "modulation_type_group": "Current",
+        "amplitude": 50, "amplitude_unit": "uA",
+        "pulse_duration": 100, "pulse_duration_unit": "us",
+        "number_of_events": 10,
+        "duration_between_events": 100, "duration_between_events_unit": "us",
+        "period_frequency_type": "Period", "period_frequency_value": 1,
+        "total_trains": trains,
+        "train_duration": 5, "train_duration_unit": "ms",
+        "accept_external_trigger": False,
+        "external_trigger_duration": 100, "external_trigger_duration_unit": "us",
+    })
+
+
+def loadtxt_tables(file_path):
+    # Baseline: np.loadtxt on each channel table, located by a line scan
+    with open(file_path) as file:
+        lines = file.read().splitlines()
+    tables = {}
+    number = None
+    for index, line in enumerate(lines):
+        if line.startswith("channel:"):
+            number = int(line.split(":")[1])
+            start = index + 2
+        elif number is not None and not line.strip():
+            rows = lines[start:index]
+            tables[number] = np.loadtxt(rows, ndmin=2) if rows else np.empty((0, 4))
+            number = None
+    return tables
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{'trains':>8}{'MB':>8}{'rows':>10}{'read ms':>10}{'MB/s':>8}{'loadtxt ms':>12}{'MB/s':>8}  round trip")
+    with tempfile.TemporaryDirectory() as directory:
+        trains = 100
+        while trains <= largest:
+            protocol = CompiledProtocol(make_config(trains))
+            path = os.path.join(directory, f"{trains}.dat")
+            write_dat_file(path, protocol.dat_channels, 'current')
+            megabytes = os.path.getsize(path) / 1e6
+
+            dat, read_seconds = timed(read_dat_file, path)
+            tables, loadtxt_seconds = timed(loadtxt_tables, path)
+            rows = sum(len(values) for values, _ in dat.channels.values())
+            same_tables = all(np.array_equal(dat.channels[number][0], table[:, 2]) for number, table in tables.items())
+
+            loaded = load_dat_protocol(path)
+            round_trip = same_tables and loaded.segments.repeat == protocol.segments.repeat and all(
+                np.array_equal(got, expected) for got, expected in
+                zip(loaded.arrays, collapse_rows(*protocol.arrays[:2]) + collapse_rows(*protocol.arrays[2:])))
+            print(f"{trains:>8}{megabytes:>8.1f}{rows:>10}{read_seconds * 1e3:>10.1f}{megabytes / read_seconds:>8.1f}"
+                  f"{loadtxt_seconds * 1e3:>12.1f}{megabytes / loadtxt_seconds:>8.1f}  {'ok' if round_trip else 'MISMATCH'}")
+            trains *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import time
+import numpy as np
+
+# Per-sample cost of encoding amplitudes and building the device arrays,
+# element-by-element (old prepare_device_data, minus its per-sample print)
+# versus NumPy packing plus one bulk copy. Uses the simulated backend unless
+# STG_BACKEND says otherwise, so on Windows it can measure the real .NET copy.
+os.environ.setdefault('STG_BACKEND', 'simulated')
+
+from device_encoding import decode_amplitudes, encode_amplitudes
+from stg_backend import load_backend
+
+stg = load_backend()
+
+
+def legacy_prepare(amplitude_arr, duration_arr):
+    encoded_amplitude = []
+    for amp in amplitude_arr:
+        magnitude = abs(amp) & 0xFFF
+        if amp < 0:
+            encoded_value = (1 << 15) | magnitude
+        else:
+            encoded_value = (0 << 7) | magnitude
+        encoded_amplitude.append(encoded_value)
+    pData = stg.Array[stg.UInt16](stg.UInt16(d) for d in encoded_amplitude)
+    tData = stg.Array[stg.UInt64]([stg.UInt64(int(d)) for d in duration_arr])
+    return pData, tData
+
+
+def bulk_prepare(amplitude_arr, duration_arr):
+    pData = stg.from_numpy(encode_amplitudes(amplitude_arr), stg.UInt16)
+    tData = stg.from_numpy(duration_arr, stg.UInt64)
+    return pData, tData
+
+
+def per_sample_ns(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1e9 / len(args[0])
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"backend: {stg.name}")
+    print(f"{'samples':>10}{'loop ns/sample':>16}{'bulk ns/sample':>16}")
+    for exponent in range(3, 8):
+        samples = 10 ** exponent
+        amplitudes = rng.integers(-4095, 4096, samples)
+        durations = rng.integers(20, 10_000, samples)
+        assert np.array_equal(decode_amplitudes(encode_amplitudes(amplitudes)), amplitudes)
+        # The element-wise path is too slow to be worth timing past 1e6
+        if samples <= 1_000_000:
+            loop = f"{per_sample_ns(legacy_prepare, amplitudes.tolist(), durations.tolist()):>16.1f}"
+        else:
+            loop = f"{'-':>16}"
+        print(f"{samples:>10}{loop}{per_sample_ns(bulk_prepare, amplitudes, durations):>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
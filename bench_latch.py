@@ -0,0 +1,73 @@
+import random
+import sys
+import time
+
+from gpio_pins import GpiozeroPins, MockPins, open_pins
+from switch_latch import SwitchLatcher
+
+# Time to latch a full 16-channel reconfiguration and a single-electrode
+# change through SwitchLatcher. It compares per-pin gpiozero writes (on
+# gpiozero's mock pin factory unless a bank is named) with masked bank writes
+# (the in-memory MockPins register by default). The LE pulse hold is left out
+# (le_pulse_us=0), so the numbers are pure write overhead.
+# Run with: python bench_latch.py [repeats] [bank]   e.g. bank=lgpio on a Pi
+
+OE_PIN = 22
+LE_PINS = [23, 24, 25, 27]
+SELECTOR_PINS = [[5, 6], [12, 13], [16, 17], [19, 26]]
+ALL_PINS = [OE_PIN] + LE_PINS + [pin for pair in SELECTOR_PINS for pin in pair]
+
+
+def gpiozero_mock_pins():
+    from gpiozero.pins.mock import MockFactory
+    return GpiozeroPins(ALL_PINS, pin_factory=MockFactory())
+
+
+def full_maps(count):
+    # Neighbouring maps differ in every group
+    rng = random.Random(0)
+    maps = []
+    for _ in range(count):
+        previous = maps[-1] if maps else ['F'] * 16
+        maps.append([rng.choice([state for state in 'FCAG' if state != old]) for old in previous])
+    return maps
+
+
+def one_channel_maps(count):
+    rng = random.Random(1)
+    channels = ['G'] * 16
+    maps = []
+    for _ in range(count):
+        channel = rng.randrange(16)
+        channels[channel] = rng.choice([state for state in 'FCAG' if state != channels[channel]])
+        maps.append(list(channels))
+    return maps
+
+
+def run(pins, maps):
+    """Return (microseconds, GPIO writes) per update."""
+    latcher = SwitchLatcher(OE_PIN, LE_PINS, SELECTOR_PINS, pins=pins, le_pulse_us=0)
+    latcher.apply(['F'] * 16)
+    writes = latcher.writes
+    start = time.perf_counter()
+    for channels in maps:
+        latcher.apply(channels)
+    elapsed = time.perf_counter() - start
+    latcher.close()
+    return elapsed / len(maps) * 1e6, (latcher.writes - writes) / len(maps)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    bank = sys.argv[2] if len(sys.argv) > 2 else None
+    banks = [("gpiozero mock", gpiozero_mock_pins),
+             (bank, lambda: open_pins(ALL_PINS, bank)) if bank else ("masked mock", lambda: MockPins(ALL_PINS))]
+    print(f"{'bank':>16}{'update':>14}{'us/update':>12}{'writes':>9}")
+    for label, maps in (("16 channels", full_maps(repeats)), ("1 channel", one_channel_maps(repeats))):
+        for name, make_pins in banks:
+            us, writes = run(make_pins(), maps)
+            print(f"{name:>16}{label:>14}{us:>12.1f}{writes:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import time
+import numpy as np
+
+from pulse_compiler import compile_pulse_train
+
+# Compares compile_pulse_train against the nested loop that
+# STGDeviceController.generate_stimulation_and_sync_data used to run.
+
+
+def legacy_pulse_train(config):
+    stim_amplitude_arr, stim_duration_arr = [], []
+    sync_amplitude_arr, sync_duration_arr = [], []
+    for train in range(config["total_trains"]):
+        sync_amplitude_arr.append(1)
+        sync_duration_arr.append(config["external_signal_dur_microseconds"])
+        for event in range(config["number_of_events"]):
+            if config["waveform"] == "Monophasic":
+                stim_amplitude_arr.append(config["amplitude_microamps"])
+                stim_duration_arr.append(config["pulse_duration_microseconds"])
+                if event < config["number_of_events"] - 1:
+                    stim_amplitude_arr.append(0)
+                    stim_duration_arr.append(config["duration_between_events_microseconds"])
+            if config["waveform"] == "Biphasic":
+                stim_amplitude_arr.append(config["amplitude_microamps"])
+                stim_duration_arr.append(config["pulse_duration_microseconds"])
+                stim_amplitude_arr.append(-config["amplitude_microamps"])
+                stim_duration_arr.append(config["pulse_duration_microseconds"])
+                if event < config["number_of_events"] - 1:
+                    stim_amplitude_arr.append(0)
+                    stim_duration_arr.append(config["duration_between_events_microseconds"])
+        if train < config["total_trains"] - 1:
+            if config["waveform"] == "Monophasic":
+                inter_train_delay = config["time_between_trains_microseconds"] - (config["number_of_events"]*config["pulse_duration_microseconds"]+(config["number_of_events"]-1)*config["duration_between_events_microseconds"])
+            if config["waveform"] == "Biphasic":
+                inter_train_delay = config["time_between_trains_microseconds"] - (config["number_of_events"]*config["pulse_duration_microseconds"]*2+(config["number_of_events"]-1)*config["duration_between_events_microseconds"])
+            sync_inter_train_delay = config["time_between_trains_microseconds"] - config["external_signal_dur_microseconds"]
+            if inter_train_delay > 0:
+                stim_amplitude_arr.append(0)
+                stim_duration_arr.append(inter_train_delay)
+            sync_amplitude_arr.append(0)
+            sync_duration_arr.append(sync_inter_train_delay)
+    return stim_amplitude_arr, stim_duration_arr, sync_amplitude_arr, sync_duration_arr
+
+
+def make_config(waveform, trains, events):
+    return {
+        "waveform": waveform,
+        "total_trains": trains,
+        "number_of_events": events,
+        "amplitude_microamps": 50000,
+        "pulse_duration_microseconds": 100,
+        "duration_between_events_microseconds": 400,
+        "time_between_trains_microseconds": 1000000,
+        "external_signal_dur_microseconds": 100,
+    }
+
+
+def best_of(fn, config, repeats=5):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(config)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'waveform':<11}{'trains':>8}{'events':>8}{'loop ms':>12}{'numpy ms':>12}{'speedup':>10}")
+    for waveform in ("Monophasic", "Biphasic"):
+        for trains in (1, 10, 100, 500):
+            for events in (1, 10, 100):
+                config = make_config(waveform, trains, events)
+                expected = legacy_pulse_train(config)
+                compiled = compile_pulse_train(config)
+                for want, got in zip(expected, compiled):
+                    assert np.array_equal(np.asarray(want, dtype=np.int64), got), (waveform, trains, events)
+                loop_s = best_of(legacy_pulse_train, config)
+                numpy_s = best_of(compile_pulse_train, config)
+                print(f"{waveform:<11}{trains:>8}{events:>8}{loop_s * 1e3:>12.3f}{numpy_s * 1e3:>12.3f}{loop_s / numpy_s:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import sys
+import time
+
+import numpy as np
+
+from protocol_cache import CompiledProtocol, normalize_config
+from protocol_validator import DURATION_QUANTUM_US
+from sine_synthesis import MAX_CYCLE_SEGMENTS, sine_cycle, sine_event
+
+# Segments, upload size and error of sampled sine protocols: the 20 us samples
+# of one cycle, the segments left after merging equal samples, what actually
+# gets uploaded after the repeat compression, and the largest deviation from
+# the ideal sine. Also checks that the longest period the GUI allows (1000 s)
+# is synthesized in bounded time and size.
+# Run with: python bench_sine_synthesis.py [number of trains]
+
+
+def make_config(frequency_hz, amplitude_ua, events, trains):
+    return normalize_config({
+        "waveform": "Sinusoidal",
+        "modulation_type_group": "Current",
+        "amplitude": amplitude_ua, "amplitude_unit": "uA",
+        "pulse_duration": 100, "pulse_duration_unit": "us",
+        "number_of_events": events,
+        "duration_between_events": 1, "duration_between_events_unit": "ms",
+        "period_frequency_type": "Frequency", "period_frequency_value": frequency_hz,
+        "total_trains": trains,
+        "train_duration": 200, "train_duration_unit": "s",
+        "accept_external_trigger": False,
+        "external_trigger_duration": 100, "external_trigger_duration_unit": "us",
+    })
+
+
+def max_error(config, amplitudes, durations):
+    # Compared every microsecond of the cycle against the ideal sine
+    period = int(np.sum(durations))
+    t = np.arange(period)
+    levels = np.repeat(amplitudes, durations)
+    return np.abs(levels - config["amplitude_microamps"] * np.sin(2 * np.pi * t / period)).max()
+
+
+def check_longest_period():
+    # Period widget maximum: 1000 s at 1 mA, current resolution
+    start = time.perf_counter()
+    amplitudes, durations = sine_cycle(1000000, 1e9, 8000)
+    seconds = time.perf_counter() - start
+    assert len(amplitudes) <= MAX_CYCLE_SEGMENTS, len(amplitudes)
+    assert int(np.sum(durations)) == 10 ** 9
+    assert seconds < 0.1, f"{seconds:.3f} s"
+    print(f"1000 s period: {len(amplitudes)} segments in {seconds * 1e3:.2f} ms")
+
+
+def main():
+    check_longest_period()
+    trains = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{'Hz':>6}{'uA':>7}{'events':>8}{'samples':>9}{'segments':>10}{'upload':>16}"
+          f"{'compile ms':>12}{'max err uA':>12}")
+    for frequency in (1, 10, 100, 1000):
+        for amplitude in (50, 1000):
+            for events in (1, 100):
+                config = make_config(frequency, amplitude, events, trains)
+                start = time.perf_counter()
+                protocol = CompiledProtocol(config)
+                segments = protocol.segments
+                compile_ms = (time.perf_counter() - start) * 1e3
+                amplitudes, durations = sine_event(config)
+                samples = -(-int(config["period_microseconds"]) // DURATION_QUANTUM_US)
+                upload = f"{len(segments.stim_amplitude)}x{segments.repeat}"
+                print(f"{frequency:>6}{amplitude:>7}{events:>8}{samples:>9}{len(amplitudes):>10}{upload:>16}"
+                      f"{compile_ms:>12.2f}{max_error(config, amplitudes, durations) / 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
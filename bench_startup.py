@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+
+# Cold-start cost of the GUI: `python -X importtime` for importing the module,
+# plus the time to construct DynamicStimGui, each in a fresh interpreter.
+# Fails if a deferred dependency is imported at startup or the total (import
+# plus DynamicStimGui()) is over budget.
+#
+# The budget is a regression guard, not the "well under a second" goal: a bare
+# `import panel` alone takes 0.9-1.6 s on the development machines, and every
+# widget of the window is a Panel widget, so that goal is not reachable with
+# Panel. The share of the total spent importing Panel is printed alongside.
+# Run with: python bench_startup.py [budget seconds]
+
+MODULE = "stg5_gui_with_channels_extended"
+DEFERRED = ("hvplot", "holoviews", "pandas", "pendulum", "serial", "clr")
+BUDGET_SECONDS = 2.5
+
+CONSTRUCT = f"""
+import sys
+import time
+start = time.perf_counter()
+import {MODULE} as gui_module
+imported = time.perf_counter()
+gui = gui_module.DynamicStimGui()
+built = time.perf_counter()
+print(",".join(name for name in {DEFERRED!r} if name in sys.modules) or "-")
+print(imported - start, built - imported)
+"""
+
+IMPORT_PANEL = """
+import time
+start = time.perf_counter()
+import panel
+print(time.perf_counter() - start)
+"""
+
+
+def run(args):
+    env = dict(os.environ, STG_BACKEND=os.environ.get('STG_BACKEND', 'simulated'))
+    return subprocess.run([sys.executable] + args, capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+
+def import_report():
+    """Return [(cumulative_us, self_us, module)] parsed from -X importtime."""
+    rows = []
+    for line in run(["-X", "importtime", "-c", f"import {MODULE}"]).stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), int(own), module.rstrip()))
+    return rows
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_SECONDS
+    rows = import_report()
+    # Direct imports of the GUI module are indented by one level under it
+    direct = sorted((row for row in rows if row[2].startswith("   ") and not row[2].startswith("     ")),
+                    reverse=True)
+    print(f"{'cumulative ms':>14}{'self ms':>10}  module")
+    for cumulative, own, module in direct[:15]:
+        print(f"{cumulative / 1e3:>14.1f}{own / 1e3:>10.1f}  {module.strip()}")
+
+    loaded = {module.strip().split(".")[0] for _, _, module in rows}
+
+    # Second interpreter so the timings are not skewed by -X importtime's own overhead,
+    # it also reports deferred modules pulled in while building the widgets
+    built_with, timings = run(["-c", CONSTRUCT]).stdout.splitlines()[-2:]
+    import_seconds, build_seconds = map(float, timings.split())
+    loaded.update(built_with.split(","))
+    eager = sorted(loaded.intersection(DEFERRED))
+    total = import_seconds + build_seconds
+    panel_seconds = float(run(["-c", IMPORT_PANEL]).stdout.split()[-1])
+    print(f"\nimport {import_seconds:.3f} s, DynamicStimGui() {build_seconds:.3f} s, "
+          f"total {total:.3f} s (budget {budget:.3f} s)")
+    print(f"of which import panel {panel_seconds:.3f} s, this module {total - panel_seconds:.3f} s")
+
+    failed = False
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+        failed = True
+    if total > budget:
+        print("FAIL: startup over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
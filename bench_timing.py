@@ -0,0 +1,69 @@
+import multiprocessing
+import sys
+import time
+
+from precise_timing import DEFAULT_GUARD_US, HybridTimer, JitterHistogram
+
+# Wake-up jitter and CPU cost of the delay strategies the switching scripts
+# can use: the old pure spin loop, plain time.sleep, and HybridTimer.
+# CPU % is process CPU time over wall time (100 % is one busy core).
+# Run with: python bench_timing.py [load processes] [samples per delay]
+# where the load processes spin on every core to mimic a busy machine.
+
+DELAYS_US = (100, 1000, 5000, 20000)
+
+
+def spin_until(deadline_ns):
+    while time.perf_counter_ns() < deadline_ns:
+        pass
+
+
+def os_sleep_until(deadline_ns):
+    time.sleep(max(0, deadline_ns - time.perf_counter_ns()) / 1e9)
+
+
+def measure(sleep_until, delay_us, samples):
+    histogram = JitterHistogram()
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(samples):
+        deadline = time.perf_counter_ns() + delay_us * 1000
+        sleep_until(deadline)
+        histogram.record(deadline, time.perf_counter_ns())
+    cpu_percent = 100 * (time.process_time() - cpu) / (time.perf_counter() - wall)
+    return histogram, cpu_percent
+
+
+def burn():
+    while True:
+        pass
+
+
+def main():
+    load = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    workers = [multiprocessing.Process(target=burn, daemon=True) for _ in range(load)]
+    for worker in workers:
+        worker.start()
+
+    hybrid = HybridTimer()
+    strategies = [("spin", spin_until), ("sleep", os_sleep_until),
+                  (f"hybrid {DEFAULT_GUARD_US}us", hybrid.sleep_until_ns)]
+    print(f"{load} load processes, {samples} samples per delay")
+    print(f"{'strategy':>14}{'delay us':>10}{'CPU %':>8}{'p50 us':>10}{'p99 us':>10}{'p999 us':>10}{'max us':>10}")
+    try:
+        for delay_us in DELAYS_US:
+            # Keep the long delays from taking minutes
+            count = max(20, min(samples, 2000000 // delay_us))
+            for name, sleep_until in strategies:
+                histogram, cpu_percent = measure(sleep_until, delay_us, count)
+                stats = histogram.summary()
+                print(f"{name:>14}{delay_us:>10}{cpu_percent:>8.1f}{stats['p50_us']:>10.1f}"
+                      f"{stats['p99_us']:>10.1f}{stats['p999_us']:>10.1f}{stats['max_us']:>10.1f}")
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+# Times the full STGDeviceController upload path against the simulated STG.
+# Run with: python bench_upload.py
+os.environ.setdefault('STG_BACKEND', 'simulated')
+
+from stg_backend import SimulatedStg200x
+from stg5_gui_with_channels_extended import STGDeviceController
+
+
+def make_settings(trains, events):
+    return {
+        "waveform": "Biphasic",
+        "modulation_type_group": "Current",
+        "amplitude": 50, "amplitude_unit": "uA",
+        "pulse_duration": 100, "pulse_duration_unit": "us",
+        "number_of_events": events,
+        "duration_between_events": 100, "duration_between_events_unit": "us",
+        "period_frequency_type": "Period", "period_frequency_value": 1,
+        "total_trains": trains,
+        "train_duration": 5, "train_duration_unit": "ms",
+        "accept_external_trigger": False,
+        "external_trigger_duration": 100, "external_trigger_duration_unit": "us",
+    }
+
+
+def settings_gui(settings):
+    # Just enough of DynamicStimGui for the controller to read settings and report progress
+    return SimpleNamespace(get_updated_data=lambda: dict(settings),
+                           schedule_progress_update=lambda progress: None)
+
+
+def main():
+    logging.getLogger("bench_upload").setLevel(logging.WARNING)
+    print(f"{'trains':>8}{'events':>8}{'calls':>8}{'bytes':>10}{'upload ms':>12}{'total ms':>12}")
+    for trains in (1, 10, 100, 1000):
+        for events in (1, 10):
+            controller = STGDeviceController(settings_gui(make_settings(trains, events)),
+                                             logging.getLogger("bench_upload"))
+            device = SimulatedStg200x(poll_interval=0)
+            start = time.perf_counter()
+            controller.configure_device_and_send_data(device)
+            total = time.perf_counter() - start
+            started = device.calls_named('SendStart')[-1].start
+            print(f"{trains:>8}{events:>8}{len(device.calls):>8}{device.bytes_sent:>10}"
+                  f"{(started - start) * 1e3:>12.2f}{total * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
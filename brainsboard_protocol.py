@@ -0,0 +1,143 @@
+import struct
+from collections import namedtuple
+
+# Binary frames for the BRAINSBoard switch firmware (brainsboard_serial_pgm.ino),
+# accepted alongside the ASCII "[0G1G...FG]" commands.
+#
+#   byte 0     FRAME_SYNC (0xA5, never part of an ASCII command)
+#   byte 1     frame type in the high nibble, flags in the low nibble
+#   bytes 2-5  channel map, uint32 little endian, 2 bits per channel,
+#              channel n in bits 2n..2n+1
+#   bytes 6-9  delay after applying in microseconds, uint32 little endian,
+#              only present with FLAG_DELAY
+#   last byte  CRC-8 (polynomial 0x07, init 0) over bytes 1 up to the CRC
+#
+# A 2-bit channel code is the (x, y) pair the firmware writes to the SP3T
+# selector pins, x in bit 0 and y in bit 1.
+#
+# The board answers a channel map (binary or ASCII) with a single ACK byte as
+# soon as it is latched, a bad frame with NAK, and a status request with a
+# FRAME_STATUS frame laid out the same way.
+
+FRAME_SYNC = 0xA5
+FRAME_CHANNEL_MAP = 0x10
+FRAME_SET_VERBOSITY = 0x20
+FRAME_STATUS_REQUEST = 0x30
+FRAME_STATUS = 0x40
+FRAME_SEQUENCE_CLEAR = 0x50
+FRAME_SEQUENCE_STEP = 0x60
+FRAME_SEQUENCE_RUN = 0x70
+FRAME_SEQUENCE_STOP = 0x80
+FLAG_DELAY = 0x01
+FLAG_EXTERNAL_TRIGGER = 0x01
+
+ACK = 0x06
+NAK = 0x15
+SEQUENCE_DONE = 0x04
+
+# Steps the board can hold for an uploaded switching sequence
+SEQUENCE_CAPACITY = 32
+
+# Firmware Serial chatter levels
+VERB_QUIET, VERB_ERRORS, VERB_STATE, VERB_TRACE = range(4)
+
+# channels, state machine state, verbosity, good frames, bad frames, last latch time (us)
+BoardStatus = namedtuple("BoardStatus", ["channels", "state", "verbosity", "frames_ok",
+                                         "frame_errors", "last_latch_us"])
+STATUS_FRAME_LENGTH = 17
+
+NUM_CHANNELS = 16
+CHANNEL_CODES = {'F': 0, 'C': 1, 'A': 2, 'G': 3}
+CHANNEL_LETTERS = 'FCAG'
+
+
+def crc8(data, crc=0):
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def pack_channel_map(channels):
+    """Pack 16 channel letters ('F', 'C', 'A', 'G') into a uint32."""
+    if len(channels) != NUM_CHANNELS:
+        raise ValueError(f"Expected {NUM_CHANNELS} channels, got {len(channels)}")
+    packed = 0
+    for number, letter in enumerate(channels):
+        packed |= CHANNEL_CODES[letter.upper()] << (2 * number)
+    return packed
+
+
+def unpack_channel_map(packed):
+    return [CHANNEL_LETTERS[(packed >> (2 * number)) & 0b11] for number in range(NUM_CHANNELS)]
+
+
+def encode_frame(kind, payload=b''):
+    body = bytes([kind]) + payload
+    return bytes([FRAME_SYNC]) + body + bytes([crc8(body)])
+
+
+def encode_channel_map_frame(channels, delay_us=None):
+    """Return the binary frame that switches all 16 channels, optionally followed by a delay."""
+    payload = struct.pack('<I', pack_channel_map(channels))
+    if delay_us is None:
+        return encode_frame(FRAME_CHANNEL_MAP, payload)
+    return encode_frame(FRAME_CHANNEL_MAP | FLAG_DELAY, payload + struct.pack('<I', int(delay_us)))
+
+
+def encode_verbosity_frame(level):
+    return encode_frame(FRAME_SET_VERBOSITY, bytes([level]))
+
+
+def encode_status_request():
+    return encode_frame(FRAME_STATUS_REQUEST)
+
+
+def encode_sequence_clear():
+    return encode_frame(FRAME_SEQUENCE_CLEAR)
+
+
+def encode_sequence_step(channels, dwell_us):
+    """One sequence step: latch `channels`, then hold them for dwell_us before the next step."""
+    return encode_frame(FRAME_SEQUENCE_STEP, struct.pack('<II', pack_channel_map(channels), int(dwell_us)))
+
+
+def encode_sequence_run(repeats=1, external_trigger=False):
+    """Run the uploaded steps `repeats` times (0 repeats until stopped)."""
+    flags = FLAG_EXTERNAL_TRIGGER if external_trigger else 0
+    return encode_frame(FRAME_SEQUENCE_RUN | flags, struct.pack('<H', repeats))
+
+
+def encode_sequence_stop():
+    return encode_frame(FRAME_SEQUENCE_STOP)
+
+
+def decode_status(frame):
+    """Parse a FRAME_STATUS reply into a BoardStatus."""
+    if len(frame) != STATUS_FRAME_LENGTH or frame[0] != FRAME_SYNC or frame[1] != FRAME_STATUS:
+        raise ValueError("Not a BRAINSBoard status frame")
+    if crc8(frame[1:-1]) != frame[-1]:
+        raise ValueError("BRAINSBoard status CRC mismatch")
+    packed, state, verbosity, frames_ok, frame_errors, last_latch_us = struct.unpack('<IBBHHI', frame[2:-1])
+    return BoardStatus(unpack_channel_map(packed), state, verbosity, frames_ok, frame_errors, last_latch_us)
+
+
+def decode_frame(frame):
+    """Inverse of encode_channel_map_frame: returns (channels, delay_us or None)."""
+    if len(frame) < 7 or frame[0] != FRAME_SYNC:
+        raise ValueError("Not a BRAINSBoard frame")
+    body, crc = frame[1:-1], frame[-1]
+    if crc8(body) != crc:
+        raise ValueError("BRAINSBoard frame CRC mismatch")
+    kind, flags = body[0] & 0xF0, body[0] & 0x0F
+    if kind != FRAME_CHANNEL_MAP or len(body) != (9 if flags & FLAG_DELAY else 5):
+        raise ValueError(f"Unsupported BRAINSBoard frame type 0x{body[0]:02X}")
+    channels = unpack_channel_map(struct.unpack_from('<I', body, 1)[0])
+    delay_us = struct.unpack_from('<I', body, 5)[0] if flags & FLAG_DELAY else None
+    return channels, delay_us
+
+
+def ascii_channel_map(channels):
+    """The equivalent ASCII command, e.g. '[0F1G2C...FA]'."""
+    return "[" + "".join(f"{number:X}{letter}" for number, letter in enumerate(channels)) + "]"
@@ -29,6 +29,44 @@
 #define STATE_EXECUTE_COMMAND 7
 #define STATE_SET_LOOP   8
 #define STATE_LOOP_EXECUTE 9
+#define STATE_GET_FRAME 10
+#define STATE_SEQUENCE_ARMED 11  // Sequence waiting for EXTERNAL_TRIGGER_PIN
+#define STATE_SEQUENCE_RUN   12
+
+// Binary channel map frames (see brainsboard_protocol.py):
+// 0xA5, type|flags, 4-byte packed channel map, [4-byte delay in us], CRC-8
+#define FRAME_SYNC         0xA5
+#define FRAME_CHANNEL_MAP  0x10
+#define FRAME_FLAG_DELAY   0x01
+#define FRAME_SET_VERBOSITY 0x20
+#define FRAME_STATUS_REQUEST 0x30
+#define FRAME_STATUS       0x40  // Sent back: map, state, verbosity, counters, last latch time
+#define FRAME_SEQUENCE_CLEAR 0x50
+#define FRAME_SEQUENCE_STEP  0x60  // 4-byte channel map, 4-byte dwell in us
+#define FRAME_SEQUENCE_RUN   0x70  // 2-byte repeat count (0 = until stopped)
+#define FRAME_SEQUENCE_STOP  0x80
+#define FRAME_FLAG_EXTERNAL_TRIGGER 0x01  // On FRAME_SEQUENCE_RUN: start on the trigger pin
+#define FRAME_MAX_LEN      10   // Everything after the sync byte
+#define FRAME_TIMEOUT_MS   50
+
+// One-byte replies: ACK once a channel map is latched (before any delay),
+// NAK for a frame that fails its CRC or has an unknown type
+#define ACK 0x06
+#define NAK 0x15
+#define SEQUENCE_DONE 0x04  // Sent when a sequence has run all its repeats
+
+// Uploaded switching sequence, an array of (map, dwell) steps played from slot 0
+#define SEQUENCE_CAPACITY 32
+
+// Serial chatter levels, set at compile time with -DVERBOSITY_DEFAULT=...
+// or at runtime with a FRAME_SET_VERBOSITY frame
+#define VERB_QUIET  0   // Nothing but ACK/NAK and status frames
+#define VERB_ERRORS 1   // Parse errors
+#define VERB_STATE  2   // State changes and the applied channel state
+#define VERB_TRACE  3   // Every received byte and pin write (the old output)
+#ifndef VERBOSITY_DEFAULT
+#define VERBOSITY_DEFAULT VERB_QUIET
+#endif
 
 // Pin definitions
 #define EXTERNAL_TRIGGER_PIN 2
@@ -43,6 +81,27 @@ char commandHistory[1000];
 int character_pos = 0;
 int current_state = STATE_IDLE;
 
+uint8_t frame_buf[FRAME_MAX_LEN];
+int frame_pos = 0;
+int frame_expected = 0;
+unsigned long frame_started = 0;
+uint8_t verbosity = VERBOSITY_DEFAULT;
+uint16_t frames_ok = 0;
+uint16_t frame_errors = 0;
+uint32_t last_latch_us = 0; // Time apply() took for the last channel map
+bool frame_active = false;
+
+struct SequenceStep {
+    uint32_t packed_map;
+    uint32_t dwell_us;
+};
+SequenceStep sequence[SEQUENCE_CAPACITY];
+int sequence_count = 0;
+int sequence_index = 0;   // Step to latch next
+uint16_t sequence_repeats = 0;
+uint16_t sequence_repeats_done = 0;
+unsigned long sequence_due = 0; // micros() deadline of the next step
+
 char channel_state[] = {'F','F','F','F','F','F','F','F','F','F','F','F','F','F','F','F'};
 int le_state[NUM_LE] = {1, 1, 1, 1};
 int le_gpio_pins[4] = {LE_0, LE_1, LE_2, LE_3} ; // Example GPIO pins, adjust as needed
@@ -100,6 +159,7 @@ void set_channel_state(int channel, Position pos) {
 
     digitalWrite(x, pos.x);
     digitalWrite(y, pos.y);
+    if (verbosity < VERB_TRACE) return;
     Serial.print("Setting Pin ");
     Serial.print(x);
     Serial.print(" to ");
@@ -118,8 +178,10 @@ void setup_and_latch(int gn) {
         set_channel_state(channel, pos);
     }
      // Activate and deactivate LE pin for the group with precise timing
+    if (verbosity >= VERB_TRACE) {
      Serial.print("Toggling LE pin: ");
      Serial.println(le_gpio_pins[gn]);
+    }
     digitalWrite(le_gpio_pins[gn], HIGH);
     delayMicroseconds(3);
     digitalWrite(le_gpio_pins[gn], LOW);
@@ -145,21 +207,26 @@ void setup() {
 int get_char() {
   if (Serial.available() > 0) {
     char ch = Serial.read();
-    Serial.print("GOT: ");
-    Serial.println(ch);
     commandHistory[character_pos] = ch;
     character_pos++;
-    Serial.println(commandHistory);
+    if (verbosity >= VERB_TRACE) {
+      Serial.print("GOT: ");
+      Serial.println(ch);
+      Serial.println(commandHistory);
+    }
     return ch;
   } else if (is_looping == true)
   {
-    Serial.println(character_pos);
     char ch = commandHistory[character_pos];
-    Serial.print("GOT: ");
-    Serial.println(ch);
+    if (verbosity >= VERB_TRACE) {
+      Serial.println(character_pos);
+      Serial.print("GOT: ");
+      Serial.println(ch);
+    }
     character_pos++;
     return ch;
   }
+  return -1; // No data available
 }
 
 void print_current_state() {
@@ -176,7 +243,8 @@ void set_channel_value(int n, char v) {
   le_state[gn] = 1;
 }
 
-void apply() {
+void latch() {
+  unsigned long started = micros();
   digitalWrite(OE, HIGH); // Disable output
   
   for (int gn = 0; gn < NUM_LE; gn++) {
@@ -187,7 +255,225 @@ void apply() {
     le_state[gn] = 0;
   }
   digitalWrite(OE, LOW); // Enable output
-  print_current_state();
+  last_latch_us = micros() - started;
+}
+
+void apply() {
+  latch();
+  Serial.write(ACK);
+  if (verbosity >= VERB_STATE) print_current_state();
+}
+
+void set_packed_map(uint32_t packed) {
+  static const char letters[4] = {'F', 'C', 'A', 'G'};
+  for (int n = 0; n < NUM_CHAN; n++) {
+    char v = letters[(packed >> (2 * n)) & 0x3];
+    if (channel_state[n] != v)
+      set_channel_value(n, v); // Only groups with a changed channel get latched
+  }
+}
+
+void write_u32(uint8_t *out, uint32_t value) {
+  for (int i = 0; i < 4; i++) out[i] = (value >> (8 * i)) & 0xFF;
+}
+
+uint32_t read_u32(const uint8_t *in) {
+  return (uint32_t)in[0] | ((uint32_t)in[1] << 8) | ((uint32_t)in[2] << 16) | ((uint32_t)in[3] << 24);
+}
+
+uint32_t packed_channel_map() {
+  uint32_t packed = 0;
+  for (int n = 0; n < NUM_CHAN; n++) {
+    Position pos = map_value_to_logic(toupper(channel_state[n]));
+    packed |= (uint32_t)((pos.x & 1) | ((pos.y & 1) << 1)) << (2 * n);
+  }
+  return packed;
+}
+
+uint8_t crc8(const uint8_t *data, int len) {
+  // CRC-8, polynomial 0x07, init 0
+  uint8_t crc = 0;
+  for (int i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (int bit = 0; bit < 8; bit++)
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+  }
+  return crc;
+}
+
+int frame_length(uint8_t type_flags) {
+  // Bytes after the sync byte: type, payload, CRC
+  switch (type_flags & 0xF0) {
+    case FRAME_CHANNEL_MAP:    return 1 + 4 + ((type_flags & FRAME_FLAG_DELAY) ? 4 : 0) + 1;
+    case FRAME_SET_VERBOSITY:  return 1 + 1 + 1;
+    case FRAME_STATUS_REQUEST: return 1 + 1;
+    case FRAME_SEQUENCE_CLEAR: return 1 + 1;
+    case FRAME_SEQUENCE_STEP:  return 1 + 4 + 4 + 1;
+    case FRAME_SEQUENCE_RUN:   return 1 + 2 + 1;
+    case FRAME_SEQUENCE_STOP:  return 1 + 1;
+    default:                   return -1;
+  }
+}
+
+void send_status() {
+  // FRAME_SYNC, FRAME_STATUS, map(4), state, verbosity, frames_ok(2), frame_errors(2), last_latch_us(4), CRC
+  uint8_t report[16];
+  report[0] = FRAME_SYNC;
+  report[1] = FRAME_STATUS;
+  write_u32(report + 2, packed_channel_map());
+  report[6] = current_state;
+  report[7] = verbosity;
+  report[8] = frames_ok & 0xFF;
+  report[9] = frames_ok >> 8;
+  report[10] = frame_errors & 0xFF;
+  report[11] = frame_errors >> 8;
+  write_u32(report + 12, last_latch_us);
+  uint8_t crc = crc8(report + 1, 15);
+  Serial.write(report, 16);
+  Serial.write(crc);
+}
+
+void long_delay_us(unsigned long us) {
+  // delayMicroseconds is only accurate up to 16383 us
+  delay(us / 1000);
+  delayMicroseconds(us % 1000);
+}
+
+bool sequence_active() {
+  return current_state == STATE_SEQUENCE_ARMED || current_state == STATE_SEQUENCE_RUN;
+}
+
+void start_sequence_timing() {
+  sequence_index = 0;
+  sequence_repeats_done = 0;
+  sequence_due = micros();
+  current_state = STATE_SEQUENCE_RUN;
+}
+
+void run_sequence_step() {
+  // Deadlines advance by the dwell times, so latch and loop latency do not accumulate
+  if ((long)(micros() - sequence_due) < 0)
+    return;
+  if (sequence_index == sequence_count) {
+    // The last step's dwell is over
+    sequence_index = 0;
+    sequence_repeats_done++;
+    if (sequence_repeats != 0 && sequence_repeats_done >= sequence_repeats) {
+      current_state = STATE_IDLE;
+      Serial.write(SEQUENCE_DONE);
+      return;
+    }
+  }
+  SequenceStep &step = sequence[sequence_index];
+  set_packed_map(step.packed_map);
+  latch();
+  sequence_due += step.dwell_us;
+  sequence_index++;
+}
+
+void handle_frame() {
+  if (crc8(frame_buf, frame_expected - 1) != frame_buf[frame_expected - 1]) {
+    frame_errors++;
+    Serial.write(NAK);
+    if (verbosity >= VERB_ERRORS) Serial.println("Frame CRC mismatch");
+    return;
+  }
+  uint8_t kind = frame_buf[0] & 0xF0;
+  if (sequence_active() && kind != FRAME_SEQUENCE_STOP && kind != FRAME_STATUS_REQUEST) {
+    // Nothing else may touch the switches while a sequence owns them
+    frame_errors++;
+    Serial.write(NAK);
+    return;
+  }
+  frames_ok++;
+  switch (kind) {
+    case FRAME_CHANNEL_MAP:
+    {
+      set_packed_map(read_u32(frame_buf + 1));
+      apply(); // Sends the ACK
+      if (frame_buf[0] & FRAME_FLAG_DELAY)
+        long_delay_us(read_u32(frame_buf + 5));
+      break;
+    }
+    case FRAME_SET_VERBOSITY:
+      verbosity = frame_buf[1];
+      Serial.write(ACK);
+      break;
+    case FRAME_STATUS_REQUEST:
+      send_status();
+      break;
+    case FRAME_SEQUENCE_CLEAR:
+      sequence_count = 0;
+      Serial.write(ACK);
+      break;
+    case FRAME_SEQUENCE_STEP:
+      if (sequence_count == SEQUENCE_CAPACITY) {
+        Serial.write(NAK);
+        break;
+      }
+      sequence[sequence_count] = {read_u32(frame_buf + 1), read_u32(frame_buf + 5)};
+      sequence_count++;
+      Serial.write(ACK);
+      break;
+    case FRAME_SEQUENCE_RUN:
+      if (sequence_count == 0) {
+        Serial.write(NAK);
+        break;
+      }
+      sequence_repeats = frame_buf[1] | (frame_buf[2] << 8);
+      Serial.write(ACK);
+      if (frame_buf[0] & FRAME_FLAG_EXTERNAL_TRIGGER)
+        current_state = STATE_SEQUENCE_ARMED;
+      else
+        start_sequence_timing();
+      break;
+    case FRAME_SEQUENCE_STOP:
+      if (sequence_active()) current_state = STATE_IDLE;
+      Serial.write(ACK);
+      break;
+  }
+}
+
+void discard_ascii() {
+  // ASCII commands are not accepted while a sequence runs
+  while (!frame_active && Serial.available() > 0 && Serial.peek() != FRAME_SYNC)
+    Serial.read();
+}
+
+bool poll_frame() {
+  // Feed waiting serial bytes into frame_buf without blocking, true once a whole frame is in
+  if (!frame_active) {
+    if (Serial.peek() != FRAME_SYNC)
+      return false;
+    Serial.read();
+    frame_active = true;
+    frame_pos = 0;
+    frame_expected = 1;
+    frame_started = millis();
+  }
+  while (Serial.available() > 0 && frame_pos < frame_expected) {
+    frame_buf[frame_pos++] = Serial.read();
+    if (frame_pos == 1) {
+      frame_expected = frame_length(frame_buf[0]);
+      if (frame_expected < 0) {
+        frame_errors++;
+        Serial.write(NAK);
+        frame_active = false;
+        return false;
+      }
+    }
+  }
+  if (frame_pos == frame_expected) {
+    frame_active = false;
+    return true;
+  }
+  if (millis() - frame_started > FRAME_TIMEOUT_MS) {
+    frame_errors++;
+    Serial.write(NAK);
+    if (verbosity >= VERB_ERRORS) Serial.println("Frame timed out");
+    frame_active = false;
+  }
+  return false;
 }
 
 
@@ -202,19 +488,23 @@ switch (current_state) {
   case STATE_IDLE:
   {
     //Serial.println("State Idle");
+    if (!is_looping && Serial.peek() == FRAME_SYNC) {
+      current_state = STATE_GET_FRAME;
+      break;
+    }
     c = get_char();
     if (c == 'l') {
-        Serial.println("Loop command detected.");
+        if (verbosity >= VERB_STATE) Serial.println("Loop command detected.");
         current_state = STATE_SET_LOOP;
     }
     else if (c == -1)
       break;
     else if (c == 'x') {
-      Serial.println("Reading!");
+      if (verbosity >= VERB_STATE) Serial.println("Reading!");
       current_state = STATE_EXTERNAL_WAIT;
       break;
     } else if (c == '[') {
-      Serial.println("Reading!");
+      if (verbosity >= VERB_STATE) Serial.println("Reading!");
       current_state = STATE_GET_CHAN_NUM;
       break;
     } else if (c == -1)
@@ -224,20 +514,20 @@ switch (current_state) {
   }
   case STATE_GET_CHAN_NUM:
   {
-    Serial.println("State Get Chan Num");
+    if (verbosity >= VERB_TRACE) Serial.println("State Get Chan Num");
     c = get_char();
     if (c == -1) {
-      Serial.println("Failed to get chan num");
+      if (verbosity >= VERB_TRACE) Serial.println("Failed to get chan num");
       break;
     } else if (c == ']') {
-      Serial.println("Headed to apply from CHAN NUM!");
+      if (verbosity >= VERB_STATE) Serial.println("Headed to apply from CHAN NUM!");
       current_state = STATE_APPLY;
       break;
     } else {
       current_chan_num = to_hex(c);
-      Serial.println(current_chan_num);
+      if (verbosity >= VERB_TRACE) Serial.println(current_chan_num);
       if (current_chan_num == -1) {
-        Serial.println("UH OH!");
+        if (verbosity >= VERB_ERRORS) Serial.println("UH OH!");
         current_state = STATE_IDLE;
         break;
       } else {
@@ -248,30 +538,30 @@ switch (current_state) {
 }
   case STATE_GET_CHAN_VALUE:
   {
-    Serial.println("State Get Chan Value");
+    if (verbosity >= VERB_TRACE) Serial.println("State Get Chan Value");
     c = get_char();
     if (c == -1)
       break;
     else if (c == ']') {
-      Serial.println("Headed to Apply from CHAN VALUE");
+      if (verbosity >= VERB_STATE) Serial.println("Headed to Apply from CHAN VALUE");
       current_state = STATE_APPLY;
       break;
     }
     int tf = is_channel_value(c);
     if (tf == 0) {
-      Serial.println("Uh oh at is_channel_value");
+      if (verbosity >= VERB_ERRORS) Serial.println("Uh oh at is_channel_value");
       current_state = STATE_IDLE;
       break;
     } else {
       set_channel_value(current_chan_num, c);
       current_state = STATE_GET_CHAN_NUM;
-      Serial.println(c);
+      if (verbosity >= VERB_TRACE) Serial.println(c);
       break;
     }
   }
   case STATE_APPLY:
   {
-    Serial.println("State Apply");
+    if (verbosity >= VERB_STATE) Serial.println("State Apply");
     apply();
     current_state = STATE_SET_DELAY; // Move to the new state to set delay
     delayDuration = 0; // Reset delay duration
@@ -287,7 +577,7 @@ switch (current_state) {
           delayMicroseconds(1);
       }
       while (digitalRead(EXTERNAL_TRIGGER_PIN) == HIGH && trig_started == false){
-          Serial.println("External trigger received, continuing...");
+          if (verbosity >= VERB_STATE) Serial.println("External trigger received, continuing...");
           trig_started = true;
           current_state = STATE_APPLY;
       }
@@ -297,7 +587,7 @@ switch (current_state) {
   }
   case STATE_SET_DELAY:
   {
-    Serial.println("State Set Delay");
+    if (verbosity >= VERB_TRACE) Serial.println("State Set Delay");
     if (c == '\0') {
         c = get_char(); // Get the next character if we need to start processing delay
     }
@@ -320,18 +610,24 @@ switch (current_state) {
         delayUnit = c; // Set the correct delay unit
         // Apply the delay based on the unit
         if (delayUnit == 's'){
-            Serial.println(delayDuration);
-            Serial.print(' s Delay');
+            if (verbosity >= VERB_STATE) {
+              Serial.println(delayDuration);
+              Serial.print(" s Delay");
+            }
             delay(delayDuration * 1000);
         }
         else if (delayUnit == 'm'){
-            Serial.println(delayDuration);
-            Serial.print(' ms Delay');
+            if (verbosity >= VERB_STATE) {
+              Serial.println(delayDuration);
+              Serial.print(" ms Delay");
+            }
             delay(delayDuration);
         }
         else if (delayUnit == 'u'){
-            Serial.println(delayDuration);
-            Serial.print(' u Delay');
+            if (verbosity >= VERB_STATE) {
+              Serial.println(delayDuration);
+              Serial.print(" u Delay");
+            }
             delayMicroseconds(delayDuration);
         }
         current_state = STATE_IDLE; // Delay has been applied, go back to idle
@@ -345,8 +641,10 @@ switch (current_state) {
   }
   case STATE_ERROR:
   {
-    Serial.print("ERROR got unexpected character");
-    Serial.println(c);
+    if (verbosity >= VERB_ERRORS) {
+      Serial.print("ERROR got unexpected character");
+      Serial.println(c);
+    }
     c = get_char();
     current_state = STATE_IDLE;
     break;
@@ -358,15 +656,17 @@ switch (current_state) {
     if (isdigit(c)) {
         loops_number = (loops_number == -1 ? 0 : loops_number) * 10 + (c - '0');
         bool number_given = true;
-        Serial.print("Number of Loops: ");
-        Serial.println(loops_number);
+        if (verbosity >= VERB_STATE) {
+          Serial.print("Number of Loops: ");
+          Serial.println(loops_number);
+        }
     } else if ((c == 'l' || c == '\0') && number_given == true) {
         loops_number = -1; // Set infinite loop on 'l' or no input
-        Serial.print("Infinite loop set.");
+        if (verbosity >= VERB_STATE) Serial.print("Infinite loop set.");
         current_state = STATE_LOOP_EXECUTE;
     } else {
         is_looping = true;
-        Serial.println("Starting loop execution.");
+        if (verbosity >= VERB_STATE) Serial.println("Starting loop execution.");
         current_state = STATE_LOOP_EXECUTE;
     }
     break;
@@ -375,13 +675,17 @@ switch (current_state) {
   case STATE_LOOP_EXECUTE:
   {
       if (is_looping) {
-          Serial.println("Replaying commands:");
-          Serial.println(commandHistory);  // Print the entire command history
+          if (verbosity >= VERB_TRACE) {
+            Serial.println("Replaying commands:");
+            Serial.println(commandHistory);  // Print the entire command history
+          }
 
           if (loops_number > 0) {  // Decrement loop count if not infinite
               loops_number--;
-              Serial.print("Loops remaining: ");
-              Serial.println(loops_number);
+              if (verbosity >= VERB_STATE) {
+                Serial.print("Loops remaining: ");
+                Serial.println(loops_number);
+              }
               if (loops_number == 0) {  // Check if loops are finished
                   is_looping = false;
                   for (int i = 0; i < 50; i++) {  // Clear command history
@@ -396,12 +700,42 @@ switch (current_state) {
           current_state = STATE_IDLE;  // Ensure the state returns to IDLE if not looping
       }
       break;
+  }
+  case STATE_GET_FRAME:
+  {
+    // Collect the rest of a binary frame without blocking the loop
+    if (poll_frame()) {
+      current_state = STATE_IDLE;
+      handle_frame(); // May start a sequence
+    } else if (!frame_active) {
+      current_state = STATE_IDLE;
+    }
+    break;
+  }
+  case STATE_SEQUENCE_ARMED:
+  {
+    discard_ascii();
+    if (digitalRead(EXTERNAL_TRIGGER_PIN) == HIGH)
+      start_sequence_timing();
+    else if (poll_frame())
+      handle_frame(); // Only STOP and status requests are accepted here
+    break;
+  }
+  case STATE_SEQUENCE_RUN:
+  {
+    run_sequence_step();
+    discard_ascii();
+    if (current_state == STATE_SEQUENCE_RUN && poll_frame())
+      handle_frame();
+    break;
   }
     // other states as necessary
   default:
   {
-    Serial.print("Unknown state");
-    Serial.println(current_state);
+    if (verbosity >= VERB_ERRORS) {
+      Serial.print("Unknown state");
+      Serial.println(current_state);
+    }
   }
 }
 }
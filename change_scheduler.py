@@ -0,0 +1,74 @@
+import threading
+
+# Central scheduler for the GUI's widget watchers. Each widget parameter gets
+# a single param watcher however many recompute callbacks depend on it, and a
+# burst of changes (dragging a slider, loading a settings file) marks the
+# callbacks dirty and runs each of them once when the debounce window closes.
+
+
+def timer_call_later(delay_ms, callback):
+    timer = threading.Timer(delay_ms / 1000, callback)
+    timer.daemon = True
+    timer.start()
+
+
+class ChangeScheduler:
+    def __init__(self, delay_ms=50, call_later=timer_call_later):
+        self.delay_ms = delay_ms
+        self.call_later = call_later
+        self.requests = 0  # Changes that asked for a recompute
+        self.runs = 0      # Recomputes actually run
+        self._callbacks = {}  # (widget id, parameter) -> callbacks, in registration order
+        self._watchers = {}
+        self._dirty = []
+        self._pending = False
+        self._lock = threading.Lock()
+
+    @property
+    def skipped(self):
+        """Requests coalesced into a recompute that was already pending."""
+        return self.requests - self.runs - len(self._dirty)
+
+    def watch(self, widget, callback, parameter='value'):
+        """Recompute `callback` after changes to `widget.<parameter>`. Returns False if already watched."""
+        key = (id(widget), parameter)
+        callbacks = self._callbacks.setdefault(key, [])
+        if callback in callbacks:
+            return False
+        callbacks.append(callback)
+        if key not in self._watchers:
+            self._watchers[key] = widget.param.watch(lambda event: self._changed(key), parameter)
+        return True
+
+    def watch_all(self, widgets, callbacks, parameter='value'):
+        for widget in widgets:
+            for callback in callbacks:
+                self.watch(widget, callback, parameter)
+
+    def _changed(self, key):
+        for callback in self._callbacks[key]:
+            self.request(callback)
+
+    def request(self, callback):
+        """Mark `callback` dirty and schedule a flush at the end of the debounce window."""
+        with self._lock:
+            self.requests += 1
+            if callback not in self._dirty:
+                self._dirty.append(callback)
+            if self._pending:
+                return
+            self._pending = True
+        self.call_later(self.delay_ms, self.flush)
+
+    def flush(self):
+        """Run every dirty callback once."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, []
+            self._pending = False
+        for callback in dirty:
+            self.runs += 1
+            callback()
+
+    def stats(self):
+        return {'requests': self.requests, 'runs': self.runs, 'skipped': self.skipped,
+                'watchers': len(self._watchers)}
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+import numpy as np
+
+from pulse_compiler import compile_train_block
+
+# Streaming writer for MC_Stimulus II ASCII import (.dat) files.
+# Each channel is described by a few fixed leading rows plus one block of
+# segments repeated `repeat` times. The block is formatted once and written
+# repeatedly in large chunks, so memory stays constant however many trains
+# the protocol has.
+
+DAT_HEADER = "Multi Channel Systems MC_Stimulus II\nASCII import Version 1.10\n\n"
+ROW_HEADER = "pulse\tvalue\tvalue\ttime\n"
+
+# Channels 1-8 are the stimulation outputs, 9-16 the sync outputs
+NUM_CHANNELS = 16
+
+DatChannel = namedtuple("DatChannel", ["prefix", "values", "durations", "repeat"])
+
+# Fixed leading rows: a 5050 us start delay on the stimulation channel and sync 1,
+# and the 5000 us start marker on sync 2
+START_DELAY = [(0.0, 5050)]
+START_MARKER = [(1.0, 5000), (0.0, 50)]
+
+
+def collapse_rows(values, durations):
+    """Merge neighbouring rows with equal values and drop zero-length rows."""
+    values = np.asarray(values, dtype=np.float64)
+    durations = np.asarray(durations, dtype=np.int64)
+    keep = durations != 0
+    values, durations = values[keep], durations[keep]
+    if len(values) == 0:
+        return values, durations
+    starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+    return values[starts], np.add.reduceat(durations, starts)
+
+
+def format_rows(values, durations):
+    return "".join(f"0\t0.000\t{value:.3f}\t{duration}\n" for value, duration in zip(values.tolist(), durations.tolist()))
+
+
+def channel_chunks(channel, chunk_bytes=1 << 20, collapse=True):
+    """Yield the text of one channel's rows in chunks of roughly `chunk_bytes`."""
+    if channel.prefix:
+        prefix_values, prefix_durations = zip(*channel.prefix)
+        yield format_rows(np.asarray(prefix_values, dtype=np.float64), np.asarray(prefix_durations, dtype=np.int64))
+    if channel.repeat == 0 or len(channel.values) == 0:
+        return
+    if collapse:
+        values, durations = collapse_rows(channel.values, channel.durations)
+    else:
+        values, durations = np.asarray(channel.values, dtype=np.float64), np.asarray(channel.durations)
+    block = format_rows(values, durations)
+    if not block:
+        return
+    per_chunk = max(1, chunk_bytes // len(block))
+    chunk = block * min(per_chunk, channel.repeat)
+    full_chunks, remainder = divmod(channel.repeat, per_chunk)
+    for _ in range(full_chunks):
+        yield chunk
+    if remainder:
+        yield block * remainder
+
+
+def dat_channels(config):
+    """Channel 1 stimulation and sync 1/2 rows for a channel_data() config."""
+    stim_amplitude, stim_duration, sync_amplitude, sync_duration = compile_train_block(config)
+    trains = int(config["total_trains"])
+    return {
+        1: DatChannel(START_DELAY, stim_amplitude, stim_duration, trains),
+        9: DatChannel(START_DELAY, sync_amplitude, sync_duration, trains),
+        10: DatChannel(START_MARKER, [], [], 0),
+    }
+
+
+def write_dat_file(file_path, channels, output_mode, chunk_bytes=1 << 20, collapse=True):
+    """Write `channels` (channel number -> DatChannel) as an MC_Stimulus II .dat file."""
+    with open(file_path, 'w', buffering=chunk_bytes) as file:
+        file.write(DAT_HEADER)
+        file.write(f"channels:\t{NUM_CHANNELS // 2}\n")
+        file.write(f"output mode:\t{output_mode}\n")
+        file.write("format:\t5\n\n")
+        for number in range(1, NUM_CHANNELS + 1):
+            file.write(f"channel: {number}\n")
+            file.write(ROW_HEADER)
+            channel = channels.get(number)
+            if channel is not None:
+                for chunk in channel_chunks(channel, chunk_bytes, collapse):
+                    file.write(chunk)
+            file.write("\n")  # Add an empty line after each channel's data
@@ -0,0 +1,137 @@
+import io
+import re
+from collections import namedtuple
+from functools import cached_property
+
+import numpy as np
+
+from dat_export import START_DELAY, DatChannel, collapse_rows
+from protocol_cache import CompiledProtocol, config_key
+from protocol_timeline import SegmentTimeline
+
+# Reader for MC_Stimulus II ASCII import (.dat) files, the inverse of
+# dat_export.write_dat_file. The file is read in one go and each channel's
+# table is converted to numbers by a single np.loadtxt call on the whole
+# block, instead of a Python loop per row.
+
+# channels maps channel number -> (values, durations), the third and fourth table columns,
+# zero_rows maps channel number -> number of zero-length rows in its table,
+# warnings lists what a lenient read let through
+DatFile = namedtuple("DatFile", ["output_mode", "format", "channels", "zero_rows", "warnings"])
+
+CHANNEL_HEADER = re.compile(r"channel:\s*(\d+)[ \t]*\r?\n(?:pulse\s+value\s+value\s+time[ \t]*\r?\n)?")
+HEADER_FIELD = re.compile(r"^(channels|output mode|format):\s*(.+?)\s*$", re.M)
+
+
+def parse_rows(text):
+    """(values, durations) of a `pulse value value time` table body."""
+    if not text.strip():
+        return np.empty(0), np.empty(0, dtype=np.int64)
+    rows = np.loadtxt(io.StringIO(text), usecols=(2, 3), ndmin=2)
+    return np.ascontiguousarray(rows[:, 0]), np.rint(rows[:, 1]).astype(np.int64)
+
+
+def channel_headers(text):
+    # str.find skips through the number tables far faster than a multiline regex scan
+    position = text.find("channel:")
+    while position != -1:
+        match = CHANNEL_HEADER.match(text, position)
+        if match and (position == 0 or text[position - 1] == "\n"):
+            yield match
+        position = text.find("channel:", position + 1)
+
+
+def read_dat_file(file_path, strict=True):
+    """Parse an MC_Stimulus II .dat file into a DatFile of NumPy arrays.
+
+    Rows with negative durations raise ValueError, or with strict=False are
+    kept and described in `warnings`, so older files can still be inspected.
+    """
+    with open(file_path) as file:
+        text = file.read()
+    headers = list(channel_headers(text))
+    if not headers:
+        raise ValueError(f"{file_path} has no channel tables")
+    fields = dict(HEADER_FIELD.findall(text, 0, headers[0].start()))
+    channels = {}
+    zero_rows = {}
+    warnings = []
+    for header, following in zip(headers, headers[1:] + [None]):
+        end = following.start() if following is not None else len(text)
+        number = int(header.group(1))
+        values, durations = parse_rows(text[header.end():end])
+        negative = np.flatnonzero(durations < 0)
+        if len(negative):
+            message = (f"{file_path}: channel {number} row {negative[0] + 1} has a negative duration "
+                       f"of {durations[negative[0]]} us ({len(negative)} such rows)")
+            if strict:
+                raise ValueError(message)
+            warnings.append(message)
+        channels[number] = values, durations
+        zeros = int(np.count_nonzero(durations == 0))
+        if zeros:
+            zero_rows[number] = zeros
+    return DatFile(fields.get('output mode', 'voltage'), int(fields.get('format', 5)), channels, zero_rows, warnings)
+
+
+def _strip(values, durations, prefix):
+    # Drop the fixed leading rows written by dat_export and the final rest,
+    # the output sits at 0 before and after the protocol anyway
+    if len(values) >= len(prefix) and all(
+            values[row] == value and durations[row] == duration for row, (value, duration) in enumerate(prefix)):
+        values, durations = values[len(prefix):], durations[len(prefix):]
+    values, durations = collapse_rows(values, durations)
+    last = len(values)
+    while last and values[last - 1] == 0:
+        last -= 1
+    return values[:last], durations[:last]
+
+
+class LoadedProtocol(CompiledProtocol):
+    """A protocol read back from a .dat file, usable wherever a CompiledProtocol is.
+
+    Channel 1 is the stimulation output and channel 9 the sync output, as
+    written by dat_export. The config only carries what the upload needs.
+    The STG cannot play zero-length rows, so they are left out of `arrays`
+    (`dat.zero_rows` counts them); `dat_channels` keeps every row, write it
+    with collapse=False for an exact copy of the file. Rows a lenient read let
+    through (`dat.warnings`) stay in `arrays`, protocol_validator refuses them
+    before an upload.
+    """
+
+    def __init__(self, dat, source=None):
+        self.dat = dat
+        self.source = source
+        config = {"modulation_type_group": 'Current' if dat.output_mode == 'current' else 'Voltage',
+                  "source": str(source)}
+        super().__init__(config, config_key(config))
+
+    @cached_property
+    def arrays(self):
+        empty = (np.empty(0), np.empty(0, dtype=np.int64))
+        stim_values, stim_durations = _strip(*self.dat.channels.get(1, empty), START_DELAY)
+        sync_values, sync_durations = _strip(*self.dat.channels.get(9, empty), START_DELAY)
+        arrays = (np.rint(stim_values).astype(np.int64), stim_durations,
+                  np.rint(sync_values).astype(np.int64), sync_durations)
+        for array in arrays:
+            array.flags.writeable = False
+        return arrays
+
+    @cached_property
+    def train_block(self):
+        # No train structure in a file, the whole protocol is one block
+        return self.arrays
+
+    @cached_property
+    def timeline(self):
+        return SegmentTimeline(*self.arrays)
+
+    @cached_property
+    def dat_channels(self):
+        return {number: DatChannel([], values, durations, 1) for number, (values, durations) in self.dat.channels.items()
+                if len(values)}
+
+
+def load_dat_protocol(file_path, strict=False):
+    """LoadedProtocol of a .dat file, leniently read by default so any file can be inspected."""
+    return LoadedProtocol(read_dat_file(file_path, strict), file_path)
@@ -0,0 +1,27 @@
+import numpy as np
+
+# STG channel data words: bit 15 is the sign, bits 0-11 the magnitude in steps
+# of the output's resolution (GetCurrentResolutionInNanoAmp or
+# GetVoltageResolutionInMicroVolt).
+
+AMPLITUDE_MASK = 0xFFF
+
+
+def amplitude_steps(amplitudes, resolution=1):
+    """Magnitudes of `amplitudes` (nA or uV) in device resolution steps, before masking."""
+    amplitudes = np.asarray(amplitudes, dtype=np.int64)
+    return np.rint(np.abs(amplitudes) / max(1, int(resolution))).astype(np.int64)
+
+
+def encode_amplitudes(amplitudes, resolution=1):
+    """Pack signed amplitudes into sign-bit + 12-bit magnitude uint16 words."""
+    amplitudes = np.asarray(amplitudes, dtype=np.int64)
+    encoded = (amplitude_steps(amplitudes, resolution) & AMPLITUDE_MASK).astype(np.uint16)
+    encoded[amplitudes < 0] |= np.uint16(1 << 15)
+    return encoded
+
+
+def decode_amplitudes(encoded, resolution=1):
+    encoded = np.asarray(encoded, dtype=np.uint16)
+    magnitude = (encoded & AMPLITUDE_MASK).astype(np.int64) * max(1, int(resolution))
+    return np.where(encoded & (1 << 15), -magnitude, magnitude)
@@ -1,14 +1,14 @@
 import serial
 import time
 
+from precise_timing import precise_sleep_ms
+
 serial_port = '/dev/cu.usbmodem143401'
 baud_rate = 115200 
 arduino = serial.Serial(serial_port, baud_rate, timeout=1)
 
-def precise_sleep(delay):
-    target = time.perf_counter_ns() + delay * 1000000
-    while time.perf_counter_ns() < target:
-        pass
+# Delays here are in milliseconds
+precise_sleep = precise_sleep_ms
 
 def send_command(command, delay):
     """Send a command to the Arduino and wait for a specified delay."""
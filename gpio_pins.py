@@ -0,0 +1,119 @@
+import os
+
+# Output pin banks for switch_latch. write({pin: level, ...}) sets any number
+# of the bank's pins and returns how many GPIO writes that took.
+#   SWITCH_GPIO=gpiozero  (default) one DigitalOutputDevice per pin, one call per pin
+#   SWITCH_GPIO=lgpio     the pins claimed as one lgpio group, each call is a
+#                         single masked group_write
+#   SWITCH_GPIO=pigpio    pigpiod bank 1, a set_bank_1 and/or clear_bank_1 mask per call
+#   SWITCH_GPIO=mock      in-memory register with the lgpio semantics, runs anywhere
+# GPIOZERO_PIN_FACTORY still picks the pin library under the gpiozero bank,
+# and GPIOZERO_PIN_FACTORY=mock runs it without a Pi.
+
+
+def open_pins(pins, name=None):
+    name = name or os.environ.get('SWITCH_GPIO', 'gpiozero')
+    if name == 'gpiozero':
+        return GpiozeroPins(pins)
+    if name == 'lgpio':
+        return LgpioPins(pins)
+    if name == 'pigpio':
+        return PigpioPins(pins)
+    if name == 'mock':
+        return MockPins(pins)
+    raise ValueError(f"Unknown SWITCH_GPIO {name!r}, expected 'gpiozero', 'lgpio', 'pigpio' or 'mock'")
+
+
+class GpiozeroPins:
+    def __init__(self, pins, pin_factory=None):
+        import gpiozero
+        self.devices = {pin: gpiozero.DigitalOutputDevice(pin, pin_factory=pin_factory) for pin in pins}
+
+    def write(self, levels):
+        for pin, level in levels.items():
+            self.devices[pin].on() if level else self.devices[pin].off()
+        return len(levels)
+
+    def close(self):
+        for device in self.devices.values():
+            device.close()
+
+
+def mask_bits(bit_of_pin, levels):
+    """(bits, mask) for setting `levels` on pins at the given bit positions."""
+    bits = mask = 0
+    for pin, level in levels.items():
+        mask |= 1 << bit_of_pin[pin]
+        if level:
+            bits |= 1 << bit_of_pin[pin]
+    return bits, mask
+
+
+class LgpioPins:
+    def __init__(self, pins, chip=0):
+        import lgpio
+        self.lgpio = lgpio
+        self.pins = list(pins)
+        self.bit_of_pin = {pin: bit for bit, pin in enumerate(self.pins)}  # bits follow the group order
+        self.handle = lgpio.gpiochip_open(chip)
+        lgpio.group_claim_output(self.handle, self.pins)
+
+    def write(self, levels):
+        if not levels:
+            return 0
+        bits, mask = mask_bits(self.bit_of_pin, levels)
+        self.lgpio.group_write(self.handle, self.pins[0], bits, mask)
+        return 1
+
+    def close(self):
+        self.lgpio.group_free(self.handle, self.pins[0])
+        self.lgpio.gpiochip_close(self.handle)
+
+
+class PigpioPins:
+    def __init__(self, pins, host=None):
+        import pigpio
+        self.pi = pigpio.pi(host) if host else pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("Could not connect to pigpiod, is it running?")
+        self.bit_of_pin = {pin: pin for pin in pins}  # bank 1 is GPIO 0-31 by number
+        for pin in pins:
+            self.pi.set_mode(pin, pigpio.OUTPUT)
+
+    def write(self, levels):
+        bits, mask = mask_bits(self.bit_of_pin, levels)
+        writes = 0
+        if bits:
+            self.pi.set_bank_1(bits)
+            writes += 1
+        if mask & ~bits:
+            self.pi.clear_bank_1(mask & ~bits)
+            writes += 1
+        return writes
+
+    def close(self):
+        self.pi.stop()
+
+
+class MockPins:
+    """Stand-in for LgpioPins that keeps the register in memory and logs every masked write."""
+
+    def __init__(self, pins):
+        self.pins = list(pins)
+        self.bit_of_pin = {pin: bit for bit, pin in enumerate(self.pins)}
+        self.register = 0
+        self.history = []  # (bits, mask) per write
+
+    def write(self, levels):
+        if not levels:
+            return 0
+        bits, mask = mask_bits(self.bit_of_pin, levels)
+        self.register = (self.register & ~mask) | bits
+        self.history.append((bits, mask))
+        return 1
+
+    def level(self, pin):
+        return (self.register >> self.bit_of_pin[pin]) & 1
+
+    def close(self):
+        pass
@@ -0,0 +1,90 @@
+import bisect
+import os
+import sys
+import time
+
+# Delays for the switching scripts. A plain busy loop on perf_counter_ns is
+# accurate but burns a whole core for the full delay, so HybridTimer lets the
+# OS sleep until a guard band before the deadline and only spins through the
+# guard band. Every sleep records how late it woke up in a JitterHistogram.
+#
+# The guard band has to cover the OS's sleep overshoot: tens of microseconds
+# on an idle Linux box, up to a scheduler tick (about 15 ms) on Windows.
+# PRECISE_SLEEP_GUARD_US overrides the default.
+
+DEFAULT_GUARD_US = int(os.environ.get('PRECISE_SLEEP_GUARD_US', 2000 if sys.platform == 'win32' else 500))
+
+
+class JitterHistogram:
+    """Counts of achieved minus requested wake-up time, in resolution_ns wide bins."""
+
+    def __init__(self, resolution_ns=1000):
+        self.resolution_ns = resolution_ns
+        self.counts = {}  # bin -> samples; bin * resolution_ns is the lower edge
+        self.count = 0
+        self.worst_ns = 0
+
+    def record(self, requested_ns, achieved_ns):
+        deviation = achieved_ns - requested_ns
+        self.counts[deviation // self.resolution_ns] = self.counts.get(deviation // self.resolution_ns, 0) + 1
+        self.count += 1
+        self.worst_ns = max(self.worst_ns, deviation)
+
+    def percentile(self, q):
+        """Deviation in ns that q percent of the samples stay under (upper bin edge)."""
+        if not self.count:
+            return 0
+        bins = sorted(self.counts)
+        cumulative = []
+        total = 0
+        for key in bins:
+            total += self.counts[key]
+            cumulative.append(total)
+        index = bisect.bisect_left(cumulative, q / 100 * self.count)
+        return (bins[min(index, len(bins) - 1)] + 1) * self.resolution_ns
+
+    def summary(self):
+        return {'count': self.count, 'p50_us': self.percentile(50) / 1e3, 'p99_us': self.percentile(99) / 1e3,
+                'p999_us': self.percentile(99.9) / 1e3, 'max_us': self.worst_ns / 1e3}
+
+    def clear(self):
+        self.counts.clear()
+        self.count = 0
+        self.worst_ns = 0
+
+
+class HybridTimer:
+    def __init__(self, guard_us=DEFAULT_GUARD_US, histogram=None):
+        self.guard_ns = int(guard_us * 1000)
+        self.histogram = histogram if histogram is not None else JitterHistogram()
+
+    def sleep_until_ns(self, deadline_ns):
+        """Return at perf_counter_ns() == deadline_ns, sleeping while more than the guard band is left."""
+        remaining = deadline_ns - time.perf_counter_ns()
+        # time.sleep may wake early, so keep going until inside the guard band
+        while remaining > self.guard_ns:
+            time.sleep((remaining - self.guard_ns) / 1e9)
+            remaining = deadline_ns - time.perf_counter_ns()
+        now = time.perf_counter_ns()
+        while now < deadline_ns:
+            now = time.perf_counter_ns()
+        self.histogram.record(deadline_ns, now)
+        return now
+
+    def sleep_us(self, delay):
+        return self.sleep_until_ns(time.perf_counter_ns() + int(delay * 1000))
+
+    def sleep_ms(self, delay):
+        return self.sleep_until_ns(time.perf_counter_ns() + int(delay * 1000000))
+
+
+# Shared by the scripts; default_timer.histogram collects their jitter
+default_timer = HybridTimer()
+
+
+def precise_sleep_us(delay):
+    default_timer.sleep_us(delay)
+
+
+def precise_sleep_ms(delay):
+    default_timer.sleep_ms(delay)
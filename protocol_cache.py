@@ -0,0 +1,155 @@
+import hashlib
+import json
+from collections import OrderedDict
+from functools import cached_property
+
+from dat_export import dat_channels
+from protocol_timeline import Timeline
+from pulse_compiler import compile_pulse_train, compile_train_block
+from segment_compressor import compress_segments
+from step_plot import step_breakpoints
+
+# One compiled protocol per parameter set, shared by the plots, the .dat
+# export, CSV logging and the device upload. Protocols are keyed by a hash of
+# the unit-converted fields the compiler reads (protocol_config) and kept in a
+# small LRU so flipping between settings does not recompile either.
+
+UNIT_CONVERSION_FACTORS = {
+    'us': 1, 'ms': 1000, 's': 1000000,
+    'uA': 1000, 'mA': 1000000, 'A': 1000000000,
+    'uV': 1, 'mV': 1000, 'V': 1000000,
+}
+
+
+def convert_to_micro(value, unit_type):
+    return value * UNIT_CONVERSION_FACTORS.get(unit_type, 1)
+
+
+def normalize_config(settings):
+    """Add the unit-converted fields used by the compiler to a get_updated_data() dict."""
+    config = dict(settings)
+    config["amplitude_microamps"] = convert_to_micro(config["amplitude"], config["amplitude_unit"])
+    config["pulse_duration_microseconds"] = convert_to_micro(config["pulse_duration"],
+                                                             config["pulse_duration_unit"])
+    config["duration_between_events_microseconds"] = convert_to_micro(config["duration_between_events"],
+                                                                      config["duration_between_events_unit"])
+    config["time_between_trains_microseconds"] = convert_to_micro(config["train_duration"],
+                                                                  config["train_duration_unit"])
+    config["external_signal_dur_microseconds"] = convert_to_micro(config["external_trigger_duration"],
+                                                                  config["external_trigger_duration_unit"])
+    if config["period_frequency_type"] == 'Frequency':
+        period_seconds = 1 / config["period_frequency_value"] if config["period_frequency_value"] else float('inf')
+        config["period_microseconds"] = convert_to_micro(period_seconds, 's')
+    else:
+        config["period_microseconds"] = convert_to_micro(config["period_frequency_value"], 's')
+    return config
+
+
+# The fields of a normalized config the compiler, timeline and validator read.
+# Everything else (raw values and units, channel selection, comments) leaves
+# the segments unchanged, so it is not part of a protocol.
+PROTOCOL_FIELDS = (
+    "waveform", "modulation_type_group", "amplitude_microamps", "pulse_duration_microseconds",
+    "duration_between_events_microseconds", "time_between_trains_microseconds",
+    "external_signal_dur_microseconds", "number_of_events", "total_trains",
+)
+
+
+def _canonical(value):
+    # 1000 and 1000.0 describe the same protocol
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def protocol_config(config):
+    """The part of a normalized config that determines the compiled protocol."""
+    fields = {name: _canonical(config[name]) for name in PROTOCOL_FIELDS}
+    if config["waveform"] == "Sinusoidal":
+        fields["period_microseconds"] = _canonical(config["period_microseconds"])
+        # The cycle is sampled at the device's resolution once it is known
+        if config.get("amplitude_resolution"):
+            fields["amplitude_resolution"] = _canonical(config["amplitude_resolution"])
+    return fields
+
+
+def config_key(config):
+    """Canonical hash of a config dict, independent of key order."""
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def _read_only(*arrays):
+    for array in arrays:
+        array.flags.writeable = False
+    return arrays
+
+
+class CompiledProtocol:
+    """A normalized config and everything derived from it, each computed on first use."""
+
+    def __init__(self, config, key=None):
+        self.config = config
+        self.key = key or config_key(config)
+
+    @cached_property
+    def arrays(self):
+        # (stim_amplitude, stim_duration, sync_amplitude, sync_duration) for the whole protocol
+        return _read_only(*compile_pulse_train(self.config, self.timeline))
+
+    @cached_property
+    def segments(self):
+        return compress_segments(*self.arrays)
+
+    @cached_property
+    def train_block(self):
+        return _read_only(*compile_train_block(self.config, self.timeline))
+
+    @cached_property
+    def breakpoints(self):
+        # ((times, values) of the stimulation output, (times, values) of the sync output) for plotting
+        stim_amplitude, stim_duration, sync_amplitude, sync_duration = self.arrays
+        return step_breakpoints(stim_amplitude, stim_duration), step_breakpoints(sync_amplitude, sync_duration)
+
+    @cached_property
+    def dat_channels(self):
+        return dat_channels(self.config)
+
+    @cached_property
+    def timeline(self):
+        # Closed-form event/train/protocol boundaries, no arrays needed
+        return Timeline(self.config)
+
+
+class ProtocolCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._protocols = OrderedDict()
+
+    def get(self, config):
+        """Return the CompiledProtocol for a normalized config, compiling it on a miss.
+
+        Configs that only differ in units, channel selection or unused fields
+        share one protocol, whose config holds just the PROTOCOL_FIELDS.
+        """
+        config = protocol_config(config)
+        key = config_key(config)
+        protocol = self._protocols.get(key)
+        if protocol is not None:
+            self.hits += 1
+            self._protocols.move_to_end(key)
+            return protocol
+        self.misses += 1
+        protocol = CompiledProtocol(config, key)
+        self._protocols[key] = protocol
+        if len(self._protocols) > self.maxsize:
+            self._protocols.popitem(last=False)
+        return protocol
+
+    def clear(self):
+        self._protocols.clear()
+
+    def __len__(self):
+        return len(self._protocols)
@@ -0,0 +1,136 @@
+import bisect
+
+from sine_synthesis import sine_event
+
+# Closed-form timing of a protocol in integer microseconds, from a normalized
+# config (protocol_cache.normalize_config). A protocol is `trains` copies of
+# one train, each train `events` copies of one event separated by the
+# between-events gap, so every boundary is an arithmetic progression and the
+# level at any time is found by dividing down to the train and then bisecting
+# the few breakpoints of a single train.
+#
+# This is the one place event shapes and durations are defined: the pulse
+# compiler builds its segments from a Timeline's phases, and the plots, the
+# progress bar, the .dat export and the upload all ask it.
+
+
+def event_phases(config):
+    """(amplitude, duration) of the phases of one event, before the gap."""
+    amplitude = int(config["amplitude_microamps"])
+    pulse_duration = int(config["pulse_duration_microseconds"])
+    if config["waveform"] == "Biphasic":
+        return [(amplitude, pulse_duration), (-amplitude, pulse_duration)]
+    if config["waveform"] == "Sinusoidal":
+        # One full sine period per event, as the sampled steps that get uploaded
+        return [(int(level), int(duration)) for level, duration in zip(*sine_event(config))]
+    if config["waveform"] == "Monophasic":
+        return [(amplitude, pulse_duration)]
+    raise ValueError(f"No pulse train compiler for waveform {config['waveform']!r}")
+
+
+class Timeline:
+    def __init__(self, config):
+        self.phases = event_phases(config)
+        self.events = int(config["number_of_events"])
+        self.trains = int(config["total_trains"])
+        self.gap_us = int(config["duration_between_events_microseconds"]) if self.events > 1 else 0
+        self.event_us = sum(duration for _, duration in self.phases)
+        self.event_stride_us = self.event_us + self.gap_us
+        self.train_active_us = self.events * self.event_us + (self.events - 1) * self.gap_us
+        self.train_period_us = int(config["time_between_trains_microseconds"])
+        # Trains too long for their period run back to back
+        self.inter_train_delay_us = self.train_period_us - self.train_active_us
+        self.train_stride_us = self.train_active_us + max(0, self.inter_train_delay_us)
+        # Without events or trains there is nothing to play, stimulation or sync
+        playing = self.trains >= 1 and self.events >= 1
+        self.duration_us = (self.trains - 1) * self.train_stride_us + self.train_active_us if playing else 0
+        self.sync_high_us = int(config["external_signal_dur_microseconds"])
+        self.sync_duration_us = (self.trains - 1) * self.train_period_us + self.sync_high_us if playing else 0
+        self.total_us = max(self.duration_us, self.sync_duration_us)
+
+        # Breakpoints of the first event: the level from times[i] up to times[i + 1]
+        self._times = [0]
+        self._levels = []
+        for amplitude, duration in self.phases:
+            self._levels.append(amplitude)
+            self._times.append(self._times[-1] + duration)
+        self._levels.append(0)  # The gap, or the rest after the last event
+
+    def train_start(self, train):
+        return train * self.train_stride_us
+
+    def event_start(self, train, event):
+        return self.train_start(train) + event * self.event_stride_us
+
+    def _locate(self, t):
+        # (train, event, offset into the event), or None outside the protocol
+        if t < 0 or t >= self.duration_us or self.event_stride_us <= 0:
+            return None
+        train = min(t // self.train_stride_us, self.trains - 1) if self.train_stride_us else 0
+        offset = t - self.train_start(train)
+        if offset >= self.train_active_us:
+            return None
+        event = offset // self.event_stride_us
+        return train, event, offset - event * self.event_stride_us
+
+    def amplitude_at(self, t):
+        """Stimulation level at time t (us)."""
+        located = self._locate(int(t))
+        if located is None:
+            return 0
+        return self._levels[bisect.bisect_right(self._times, located[2]) - 1]
+
+    def sync_at(self, t):
+        """Sync output level at time t (us): high for the external signal at the start of each train."""
+        t = int(t)
+        if t < 0 or t >= self.sync_duration_us:
+            return 0
+        return 1 if not self.train_period_us or t % self.train_period_us < self.sync_high_us else 0
+
+    def next_edge(self, t):
+        """First stimulation breakpoint strictly after t (us), or None past the end of the protocol."""
+        t = int(t)
+        if t < 0:
+            return 0 if self.duration_us else None
+        located = self._locate(t)
+        if located is None:
+            if t >= self.duration_us:
+                return None
+            # Between two trains
+            return self.train_start(t // self.train_stride_us + 1)
+        train, event, offset = located
+        index = bisect.bisect_right(self._times, offset)
+        if index < len(self._times):
+            return self.event_start(train, event) + self._times[index]
+        # In the gap after an event
+        return self.event_start(train, event + 1)
+
+
+class SegmentTimeline:
+    """The same queries over explicit (amplitude, duration) segments, e.g. a protocol read from a .dat file."""
+
+    def __init__(self, stim_amplitude, stim_duration, sync_amplitude, sync_duration):
+        import numpy as np
+        self._stim = (np.asarray(stim_amplitude), np.concatenate(([0], np.cumsum(stim_duration))))
+        self._sync = (np.asarray(sync_amplitude), np.concatenate(([0], np.cumsum(sync_duration))))
+        self.duration_us = int(self._stim[1][-1])
+        self.sync_duration_us = int(self._sync[1][-1])
+        self.total_us = max(self.duration_us, self.sync_duration_us)
+
+    @staticmethod
+    def _level(segments, t):
+        values, times = segments
+        if t < 0 or t >= times[-1]:
+            return 0
+        return int(values[times.searchsorted(t, 'right') - 1])
+
+    def amplitude_at(self, t):
+        return self._level(self._stim, t)
+
+    def sync_at(self, t):
+        return self._level(self._sync, t)
+
+    def next_edge(self, t):
+        times = self._stim[1]
+        index = times.searchsorted(t, 'right')
+        return int(times[index]) if index < len(times) else None
@@ -0,0 +1,140 @@
+from collections import namedtuple
+
+import numpy as np
+
+from device_encoding import AMPLITUDE_MASK, amplitude_steps
+
+# Pre-flight checks of a compiled protocol against what the STG can play, run
+# before anything is sent over USB. Only the closed-form timeline and the
+# single train block are inspected, never the expanded protocol, so a check
+# takes tens of microseconds however many trains there are and can run on
+# every settings change.
+#
+# Errors make the upload refuse to start. Warnings describe what the device
+# will do differently from the settings (rounding), but the run can go ahead.
+
+ERROR = 'error'
+WARNING = 'warning'
+
+Issue = namedtuple("Issue", ["level", "field", "message"])
+
+# Limits of the output stage. The ranges and resolutions come from the
+# connected STG (see STGDeviceManager.info); these defaults are the values the
+# simulated STG reports. Until a device has been seen (limits=None) the
+# default ranges are checked, but nothing that depends on the resolution.
+DeviceLimits = namedtuple("DeviceLimits", ["current_range_na", "current_resolution_na", "voltage_range_uv",
+                                           "voltage_resolution_uv", "max_segments"])
+
+# Segments the STG accepts per channel in one upload
+DEFAULT_MAX_SEGMENTS = 65536
+DEFAULT_LIMITS = DeviceLimits(16_000_000, 8_000, 8_000_000, 4_000, DEFAULT_MAX_SEGMENTS)
+
+# The STG plays durations in 20 us steps (see stg5_no_gui_test.py)
+DURATION_QUANTUM_US = 20
+MAX_REPEAT = 0xFFFFFFFF
+
+
+class ProtocolError(ValueError):
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__("; ".join(issue.message for issue in issues))
+
+
+def limits_from_info(info, max_segments=DEFAULT_MAX_SEGMENTS):
+    """DeviceLimits from an STGDeviceManager.info() dict."""
+    return DeviceLimits(info["current_range_na"], info["current_resolution_na"], info["voltage_range_uv"],
+                        info["voltage_resolution_uv"], max_segments)
+
+
+def amplitude_resolution(limits, modulation):
+    """Resolution of the output used by `modulation` ('Current' or 'Voltage'), in nA or uV."""
+    current = modulation.lower() == 'current'
+    return limits.current_resolution_na if current else limits.voltage_resolution_uv
+
+
+def _check_durations(issues, durations, what):
+    durations = np.asarray(durations)
+    short = durations[(durations > 0) & (durations < DURATION_QUANTUM_US)]
+    if len(short):
+        issues.append(Issue(ERROR, what, f"{what} has segments of {int(short.min())} us, "
+                                         f"the STG cannot play less than {DURATION_QUANTUM_US} us"))
+    if (durations < 0).any():
+        issues.append(Issue(ERROR, what, f"{what} has negative durations"))
+    off_grid = durations[(durations >= DURATION_QUANTUM_US) & (durations % DURATION_QUANTUM_US != 0)]
+    if len(off_grid):
+        issues.append(Issue(WARNING, what, f"{what} durations such as {int(off_grid[0])} us are not multiples of "
+                                           f"{DURATION_QUANTUM_US} us and will be rounded down"))
+
+
+def validate_protocol(protocol, limits=None):
+    """Return the list of Issues that stop (ERROR) or alter (WARNING) `protocol` on the STG.
+
+    `limits` are the connected device's DeviceLimits, None when no device is known yet.
+    """
+    known = limits is not None
+    limits = limits or DEFAULT_LIMITS
+    config = protocol.config
+    issues = []
+    if int(config.get("number_of_events", 1)) < 1 or int(config.get("total_trains", 1)) < 1:
+        return [Issue(ERROR, 'number_of_events', "A protocol needs at least one event and one train")]
+    try:
+        stim_amplitude, stim_duration, sync_amplitude, sync_duration = protocol.train_block
+    except ValueError as error:
+        # Waveforms the compiler cannot build yet
+        return [Issue(ERROR, 'waveform', str(error))]
+    timeline = protocol.timeline
+
+    # Output range and resolution
+    current = config["modulation_type_group"].lower() == 'current'
+    output_range = limits.current_range_na if current else limits.voltage_range_uv
+    resolution = amplitude_resolution(limits, config["modulation_type_group"])
+    unit = 'nA' if current else 'uV'
+    peak = int(np.abs(stim_amplitude).max()) if len(stim_amplitude) else 0
+    if peak > output_range:
+        issues.append(Issue(ERROR, 'amplitude', f"Amplitude {peak} {unit} is outside the STG's "
+                                                f"+/-{output_range} {unit} range"))
+    elif known and int(amplitude_steps(peak, resolution)) > AMPLITUDE_MASK:
+        # The same steps device_encoding.encode_amplitudes masks to 12 bits
+        issues.append(Issue(ERROR, 'amplitude', f"Amplitude {peak} {unit} needs more than 12 bits "
+                                                f"at {resolution} {unit} resolution"))
+    if known and resolution and (np.asarray(stim_amplitude) % resolution).any():
+        issues.append(Issue(WARNING, 'amplitude', f"Amplitude is not a multiple of the {resolution} {unit} "
+                                                  f"resolution and will be rounded"))
+
+    # Durations on the device's time grid
+    _check_durations(issues, stim_duration, 'Stimulation')
+    _check_durations(issues, sync_duration, 'Sync output')
+
+    # Stim and sync have to stay in step, train after train. Protocols read
+    # from a .dat file have no train structure to check.
+    if hasattr(timeline, 'train_period_us'):
+        if timeline.inter_train_delay_us < 0:
+            issues.append(Issue(ERROR, 'train_duration', f"Each train lasts {timeline.train_active_us} us, longer "
+                                                         f"than the {timeline.train_period_us} us train duration"))
+        if timeline.sync_high_us > timeline.train_period_us:
+            issues.append(Issue(ERROR, 'external_trigger_duration',
+                                f"External signal of {timeline.sync_high_us} us is longer than the "
+                                f"{timeline.train_period_us} us train duration"))
+        elif timeline.sync_high_us <= 0:
+            issues.append(Issue(WARNING, 'external_trigger_duration', "The sync output never goes high"))
+
+    # Upload size: one train block, replayed `total_trains` times by the trigger
+    segments = max(len(stim_amplitude), len(sync_amplitude))
+    if segments > limits.max_segments:
+        issues.append(Issue(ERROR, 'number_of_events', f"A train needs {segments} segments, "
+                                                       f"the STG takes {limits.max_segments}"))
+    if int(config.get("total_trains", 1)) > MAX_REPEAT:
+        issues.append(Issue(ERROR, 'total_trains', f"At most {MAX_REPEAT} trains"))
+    return issues
+
+
+def errors(issues):
+    return [issue for issue in issues if issue.level == ERROR]
+
+
+def check_protocol(protocol, limits=None):
+    """Raise ProtocolError when `protocol` cannot be played, else return its warnings."""
+    issues = validate_protocol(protocol, limits)
+    if errors(issues):
+        raise ProtocolError(errors(issues))
+    return issues
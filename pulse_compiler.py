@@ -0,0 +1,85 @@
+import numpy as np
+
+from protocol_timeline import Timeline
+
+# Compiles the channel_data() config of STGDeviceController into the flat
+# amplitude/duration segment arrays that get uploaded to the STG.
+# Everything is built from one event block with np.tile, so the cost no longer
+# grows with a Python loop over every train and event. The event's phases and
+# every delay come from protocol_timeline.Timeline, the same model the plots,
+# progress bar and validator use.
+
+
+def _event_block(timeline):
+    # The phases of one event, then the gap to the next one
+    amplitudes = [amplitude for amplitude, _ in timeline.phases] + [0]
+    durations = [duration for _, duration in timeline.phases] + [timeline.gap_us]
+    return np.array(amplitudes, dtype=np.int64), np.array(durations, dtype=np.int64)
+
+
+def _train_block(timeline):
+    event_amplitudes, event_durations = _event_block(timeline)
+    # Every event is followed by the between-events delay except the last one
+    train_amplitudes = np.tile(event_amplitudes, timeline.events)[:-1]
+    train_durations = np.tile(event_durations, timeline.events)[:-1]
+    return train_amplitudes, train_durations
+
+
+def compile_pulse_train(config, timeline=None):
+    """Return (stim_amplitude, stim_duration, sync_amplitude, sync_duration) as int64 arrays.
+
+    `timeline` is the config's Timeline when the caller already has one, the
+    segments are built from its phases so both always agree.
+    """
+    timeline = timeline or Timeline(config)
+    trains = timeline.trains
+    if trains < 1 or timeline.events < 1:
+        # Nothing to play, protocol_validator reports it
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), empty.copy(), empty.copy()
+    train_amplitudes, train_durations = _train_block(timeline)
+
+    # All trains but the last are followed by the inter-train delay (if there is room for one)
+    delay = timeline.inter_train_delay_us
+    if delay > 0:
+        repeated_amplitudes = np.append(train_amplitudes, 0)
+        repeated_durations = np.append(train_durations, delay)
+    else:
+        repeated_amplitudes = train_amplitudes
+        repeated_durations = train_durations
+    stim_amplitude = np.concatenate((np.tile(repeated_amplitudes, trains - 1), train_amplitudes))
+    stim_duration = np.concatenate((np.tile(repeated_durations, trains - 1), train_durations))
+
+    # Sync output goes high for the external signal at the start of each train
+    signal_duration = timeline.sync_high_us
+    sync_low = timeline.train_period_us - timeline.sync_high_us
+    sync_amplitude = np.concatenate((np.tile(np.array([1, 0], dtype=np.int64), trains - 1),
+                                     np.array([1], dtype=np.int64)))
+    sync_duration = np.concatenate((np.tile(np.array([signal_duration, sync_low], dtype=np.int64), trains - 1),
+                                    np.array([signal_duration], dtype=np.int64)))
+
+    return (np.ascontiguousarray(stim_amplitude, dtype=np.int64),
+            np.ascontiguousarray(stim_duration, dtype=np.int64),
+            np.ascontiguousarray(sync_amplitude, dtype=np.int64),
+            np.ascontiguousarray(sync_duration, dtype=np.int64))
+
+
+def compile_train_block(config, timeline=None):
+    """One full train period: the train, its inter-train delay, and the matching sync output.
+
+    Repeating this block total_trains times replays the protocol (plus a
+    trailing rest), without materializing every train.
+    """
+    timeline = timeline or Timeline(config)
+    if timeline.trains < 1 or timeline.events < 1:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty.copy(), empty.copy(), empty.copy()
+    stim_amplitude, stim_duration = _train_block(timeline)
+    delay = timeline.inter_train_delay_us
+    if delay > 0:
+        stim_amplitude = np.append(stim_amplitude, 0)
+        stim_duration = np.append(stim_duration, delay)
+    return (np.ascontiguousarray(stim_amplitude, dtype=np.int64),
+            np.ascontiguousarray(stim_duration, dtype=np.int64),
+            np.array([1, 0], dtype=np.int64),
+            np.array([timeline.sync_high_us, timeline.train_period_us - timeline.sync_high_us], dtype=np.int64))
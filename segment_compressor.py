@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Run-length compression of the segment arrays built by compile_pulse_train.
+# The STG can replay the data of a trigger a fixed number of times (the
+# `repeat` array of SetupTrigger), so a protocol made of identical blocks only
+# needs one block uploaded together with its repeat count.
+#
+# The repeat applies to everything mapped on the trigger, so a block is only
+# used when the stimulation and the sync output repeat the same number of
+# times and both blocks last equally long.
+
+CompressedSegments = namedtuple(
+    "CompressedSegments",
+    ["stim_amplitude", "stim_duration", "sync_amplitude", "sync_duration", "repeat"])
+
+
+def _divisors(n):
+    small, large = [], []
+    i = 1
+    while i * i <= n:
+        if n % i == 0:
+            small.append(i)
+            if i != n // i:
+                large.append(n // i)
+        i += 1
+    return small + large[::-1]
+
+
+def _shift_equal(values, block):
+    return np.array_equal(values[block:], values[:len(values) - block])
+
+
+def repeat_candidates(amplitudes, durations):
+    """Map every possible repeat count to (block_length, trimmed).
+
+    `trimmed` means the last repetition is missing its final rest segment,
+    which is how the last train/event is emitted by the compiler.
+    """
+    amplitudes = np.asarray(amplitudes)
+    durations = np.asarray(durations)
+    n = len(amplitudes)
+    candidates = {1: (n, False)}
+    if n == 0:
+        return candidates
+    for block in _divisors(n):
+        if block < n and _shift_equal(amplitudes, block) and _shift_equal(durations, block):
+            candidates[n // block] = (block, False)
+    for block in _divisors(n + 1):
+        if block < 2 or block > n:
+            continue
+        # The dropped segment is the block's last one, which must be a rest
+        if amplitudes[block - 1] != 0:
+            continue
+        if _shift_equal(amplitudes, block) and _shift_equal(durations, block):
+            candidates.setdefault((n + 1) // block, (block, True))
+    return candidates
+
+
+def compress_segments(stim_amplitude, stim_duration, sync_amplitude, sync_duration):
+    """Return the smallest block that replays the whole protocol, with its repeat count."""
+    stim_amplitude = np.asarray(stim_amplitude, dtype=np.int64)
+    stim_duration = np.asarray(stim_duration, dtype=np.int64)
+    sync_amplitude = np.asarray(sync_amplitude, dtype=np.int64)
+    sync_duration = np.asarray(sync_duration, dtype=np.int64)
+
+    stim_candidates = repeat_candidates(stim_amplitude, stim_duration)
+    sync_candidates = repeat_candidates(sync_amplitude, sync_duration)
+    for repeat in sorted(set(stim_candidates) & set(sync_candidates), reverse=True):
+        if repeat == 1:
+            break
+        stim_block = stim_candidates[repeat][0]
+        sync_block = sync_candidates[repeat][0]
+        if stim_duration[:stim_block].sum() != sync_duration[:sync_block].sum():
+            continue
+        return CompressedSegments(
+            np.ascontiguousarray(stim_amplitude[:stim_block]),
+            np.ascontiguousarray(stim_duration[:stim_block]),
+            np.ascontiguousarray(sync_amplitude[:sync_block]),
+            np.ascontiguousarray(sync_duration[:sync_block]),
+            repeat)
+    return CompressedSegments(stim_amplitude, stim_duration, sync_amplitude, sync_duration, 1)
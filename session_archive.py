@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from brainsboard_protocol import pack_channel_map, unpack_channel_map
+from segment_compressor import CompressedSegments
+
+# Append-only archive of stimulation runs, one directory for a whole session
+# (or years of them). Everything is stored in a few flat binary files that are
+# only ever appended to and are read back with np.memmap:
+#
+#   runs.bin       one RUN_DTYPE record per run
+#   protocols.bin  one PROTOCOL_DTYPE record per distinct compiled protocol
+#   stim.bin       (amplitude, duration) int64 rows of the protocols' stimulation block
+#   sync.bin       the same for the sync output
+#   configs.bin    the protocols' configs as JSON, addressed by offset and length
+#
+# A protocol is stored once as its run-length compressed segments (one block
+# plus the repeat count, see segment_compressor) however many runs use it.
+# The run table is a structured array, so thousands of runs are filtered with
+# NumPy without opening a file per run. Data is written before the record
+# that points at it, and the row files are cut back to whole rows on open and
+# before every append, so a crash mid-append leaves only unreferenced bytes.
+#
+# Use get_session_archive(): every GUI session writing to a directory shares
+# one SessionArchive, so appends are serialized by one lock and see one
+# protocol index.
+
+PROTOCOL_DTYPE = np.dtype([
+    ('key', 'S40'), ('repeat', '<i8'),
+    ('stim_offset', '<i8'), ('stim_rows', '<i8'),
+    ('sync_offset', '<i8'), ('sync_rows', '<i8'),
+    ('config_offset', '<i8'), ('config_bytes', '<i8'),
+])
+RUN_DTYPE = np.dtype([
+    ('timestamp', '<f8'),      # Unix time the run started
+    ('protocol', '<i8'),       # Index into protocols.bin
+    ('label', 'S64'),          # Filename the run was saved under in the GUI
+    ('channel_map', '<i8'),    # Packed BRAINSBoard map, -1 without a board
+    ('status', 'S12'),         # stim_runner job status
+    ('duration_us', '<i8'),    # Planned protocol length
+    ('upload_ms', '<f8'),      # Telemetry, NaN when not measured
+    ('latch_ms', '<f8'),
+    ('run_ms', '<f8'),
+])
+TELEMETRY_FIELDS = ('upload_ms', 'latch_ms', 'run_ms')
+SEGMENT_DTYPE = np.dtype('<i8')
+# Bytes per row of each file, configs.bin is addressed by byte offset
+ROW_BYTES = {
+    'runs.bin': RUN_DTYPE.itemsize,
+    'protocols.bin': PROTOCOL_DTYPE.itemsize,
+    'stim.bin': 2 * SEGMENT_DTYPE.itemsize,
+    'sync.bin': 2 * SEGMENT_DTYPE.itemsize,
+    'configs.bin': 1,
+}
+
+
+_shared_archives = {}
+_shared_lock = threading.Lock()
+
+
+def get_session_archive(directory):
+    """Return the process-wide SessionArchive for `directory`, shared by every GUI session."""
+    key = os.path.realpath(directory)
+    with _shared_lock:
+        archive = _shared_archives.get(key)
+        if archive is None:
+            archive = SessionArchive(directory)
+            _shared_archives[key] = archive
+        return archive
+
+
+class SessionArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        for name in ROW_BYTES:
+            self._trim(name)
+        self._protocol_index = {}
+        self._indexed = 0  # Rows of protocols.bin already in the index
+        self._refresh_index()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _table(self, name, dtype):
+        path = self._path(name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < dtype.itemsize:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(size // dtype.itemsize,))
+
+    @property
+    def runs(self):
+        """Read-only structured array of every run, memory-mapped."""
+        return self._table('runs.bin', RUN_DTYPE)
+
+    @property
+    def protocols(self):
+        return self._table('protocols.bin', PROTOCOL_DTYPE)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def _trim(self, name):
+        # Drop a partial row left by an interrupted write
+        path = self._path(name)
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            if size % ROW_BYTES[name]:
+                os.truncate(path, size - size % ROW_BYTES[name])
+
+    def _append(self, name, data):
+        # Returns the offset, in bytes, the data was written at, always on a row boundary
+        self._trim(name)
+        with open(self._path(name), 'ab') as file:
+            offset = file.tell()
+            file.write(data)
+        return offset
+
+    def _refresh_index(self):
+        # Pick up protocols appended since the index was built, e.g. by another process
+        protocols = self.protocols
+        for index in range(self._indexed, len(protocols)):
+            self._protocol_index.setdefault(protocols['key'][index].decode(), index)
+        self._indexed = max(self._indexed, len(protocols))
+
+    def _store_protocol(self, protocol):
+        self._refresh_index()
+        index = self._protocol_index.get(protocol.key)
+        if index is not None:
+            return index
+        segments = protocol.segments
+        stim = np.column_stack((segments.stim_amplitude, segments.stim_duration)).astype(SEGMENT_DTYPE)
+        sync = np.column_stack((segments.sync_amplitude, segments.sync_duration)).astype(SEGMENT_DTYPE)
+        config = json.dumps(protocol.config, sort_keys=True, default=str).encode()
+        record = np.zeros(1, dtype=PROTOCOL_DTYPE)
+        record['key'] = protocol.key
+        record['repeat'] = segments.repeat
+        record['stim_offset'] = self._append('stim.bin', stim.tobytes()) // (2 * SEGMENT_DTYPE.itemsize)
+        record['stim_rows'] = len(stim)
+        record['sync_offset'] = self._append('sync.bin', sync.tobytes()) // (2 * SEGMENT_DTYPE.itemsize)
+        record['sync_rows'] = len(sync)
+        record['config_offset'] = self._append('configs.bin', config)
+        record['config_bytes'] = len(config)
+        index = self._append('protocols.bin', record.tobytes()) // PROTOCOL_DTYPE.itemsize
+        self._protocol_index[protocol.key] = index
+        return index
+
+    def append(self, protocol, channels=None, label='', status='done', timestamp=None, **telemetry):
+        """Record a run of `protocol` (a CompiledProtocol) and return its run number.
+
+        `channels` is the BRAINSBoard map as 16 letters, telemetry keywords are
+        any of TELEMETRY_FIELDS in milliseconds.
+        """
+        unknown = set(telemetry) - set(TELEMETRY_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown telemetry fields {sorted(unknown)}")
+        with self._lock:
+            record = np.zeros(1, dtype=RUN_DTYPE)
+            record['timestamp'] = time.time() if timestamp is None else timestamp
+            record['protocol'] = self._store_protocol(protocol)
+            record['label'] = label.encode()[:64]
+            record['channel_map'] = -1 if channels is None else pack_channel_map(channels)
+            record['status'] = status.encode()[:12]
+            record['duration_us'] = int(np.sum(protocol.arrays[1]))
+            for field in TELEMETRY_FIELDS:
+                record[field] = telemetry.get(field, np.nan)
+            return self._append('runs.bin', record.tobytes()) // RUN_DTYPE.itemsize
+
+    def select(self, since=None, until=None, protocol_key=None, label=None, status=None):
+        """Indices of the runs matching every given filter."""
+        runs = self.runs
+        mask = np.ones(len(runs), dtype=bool)
+        if since is not None:
+            mask &= runs['timestamp'] >= since
+        if until is not None:
+            mask &= runs['timestamp'] < until
+        if protocol_key is not None:
+            # Compared by key, the same protocol may have been stored twice by separate writers
+            mask &= np.isin(runs['protocol'], np.flatnonzero(self.protocols['key'] == protocol_key.encode()))
+        if label is not None:
+            mask &= runs['label'] == label.encode()
+        if status is not None:
+            mask &= runs['status'] == status.encode()
+        return np.flatnonzero(mask)
+
+    def config(self, run):
+        protocol = self.protocols[self.runs[run]['protocol']]
+        with open(self._path('configs.bin'), 'rb') as file:
+            file.seek(protocol['config_offset'])
+            return json.loads(file.read(protocol['config_bytes']))
+
+    def segments(self, run):
+        """CompressedSegments of the run's protocol, views into the memory-mapped segment files."""
+        protocol = self.protocols[self.runs[run]['protocol']]
+        stim = self._table('stim.bin', SEGMENT_DTYPE).reshape(-1, 2)
+        sync = self._table('sync.bin', SEGMENT_DTYPE).reshape(-1, 2)
+        stim = stim[protocol['stim_offset']:protocol['stim_offset'] + protocol['stim_rows']]
+        sync = sync[protocol['sync_offset']:protocol['sync_offset'] + protocol['sync_rows']]
+        return CompressedSegments(stim[:, 0], stim[:, 1], sync[:, 0], sync[:, 1], int(protocol['repeat']))
+
+    def channel_map(self, run):
+        packed = int(self.runs[run]['channel_map'])
+        return None if packed < 0 else unpack_channel_map(packed)
+
+    def to_dataframe(self):
+        """The run table as a pandas DataFrame, one row per run."""
+        import pandas as pd
+        runs = self.runs
+        frame = pd.DataFrame({name: runs[name] for name in RUN_DTYPE.names})
+        for name in ('label', 'status'):
+            frame[name] = frame[name].str.decode('utf-8')
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'], unit='s')
+        frame['protocol_key'] = self.protocols['key'][runs['protocol']].astype(str) if len(runs) else []
+        return frame
+
+    def to_parquet(self, path):
+        # Needs pyarrow or fastparquet next to pandas
+        self.to_dataframe().to_parquet(path, index=False)
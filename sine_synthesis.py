@@ -0,0 +1,70 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from protocol_validator import DEFAULT_LIMITS, DEFAULT_MAX_SEGMENTS, DURATION_QUANTUM_US, amplitude_resolution
+
+# Sampled sine cycles for the Sinusoidal waveform. One period is sampled on
+# the STG's 20 us time grid at the middle of each step, rounded to the
+# output's amplitude resolution, and runs of equal samples are merged into one
+# segment, so a slow or small sine needs only a few segments per cycle. A
+# cycle is computed once per (amplitude, period, resolution) and shared; the
+# event is repeated by the pulse compiler and the upload's repeat count like
+# any other event block.
+#
+# The resolution is the config's "amplitude_resolution", set by the controller
+# from the connected STG, and the simulated STG's default until one is known.
+#
+# The upload's repeat count replays the whole trigger, stimulation and sync
+# together, and the sync output only marks the start of a train, so the train
+# is the smallest block that can be repeated. A train of several events
+# uploads the cycle once per event; the cycle is capped so the train still
+# fits one upload.
+
+# Samples (and so segments) allowed for one cycle, longer periods get a coarser time step
+MAX_CYCLE_SEGMENTS = 4096
+
+
+def _samples(amplitude, period_us, resolution, step_us):
+    starts = np.arange(0, period_us, step_us, dtype=np.int64)
+    durations = np.diff(np.append(starts, period_us))
+    phase = 2 * np.pi * (starts + durations / 2) / period_us
+    levels = np.rint(amplitude * np.sin(phase) / resolution).astype(np.int64) * resolution
+    # Merge runs of equal levels
+    keep = np.flatnonzero(np.diff(levels, prepend=levels[0] - 1))
+    merged = np.add.reduceat(durations, keep)
+    return levels[keep], merged
+
+
+@lru_cache(maxsize=64)
+def _cycle(amplitude, period_us, resolution, max_segments):
+    # Steps long enough for at most max_segments samples, so a long period is
+    # never sampled at 20 us first
+    step_us = DURATION_QUANTUM_US * max(1, math.ceil(period_us / (DURATION_QUANTUM_US * max_segments)))
+    amplitudes, durations = _samples(amplitude, period_us, resolution, step_us)
+    for array in (amplitudes, durations):
+        array.flags.writeable = False
+    return amplitudes, durations
+
+
+def sine_cycle(amplitude, period_us, resolution=1, max_segments=MAX_CYCLE_SEGMENTS):
+    """(amplitudes, durations) of one sine period as int64 segments, read-only and cached.
+
+    `amplitude` and `resolution` are in the device unit (nA or uV), `period_us`
+    is rounded to whole microseconds.
+    """
+    if not math.isfinite(period_us) or period_us < 2 * DURATION_QUANTUM_US:
+        raise ValueError(f"Sine period of {period_us} us is shorter than two {DURATION_QUANTUM_US} us samples")
+    resolution = max(1, int(resolution))
+    return _cycle(int(amplitude), int(round(period_us)), resolution, max(2, int(max_segments)))
+
+
+def sine_event(config):
+    """The sine cycle of a normalized Sinusoidal config, sized so a train fits one upload."""
+    resolution = config.get("amplitude_resolution") or amplitude_resolution(DEFAULT_LIMITS,
+                                                                            config["modulation_type_group"])
+    # Each event is the cycle plus its gap, the whole train has to fit the device memory
+    events = max(1, int(config["number_of_events"]))
+    max_segments = min(MAX_CYCLE_SEGMENTS, DEFAULT_MAX_SEGMENTS // events - 1)
+    return sine_cycle(config["amplitude_microamps"], config["period_microseconds"], resolution, max_segments)
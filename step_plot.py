@@ -0,0 +1,61 @@
+import numpy as np
+
+from dat_export import collapse_rows
+
+# Step-function rendering of the compiled amplitude/duration segments.
+# The waveform is kept as its exact breakpoints and only reduced to about
+# four points per screen pixel when it is drawn, so the number of points sent
+# to the browser depends on the plot width and not on the protocol length.
+
+
+def step_breakpoints(amplitudes, durations, start=0):
+    """Return (times, values): values[i] holds from times[i] to times[i + 1].
+
+    The last value is the 0 the output rests at after the final segment, so
+    times and values have the same length.
+    """
+    values, durations = collapse_rows(amplitudes, durations)
+    times = np.empty(len(durations) + 1, dtype=np.float64)
+    times[0] = start
+    np.cumsum(durations, out=times[1:])
+    times[1:] += start
+    return times, np.append(values, 0.0)
+
+
+def decimate_steps(times, values, x_range=None, pixels=800):
+    """Return (x, y) line coordinates of the step function over `x_range`.
+
+    When more segments are visible than there are pixels, every pixel-wide bin
+    is drawn as a vertical run from its min to its max value, which keeps every
+    pulse visible however far the plot is zoomed out.
+    """
+    end = times[-1]
+    x0, x1 = x_range if x_range is not None else (times[0], end)
+    x0, x1 = max(x0, times[0]), min(x1, end)
+    if x1 <= x0:
+        x1 = x0 + 1
+    first = np.searchsorted(times, x0, 'right') - 1
+    last = max(first, np.searchsorted(times, x1, 'left') - 1)
+
+    if last - first + 1 <= pixels:
+        # Few enough segments on screen: draw them exactly
+        starts = np.maximum(times[first:last + 1], x0)
+        ends = np.minimum(times[first + 1:last + 2], x1)
+        if len(ends) < len(starts):
+            ends = np.append(ends, x1)
+        x = np.column_stack((starts, ends)).ravel()
+        y = np.repeat(values[first:last + 1], 2)
+        return x, y
+
+    bins = np.linspace(x0, x1, pixels + 1)
+    lo = np.searchsorted(times, bins[:-1], 'right') - 1
+    hi = np.maximum(lo, np.searchsorted(times, bins[1:], 'left') - 1)
+    # reduceat covers lo[k]..lo[k+1]-1; adding values[hi] covers a segment
+    # that runs across the right edge of the bin
+    visible = values[:hi[-1] + 1]
+    low = np.minimum(np.minimum.reduceat(visible, lo), values[hi])
+    high = np.maximum(np.maximum.reduceat(visible, lo), values[hi])
+
+    x = np.append(np.repeat(bins[:-1], 4), x1)
+    y = np.append(np.column_stack((values[lo], low, high, values[hi])).ravel(), values[hi[-1]])
+    return x, y
@@ -19,20 +19,13 @@ import csv
 import pendulum
 import time
 import os
-import clr
-
-from System import Action
-from System import *
-
-#change this path to the McsUsbNet for your computer
-clr.AddReference(r"C:\Users\denma\Documents\GitHub\McsUsbNet_Examples-master\McsUsbNet\x64\McsUsbNet.dll")
-
-from Mcs.Usb import CMcsUsbListNet
-from Mcs.Usb import DeviceEnumNet
-
-from Mcs.Usb import CStg200xDownloadNet
-from Mcs.Usb import McsBusTypeEnumNet
-from Mcs.Usb import STG_DestinationEnumNet
+# STG_BACKEND=simulated runs the device pipeline without hardware,
+# MCS_USB_DLL points at the McsUsbNet.dll for your computer
+from stg_backend import load_backend
+stg = load_backend()
+CMcsUsbListNet, DeviceEnumNet = stg.CMcsUsbListNet, stg.DeviceEnumNet
+CStg200xDownloadNet, STG_DestinationEnumNet = stg.CStg200xDownloadNet, stg.STG_DestinationEnumNet
+Array, UInt32, Int32, UInt64 = stg.Array, stg.UInt32, stg.Int32, stg.UInt64
 
 # Set the rendering backend to Bokeh (default)
 hv.extension('bokeh')
@@ -10,13 +10,13 @@ import csv  # For CSV file operations
 import pendulum  # For handling dates and times
 import time  # For timing and delays
 import os  # For interacting with the operating system
-import clr  # For .NET integration, to interact with the MCS device
-
-# Import specific .NET libraries needed to interact with the MCS STG device
-from System import Action
-from System import Array, UInt32, Int32, UInt64
-clr.AddReference(r"C:\Users\denma\Documents\GitHub\McsUsbNet_Examples-master\McsUsbNet\x64\McsUsbNet.dll")
-from Mcs.Usb import CMcsUsbListNet, DeviceEnumNet, CStg200xDownloadNet, McsBusTypeEnumNet, STG_DestinationEnumNet
+# STG_BACKEND=simulated runs the device pipeline without hardware,
+# MCS_USB_DLL points at the McsUsbNet.dll for your computer
+from stg_backend import load_backend
+stg = load_backend()
+CMcsUsbListNet, DeviceEnumNet = stg.CMcsUsbListNet, stg.DeviceEnumNet
+CStg200xDownloadNet, STG_DestinationEnumNet = stg.CStg200xDownloadNet, stg.STG_DestinationEnumNet
+Array, UInt32, Int32, UInt64 = stg.Array, stg.UInt32, stg.Int32, stg.UInt64
 
 # Initialize the HoloViews and Panel libraries with their respective extensions
 hv.extension('bokeh')
@@ -1,6 +1,4 @@
 import numpy as np
-import hvplot.pandas  # Import hvplot for Pandas
-import pandas as pd
 import panel as pn
 import random
 # Ensure extensions are loaded
@@ -10,55 +8,156 @@ import random
 # Ensure Panel extension is initialized
 pn.extension()
 import csv
-import pendulum
 import time
 import os
 import json
-import clr
 from typing import Tuple, List
 
-from System import Action
-from System import *
 from time import perf_counter_ns
 
-#change this path to the McsUsbNet for your computer
-#clr.AddReference(r"C:\Users\denma\Desktop\McsUsbNet_Examples-master\McsUsbNet\x64\McsUsbNet.dll")
-clr.AddReference(r"C:\Users\denma\Documents\GitHub\McsUsbNet_Examples-master\McsUsbNet\x64\McsUsbNet.dll")
-
-from Mcs.Usb import CMcsUsbListNet
-from Mcs.Usb import DeviceEnumNet
-
-from Mcs.Usb import CStg200xDownloadNet
-from Mcs.Usb import McsBusTypeEnumNet
-from Mcs.Usb import STG_DestinationEnumNet
-
 import math
-from System import Array, UInt32, Int32, UInt64
 
-import serial
-import serial.tools.list_ports
+# Plotting (pandas, hvplot, holoviews), pendulum, pyserial and the STG backend
+# are imported where they are first used, so the window comes up without them.
+# STG_BACKEND=simulated runs the device pipeline without hardware,
+# MCS_USB_DLL points at the McsUsbNet.dll for your computer
+from stg_backend import get_backend
+
+from device_encoding import encode_amplitudes
+from dat_export import write_dat_file
+from protocol_cache import ProtocolCache, convert_to_micro, normalize_config
+from protocol_timeline import Timeline
+from step_plot import decimate_steps
+from change_scheduler import ChangeScheduler, timer_call_later
+from precise_timing import precise_sleep_ms
+from table_model import TableModel
+from session_archive import get_session_archive
+from brainsboard_protocol import (ACK, FRAME_SYNC, NAK, SEQUENCE_CAPACITY, SEQUENCE_DONE, STATUS_FRAME_LENGTH,
+                                  ascii_channel_map, decode_status, encode_channel_map_frame,
+                                  encode_sequence_clear, encode_sequence_run, encode_sequence_step,
+                                  encode_sequence_stop, encode_status_request, encode_verbosity_frame)
+from stim_monitor import CompletionMonitor
+from stim_runner import FAILED, StimulationRunner
+from stg_device_manager import DeviceNotFoundError, get_device_manager
+from protocol_validator import amplitude_resolution, check_protocol, errors, limits_from_info, validate_protocol
 
 import logging
 pn.extension('terminal', console_output='disable')
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger("my_app_logger")
+
+# Runs are appended to this archive inside the folder picked on the Finalize tab
+SESSION_ARCHIVE_DIRECTORY = "stim_session_archive"
 class BRAINSBoard:
-    def __init__(self, gui_instance, logger):
+    def __init__(self, gui_instance, logger, binary=True):
         self.gui = gui_instance
         self.logger = logger
+        self.binary = binary  # False for firmware that only understands the ASCII commands
     def connect(self, port):
+        import serial
         self.baud_rate = 115200 
         self.arduino = serial.Serial(port, self.baud_rate, timeout=1)
     def precise_sleep(self, delay):
-        target = time.perf_counter_ns() + delay * 1000000
-        while time.perf_counter_ns() < target:
-            pass
+        precise_sleep_ms(delay)
 
     def send_command(self, command, delay=0):
         """Send a command to the Arduino and wait for a specified delay."""
         self.logger.debug(command)
         self.arduino.write(command.encode())
         self.precise_sleep(delay)
+
+    def send_channel_map(self, channels, delay_us=None, wait_ack=True):
+        """Switch all 16 channels ('F', 'C', 'A', 'G' each) in one write.
+
+        With wait_ack, returns the seconds from the write to the board's ACK
+        (the latch), or None if it did not acknowledge.
+        """
+        self.arduino.reset_input_buffer()  # Drop leftover chatter so the next byte read is ours
+        start = time.perf_counter()
+        if self.binary:
+            frame = encode_channel_map_frame(channels, delay_us)
+            self.logger.debug(f"Channel map frame {frame.hex()}")
+            self.arduino.write(frame)
+        else:
+            command = ascii_channel_map(channels)
+            if delay_us is not None:
+                command += f"{int(delay_us)}u"
+            self.send_command(command)
+        if not wait_ack:
+            return None
+        if not self.read_ack():
+            self.logger.debug("BRAINSBoard did not acknowledge the channel map")
+            return None
+        latency = time.perf_counter() - start
+        self.logger.debug(f"Channel map latched {latency * 1e3:.2f} ms after sending")
+        return latency
+
+    def read_ack(self, timeout=1.0):
+        """Wait for the one-byte ACK/NAK, skipping any debug text. True on ACK."""
+        return self._read_reply((ACK, NAK), timeout) == ACK
+
+    def _read_reply(self, codes, timeout):
+        # First byte out of `codes` within timeout seconds (None for no timeout), else None
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while deadline is None or time.perf_counter() < deadline:
+            byte = self.arduino.read(1)
+            if byte and byte[0] in codes:
+                return byte[0]
+        return None
+
+    def upload_sequence(self, steps):
+        """Store a switching sequence on the board.
+
+        `steps` is a list of (channels, dwell_us): the 16 channel letters to
+        latch and how long to hold them before the next step. Returns True
+        once the board acknowledged every step.
+        """
+        if len(steps) > SEQUENCE_CAPACITY:
+            raise ValueError(f"The BRAINSBoard holds at most {SEQUENCE_CAPACITY} steps, got {len(steps)}")
+        self.sequence_us = sum(int(dwell_us) for _, dwell_us in steps)
+        frames = [encode_sequence_clear()] + [encode_sequence_step(channels, dwell_us) for channels, dwell_us in steps]
+        self.arduino.reset_input_buffer()
+        self.arduino.write(b"".join(frames))
+        return all(self.read_ack() for _ in frames)
+
+    def run_sequence(self, repeats=1, external_trigger=False, wait=True, timeout=None):
+        """Run the uploaded sequence on the board's own clock.
+
+        With external_trigger the board starts on a rising EXTERNAL_TRIGGER_PIN.
+        repeats=0 runs until stop_sequence(). With wait, blocks until the board
+        reports the sequence done and returns True (False on NAK or timeout).
+        Without a timeout, a triggerless finite run waits its own length plus a second.
+        """
+        self.arduino.reset_input_buffer()
+        self.arduino.write(encode_sequence_run(repeats, external_trigger))
+        if not self.read_ack():
+            self.logger.debug("BRAINSBoard refused to run the sequence")
+            return False
+        if not wait or repeats == 0:
+            return True
+        if timeout is None and not external_trigger:
+            timeout = repeats * getattr(self, 'sequence_us', 0) / 1e6 + 1.0
+        return self._read_reply((SEQUENCE_DONE,), timeout) == SEQUENCE_DONE
+
+    def stop_sequence(self):
+        self.arduino.write(encode_sequence_stop())
+        return self._read_reply((ACK,), 1.0) == ACK
+
+    def set_verbosity(self, level):
+        """Set the firmware's Serial chatter level (VERB_QUIET ... VERB_TRACE)."""
+        self.arduino.write(encode_verbosity_frame(level))
+        return self.read_ack()
+
+    def status(self):
+        """Ask the board for its binary status report, returns a BoardStatus."""
+        self.arduino.reset_input_buffer()
+        self.arduino.write(encode_status_request())
+        # The report starts at the next sync byte, debug text before it is skipped
+        deadline = time.perf_counter() + 1.0
+        while time.perf_counter() < deadline:
+            if self.arduino.read(1) == bytes([FRAME_SYNC]):
+                return decode_status(bytes([FRAME_SYNC]) + self.arduino.read(STATUS_FRAME_LENGTH - 1))
+        raise TimeoutError("No status report from the BRAINSBoard")
     def close(self):
         self.arduino.close()
 
@@ -71,117 +170,91 @@ class STGDeviceController:
         self.stim_duration_arr = []
         self.sync_amplitude_arr = []
         self.sync_duration_arr = []
+        self._devices = None
+        self.protocols = ProtocolCache()
+        self.last_upload_ms = float('nan')  # Time from the start of the upload to SendStart
+        self.last_protocol = None  # The protocol the last upload sent to the device
+
+    @property
+    def stg(self):
+        # McsUsbNet.dll (or the simulator) is loaded on the first device call, not at startup
+        return get_backend()
+
+    @property
+    def devices(self):
+        if self._devices is None:
+            self._devices = get_device_manager(self.stg, self.logger)
+        return self._devices
 
     def channel_data(self):
-        config = self.gui.get_updated_data()
-        config["amplitude_microamps"] = self.convert_to_micro(config["amplitude"], 
-                                                              config["amplitude_unit"])
-        config["pulse_duration_microseconds"] = self.convert_to_micro(config["pulse_duration"], 
-                                                                      config["pulse_duration_unit"])
-        config["duration_between_events_microseconds"] = self.convert_to_micro(config["duration_between_events"], 
-                                                                               config["duration_between_events_unit"])
-        config["time_between_trains_microseconds"] = self.convert_to_micro(config["train_duration"], 
-                                                                           config["train_duration_unit"])
-        config["external_signal_dur_microseconds"] = self.convert_to_micro(config["external_trigger_duration"],
-                                                                            config["external_trigger_duration_unit"])
-        if config["period_frequency_type"] == 'Frequency':
-            period_seconds = 1 / config["period_frequency_value"] if config["period_frequency_value"] else float('inf')
-            config["period_microseconds"] = self.convert_to_micro(period_seconds, 's')
-        else:
-            config["period_microseconds"] = self.convert_to_micro(config["period_frequency_value"], 's')
-        return config
+        return normalize_config(self.gui.get_updated_data())
 
     def convert_to_micro(self, value, unit_type):
-        unit_conversion_factors = {
-            'us': 1, 'ms': 1000, 's': 1000000,
-            'uA': 1000, 'mA': 1000000, 'A': 1000000000,
-            'uV': 1, 'mV': 1000, 'V': 1000000,
-        }
-        return value * unit_conversion_factors.get(unit_type, 1)
+        return convert_to_micro(value, unit_type)
 
-    def generate_stimulation_and_sync_data(self):
+    def compiled_protocol(self):
+        # Compiled once per parameter set, shared by the plots, exports and upload
         config = self.channel_data()
-        self.stim_amplitude_arr.clear()
-        self.stim_duration_arr.clear()
-        self.sync_amplitude_arr.clear()
-        self.sync_duration_arr.clear()
-
-        cumulative_duration = 0
-        train_duration = 0  # Initialize train duration
-
-        for train in range(config["total_trains"]):
-            self.sync_amplitude_arr.append(1)
-            self.sync_duration_arr.append(config["external_signal_dur_microseconds"])
-            cumulative_duration += config["pulse_duration_microseconds"]
-            train_duration += config["pulse_duration_microseconds"]
-            for event in range(config["number_of_events"]):
-                if config["waveform"] == "Monophasic":
-                    self.stim_amplitude_arr.append(config["amplitude_microamps"])
-                    self.stim_duration_arr.append(config["pulse_duration_microseconds"])
-                    if event < config["number_of_events"] - 1:
-                        self.add_delay(config["duration_between_events_microseconds"])
-                        cumulative_duration += config["duration_between_events_microseconds"] + config["pulse_duration_microseconds"]
-                        train_duration += config["duration_between_events_microseconds"]
-                if config["waveform"] == "Biphasic":
-                    self.stim_amplitude_arr.append(config["amplitude_microamps"])
-                    self.stim_duration_arr.append(config["pulse_duration_microseconds"])
-                    self.stim_amplitude_arr.append(-config["amplitude_microamps"])
-                    self.stim_duration_arr.append(config["pulse_duration_microseconds"])
-                    if event < config["number_of_events"] - 1:
-                        self.add_delay(config["duration_between_events_microseconds"])
-                        cumulative_duration += config["duration_between_events_microseconds"] + 2*config["pulse_duration_microseconds"]
-                        train_duration += config["duration_between_events_microseconds"]
-
-            if train < config["total_trains"] - 1:
-                next_train_start = cumulative_duration + config["time_between_trains_microseconds"]
-                if config["waveform"] == "Monophasic":
-                    inter_train_delay = config["time_between_trains_microseconds"] - (config["number_of_events"]*config["pulse_duration_microseconds"]+(config["number_of_events"]-1)*config["duration_between_events_microseconds"])
-                if config["waveform"] == "Biphasic":
-                    inter_train_delay = config["time_between_trains_microseconds"] - (config["number_of_events"]*config["pulse_duration_microseconds"]*2+(config["number_of_events"]-1)*config["duration_between_events_microseconds"])
-
-                sync_inter_train_delay = config["time_between_trains_microseconds"] - config["external_signal_dur_microseconds"]
-                if inter_train_delay > 0:
-                # Append a delay at the end of each train to match the time until the next train starts
-                    self.add_delay(inter_train_delay)
-                cumulative_duration += sync_inter_train_delay
-                self.sync_amplitude_arr.append(0)  # Sync signal low to mark inter-train delay
-                self.sync_duration_arr.append(sync_inter_train_delay)
-
-    def add_delay(self, delay_duration):
-        self.stim_amplitude_arr.append(0)
-        self.stim_duration_arr.append(delay_duration)
-    @staticmethod
-    def prepare_device_data(amplitude_arr, duration_arr):
-        encoded_amplitude = []
-        for amp in amplitude_arr:
-            magnitude = abs(amp) & 0xFFF
-            if amp < 0:
-                # Set sign bit for negative amplitudes
-                encoded_value = (1 << 15) | magnitude
-            else:
-                # Positive amplitudes directly
-                encoded_value = (0 << 7) | magnitude
+        limits = self.device_limits()
+        if limits is not None:
+            # Sine cycles are sampled at the resolution of the connected STG
+            config["amplitude_resolution"] = amplitude_resolution(limits, config["modulation_type_group"])
+        return self.protocols.get(config)
+
+    def device_limits(self):
+        # Limits of the last connected STG, without connecting (or loading the DLL) for it,
+        # None until a device has been seen
+        info = self._devices.cached_info() if self._devices is not None else None
+        return limits_from_info(info) if info else None
+
+    def validate(self, protocol=None):
+        """Issues that stop or alter the current settings (or `protocol`) on the STG."""
+        return validate_protocol(protocol or self.compiled_protocol(), self.device_limits())
 
-            # Convert encoded_value to int for formatting purposes
-            formatted_value = (encoded_value)
-            print(f"Encoded: {formatted_value} | Binary: {formatted_value:016b}")
-            encoded_amplitude.append(encoded_value)
+    def generate_stimulation_and_sync_data(self):
+        protocol = self.compiled_protocol()
+        (self.stim_amplitude_arr, self.stim_duration_arr,
+         self.sync_amplitude_arr, self.sync_duration_arr) = protocol.arrays
+        return protocol
 
-        pData = Array[UInt16](UInt16(d) for d in encoded_amplitude)
-        tData = Array[UInt64]([UInt64(int(d)) for d in duration_arr])
+    @staticmethod
+    def prepare_device_data(amplitude_arr, duration_arr, resolution=1):
+        # Sign bit + 12-bit magnitude in resolution steps packed in NumPy, handed to the device arrays in one copy
+        stg = get_backend()
+        pData = stg.from_numpy(encode_amplitudes(amplitude_arr, resolution), stg.UInt16)
+        tData = stg.from_numpy(duration_arr, stg.UInt64)
         return pData, tData
     def update_progress(self, progress):
-    # Assuming self.gui.progress_bar is the progress bar widget
-        self.gui.progress_bar.value = int(progress)
-        self.gui.progress_percent.value = int(progress)
-    def configure_device_and_send_data(self, device):
-        # Generate stimulation and synchronization data based on input parameters
-        config = self.channel_data()
-        self.generate_stimulation_and_sync_data()
+        # Runs on the stimulation worker thread, the GUI applies it on its next tick
+        self.gui.schedule_progress_update(progress)
+    def configure_device_and_send_data(self, device, job=None, protocol=None):
+        # Generate stimulation and synchronization data based on input parameters,
+        # or replay a given protocol such as dat_import.load_dat_protocol()
+        upload_start = time.perf_counter()
+        self.last_upload_ms = float('nan')
+        stg = self.stg
+        Array, UInt16, UInt32, Int32, UInt64 = stg.Array, stg.UInt16, stg.UInt32, stg.Int32, stg.UInt64
+        if protocol is None:
+            protocol = self.compiled_protocol()
+        config = protocol.config
+        limits = limits_from_info(self.devices.info(device))
+        resolution = amplitude_resolution(limits, config["modulation_type_group"])
+        if config.get("waveform") == "Sinusoidal" and config.get("amplitude_resolution") != resolution:
+            # Compiled before this device was known, sample the sine at its resolution
+            protocol = self.protocols.get(dict(config, amplitude_resolution=resolution))
+        self.last_protocol = protocol
+        (self.stim_amplitude_arr, self.stim_duration_arr,
+         self.sync_amplitude_arr, self.sync_duration_arr) = protocol.arrays
+        # Refuse before touching the device, warnings only go to the log
+        for issue in check_protocol(protocol, limits):
+            self.logger.warning(issue.message)
+        # Upload one repeated block instead of every train, the trigger repeat count replays it
+        segments = protocol.segments
+        self.logger.debug(f"Uploading {len(segments.stim_amplitude)} segments x {segments.repeat} repeats")
         # Prepare the data with the correct arrays directly using the static method
-        pData, tData = self.prepare_device_data(self.stim_amplitude_arr, self.stim_duration_arr)
-        sync_pData = Array[UInt16]([UInt16(v) for v in self.sync_amplitude_arr])
-        sync_tData = Array[UInt64]([UInt64(int(d)) for d in self.sync_duration_arr])
+        pData, tData = self.prepare_device_data(segments.stim_amplitude, segments.stim_duration, resolution)
+        sync_pData = stg.from_numpy(segments.sync_amplitude, UInt16)
+        sync_tData = stg.from_numpy(segments.sync_duration, UInt64)
         syncout_start = [1,0]
         syncout_start_dur = [500,100]
         sync_start_pData = Array[UInt16]([UInt16(v) for v in syncout_start])
@@ -192,14 +265,14 @@ class STGDeviceController:
         else:
             device.SetVoltageMode()
         # Setup triggers, assuming the device supports configuring multiple triggers
-        trigger_inputs = device.GetNumberOfTriggerInputs()
+        trigger_inputs = self.devices.info(device)["trigger_inputs"]
         channelmap = Array[UInt32]([1] + [2] + [0] * (trigger_inputs - 2))  # Activate the first channel
         syncoutmap = Array[UInt32]([1] + [2] + [0] * (trigger_inputs - 2))  # Sync signal for synchronization
         #start_channelmap = Array[UInt32]([2] + [0] * (trigger_inputs - 1))
         #start_syncoutmap = Array[UInt32]([2] + [0] * (trigger_inputs - 1))
         start_repeat = Array[UInt32]([1] + [0] * (trigger_inputs - 1))
 
-        repeat = Array[UInt32]([0] * trigger_inputs)  # Infinite repeat for simplicity
+        repeat = Array[UInt32]([segments.repeat] + [0] * (trigger_inputs - 1))  # Trains replayed by the device
         self.logger.debug(channelmap)
         device.SetupTrigger(UInt32(1), channelmap, syncoutmap, start_repeat)
         device.SetupTrigger(UInt32(0), channelmap, syncoutmap, repeat)
@@ -216,120 +289,67 @@ class STGDeviceController:
         device.ClearSyncData(UInt32(0))
         # Send stimulation data to the device
         #device.SendChannelData(UInt32(0), pData, tData)
+        amplitude = stg.from_numpy(segments.stim_amplitude, Int32)
         if config["modulation_type_group"].lower() == 'current':
-            device.PrepareAndSendData(0, self.stim_amplitude_arr, self.stim_duration_arr,STG_DestinationEnumNet.channeldata_current)
+            device.PrepareAndSendData(0, amplitude, tData,stg.STG_DestinationEnumNet.channeldata_current)
         else:
-            device.PrepareAndSendData(0, self.stim_amplitude_arr, self.stim_duration_arr,STG_DestinationEnumNet.channeldata_voltage)
+            device.PrepareAndSendData(0, amplitude, tData,stg.STG_DestinationEnumNet.channeldata_voltage)
         # For synchronization signal, assuming simple on/off logic
         #self.logger.debug(sync_pData)
         device.SendSyncData(UInt32(0), sync_pData, sync_tData)
 
-        # Start the stimulation based on the trigger configuration
-        device.SendStart(UInt32(1))
-
-        self.logger.debug("Stimulation started. Please wait for completion...")
-        # Wait for stimulation to complete based on the duration (simplified)
-        total_duration = (sum(self.stim_duration_arr)/1000000) #+ 0.00001  # Convert µs to seconds
-        total_duration_ns = sum(self.stim_duration_arr) * 1000
-        start_time_ns = perf_counter_ns()
-        while True:
-            elapsed_time_ns = perf_counter_ns() - start_time_ns
-            progress = min(100, (elapsed_time_ns / total_duration_ns) * 100)  # Calculate progress
-            # Update the GUI progress bar; ensure this operation is thread-safe
-            self.update_progress(progress)
-
-            if elapsed_time_ns >= total_duration_ns:
-                break  # Exit the loop once the total duration is reached
-        device.SendStop(1)
-        self.logger.debug("Stimulation completed. Disconnecting from device.")
-        device.Disconnect()
+        # Wait for stimulation to complete based on the trigger status, or the duration if the device never reports it
+        # Until the last sync pulse ends too, it can outlast the final train
+        monitor = CompletionMonitor(protocol.timeline.total_us, self.update_progress)
+        monitor.attach(device)
+        # The device stays connected between runs, so its poll handler has to go whatever happens
+        try:
+            if job is not None:
+                job.on_cancel(monitor.cancel)
+                job.on_cancel(lambda: device.SendStop(UInt32(1)))
+
+            # Start the stimulation based on the trigger configuration
+            if job is None or not job.cancelled:
+                self.last_upload_ms = (time.perf_counter() - upload_start) * 1e3
+                device.SendStart(UInt32(1))
+                monitor.start()
+
+                self.logger.debug("Stimulation started. Please wait for completion...")
+                if not monitor.wait():
+                    self.logger.debug("Stimulation cancelled.")
+        finally:
+            monitor.detach(device)
+            device.SendStop(1)
+        self.logger.debug("Stimulation completed.")
 
     def dat_data(self):
-        config = self.channel_data()
-        channels_data = {channel: [] for channel in range(1, 17)}    
-        # Helper function to add pulse data
-        def add_pulse_data(channel, pulse, value1, value2, duration):
-            channels_data[channel].append({
-                "pulse": pulse,
-                "value1": f"{value1:.3f}",
-                "value2": f"{value2:.3f}",
-                "time": duration
-            })
-        
-        # Initial delay for channel 1 and initial signal for channel 3
-        add_pulse_data(1, 0, 0.000, 0.000, 5050)  # Initial delay for channel 1
-        add_pulse_data(9, 0, 0.000, 0.000, 5050)  # Initial delay for channel 9
-        add_pulse_data(10, 0, 0.000, 1.000, 5000)  # Initial 5000 time unit on signal for channel 3
-        add_pulse_data(10, 0, 0.000, 0.000, 50)    # Followed by 50 time unit off signal for channel 3
-        
-        for train in range(config["total_trains"]):
-            for event in range(config["number_of_events"]):
-                # Assign waveform-specific values and add pulse data
-                if config["waveform"] == "Monophasic":
-                    total_time = config["number_of_events"] * (config["pulse_duration_microseconds"] + config["duration_between_events_microseconds"])
-                    add_pulse_data(1, 0, 0, config["amplitude_microamps"], config["pulse_duration_microseconds"])
-                    add_pulse_data(1, 0, 0, 0, config["duration_between_events_microseconds"])
-                    if event == config["number_of_events"] - 1:  # Add rest time at the end of each train, except after the last event
-                        add_pulse_data(1, 0, 0, 0, config["time_between_trains_microseconds"] - total_time)
-                elif config["waveform"] == "Biphasic":
-                    total_time = config["number_of_events"] * (2 * config["pulse_duration_microseconds"] + config["duration_between_events_microseconds"])
-                    # Biphasic waveform: first phase amplitude, then negative phase
-                    add_pulse_data(1, 0, 0, config["amplitude_microamps"], config["pulse_duration_microseconds"])
-                    add_pulse_data(1, 0, 0, -config["amplitude_microamps"], config["pulse_duration_microseconds"])
-                    add_pulse_data(1, 0, 0, 0, config["duration_between_events_microseconds"])
-                    if event == config["number_of_events"] - 1:
-                        add_pulse_data(1, 0, 0, 0, config["time_between_trains_microseconds"] - total_time)
-                elif config["waveform"] == "Sinusoidal":
-                    total_time = config["number_of_events"] * (config["period_microseconds"] + config["duration_between_events_microseconds"])
-                    # For simplicity, assuming each event in a sinusoidal train lasts for 'pulse_duration'
-                    add_pulse_data(1, 0, 0, config["amplitude_microamps"], config["pulse_duration_microseconds"])
-                    add_pulse_data(1, 0, 0, 0, config["duration_between_events_microseconds"])
-                    if event == config["number_of_events"] - 1:
-                        add_pulse_data(1, 0, 0, 0, config["time_between_trains_microseconds"] - total_time)
-
-        # Process external signal duration and delay from stimulus for relevant channels
-            add_pulse_data(9, 0, 0, 1.000, config["external_trigger_duration"])
-            add_pulse_data(9, 0, 0, 0.000, config["time_between_trains_microseconds"]-config["external_trigger_duration"])  # Example for external signal duration
-        return channels_data
+        # Channel rows as one repeated train block each, expanded while writing
+        return self.compiled_protocol().dat_channels
 
     def create_dat_file(self, file_path, dat_data):
-        config = self.channel_data()
-        with open(file_path, 'w') as file:
-            # Write header information
-            file.write("Multi Channel Systems MC_Stimulus II\n")
-            file.write("ASCII import Version 1.10\n\n")
-            file.write(f"channels:\t{int(len(dat_data)/2)}\n")
-            file.write(f"output mode:\t{'current' if self.gui.modulation_type_group.value == 'Current' else 'voltage'}\n")
-            file.write("format:\t5\n\n")
-            
-            # Iterate over each channel and its data
-            for channel, data in dat_data.items():
-                file.write(f"channel: {channel}\n")
-                file.write("pulse\tvalue\tvalue\ttime\n")
-                for row in data:
-                    file.write(f"{row['pulse']}\t{row['value1']}\t{row['value2']}\t{row['time']}\n")
-                file.write("\n")  # Add an empty line after each channel's data
+        config = self.compiled_protocol().config
+        output_mode = 'current' if config["modulation_type_group"] == 'Current' else 'voltage'
+        write_dat_file(file_path, dat_data, output_mode)
     
-    def start_stimulation(self):
-        def PollHandler(status, stgStatusNet, index_list):
-            self.logger.debug('%x %s' % (status, str(stgStatusNet.TiggerStatus[0])))
-
-        deviceList = CMcsUsbListNet(DeviceEnumNet.MCS_DEVICE_USB)
-        if deviceList.Count == 0:
-            self.logger.debug("No devices found")
-            return
-
-        device = CStg200xDownloadNet()
-        device.Stg200xPollStatusEvent += PollHandler
-        device.Connect(deviceList.GetUsbListEntry(0))
-
-        self.configure_device_and_send_data(device)
+    def start_stimulation(self, job=None, protocol=None):
+        # The connection stays open between runs, the manager reconnects if it went stale
+        self.last_protocol = None
+        device = self.devices.get()
+        if device is None:
+            # Fails the job, so the run is not reported or archived as done
+            raise DeviceNotFoundError("No STG found")
+        # The device is shared by every browser session, only one may upload and run at a time
+        with self.devices.running(device):
+            self.configure_device_and_send_data(device, job, protocol)
 
 
 class DynamicStimGui:
-    def __init__(self,logger=None):
+    def __init__(self,logger=None, lazy_tabs=True):
         self.logger = logger
+        self.lazy_tabs = lazy_tabs  # Build the Finalize tab the first time it is opened
         self.channel_buttons = {}  # Stores RadioButtonGroup for each channel
+        # Coalesces bursts of widget changes into one run of each recompute
+        self.changes = ChangeScheduler(delay_ms=50, call_later=self._call_later)
         self._setup_widgets()
         self._setup_layout()
         self._connect_callbacks()
@@ -337,6 +357,11 @@ class DynamicStimGui:
         self._setup_logging_and_debugger()
         self.final_tab_active = False
         self.graph_tab_active = False
+        self.runner = StimulationRunner(logger)
+        self.stimulation_job = None
+        self.last_latch_ms = float('nan')
+        self._doc = None
+        self.on_any_change(None)
 
         #self.upload_old_settings_button = pn.widgets.FileInput(accept='.json', name='Upload Old Settings')
 
@@ -469,7 +494,8 @@ class DynamicStimGui:
             self.channel_select_widgets.append(radio_button_group)  # Store the widget for later reference
 
         self.random_ca_button = pn.widgets.Button(name="Random Cathode/Anode", button_type="success")
-        self.serial_ports = ['None', self.get_serial_ports()]
+        # Ports are listed when the Channel Select tab is first opened
+        self.serial_ports = ['None']
         self.port_selector = pn.widgets.Select(name='Select Serial Port:', options=self.serial_ports)
 
         # Text area for showing selected port's info
@@ -558,12 +584,10 @@ class DynamicStimGui:
         self._update_visibility_and_content()
     def _connect_callbacks(self):
         #Event Settings
-        self.waveform_group.param.watch(self._update_visibility_and_content, 'value')
-        self.number_of_events_input.param.watch(self._update_visibility_and_content, 'value')
-        self.amplitude_slider.param.watch(self._update_visibility_and_content, 'value')
-        self.period_frequency_group.param.watch(self._update_visibility_and_content, 'value')
-        self.period_frequency_value_input.param.watch(self._update_visibility_and_content, 'value')
-        self.modulation_type_group.param.watch(self._update_visibility_and_content, 'value')
+        self.changes.watch_all([
+            self.waveform_group, self.number_of_events_input, self.amplitude_slider,
+            self.period_frequency_group, self.period_frequency_value_input, self.modulation_type_group,
+        ], [self._update_visibility_and_content])
         #self.phase_text.param.watch(self._update_visibility_and_content, 'value')
 
         # Randomize button clicks
@@ -581,7 +605,6 @@ class DynamicStimGui:
         self.pulse_duration_range_slider.param.watch(lambda event: self._update_range('pulse_duration', event.new), 'value')
         self.period_frequency_range_slider.param.watch(lambda event: self._update_range('period_frequency', event.new), 'value')
         self.duration_between_events_range_slider.param.watch(lambda event: self._update_range('duration_between_events', event.new), 'value')
-        self.set_to_pulse_duration.param.watch(lambda event: self._on_event_settings_changed, 'value')
 
         #Train Settings
         self.number_of_trains_input.param.watch(self._update_train_settings, 'value')
@@ -603,31 +626,29 @@ class DynamicStimGui:
 
         # Ensure updates based on event settings changes
         #self.amplitude_slider.param.watch(lambda event: self._update_time_based_on_event_settings(), 'value')
-        self.pulse_duration_slider.param.watch(self._on_event_settings_changed, 'value')
-        self.duration_between_events_slider.param.watch(self._on_event_settings_changed, 'value') if self.number_of_events_input.value > 1 else 0
-        self.number_of_events_input.param.watch(self._on_event_settings_changed, 'value')
-        self.set_to_pulse_duration.on_click(self._on_event_settings_changed)
+        self.set_to_pulse_duration.on_click(self._update_external_trigger_settings_based_on_event_duration)
         self.tabs.param.watch(self._on_graph_tab_active, 'active')
+        self.tabs.param.watch(self._on_channel_tab_active, 'active')
 
 
         self.port_selector.param.watch(self.show_port_info, 'value')
 
+        ### Channel Setting
+        self.random_ca_button.on_click(self.randomize_cathode_anode)
+
+    def _on_channel_tab_active(self, event):
+        if self.tabs.active == 4 and self.serial_ports == ['None']:
+            self.serial_ports = ['None'] + self.get_serial_ports()
+            self.port_selector.options = self.serial_ports
+
     def _on_graph_tab_active(self, event):
         # Check if the "Projected Graphs" tab is currently active
         if self.tabs.active == 3:
             # Call the update functions for the projected graphs
             self.graph_tab_active = True
-            self.on_any_change(None)  # Assuming this function is correctly defined elsewhere
             self.update_projected_graphs()  # Assuming this function is correctly defined elsewhere
         else:
             self.graph_tab_active = False
-    def _on_event_settings_changed(self, event):
-        #self._update_external_trigger_settings_based_on_event_duration()
-
-        ### Channel Setting
-        self.random_ca_button.on_click(self.randomize_cathode_anode)
-        self.set_to_pulse_duration.on_click(self._update_external_trigger_settings_based_on_event_duration)
-
 
     def _update_visibility_and_content(self, event=None):
         is_sinusoidal = self.waveform_group.value == 'Sinusoidal'
@@ -700,16 +721,14 @@ class DynamicStimGui:
     def _randomize_duration_between_events(self, event):
         self.duration_between_events_slider.value = random.randint(*self.duration_between_events_range_slider.value)
 
+    def _timeline(self):
+        # Durations of the current settings, from the same model the compiler uses
+        return Timeline(normalize_config(self.get_updated_data()))
+
     def _update_train_settings(self, event):
-        # Calculate the minimum value for the train duration slider
-        duration_between_events = self.duration_between_events_slider.value if self.number_of_events_input.value > 1 else 0
-        if self.waveform_group.value == 'Monophasic':
-            min_duration = (self.pulse_duration_slider.value + duration_between_events) * self.number_of_events_input.value
-        elif self.waveform_group.value == 'Biphasic':
-            min_duration = (2 * self.pulse_duration_slider.value + duration_between_events) * self.number_of_events_input.value
-        elif self.waveform_group.value == 'Sinusoidal':
-            min_duration = (self.period_frequency_value_input.value + duration_between_events) * self.number_of_events_input.value
-        self.train_duration_slider.start = max(0, min_duration)  # Ensure minimum is not negative
+        # A train cannot be shorter than its events, in the train duration's unit
+        min_duration = self._timeline().train_active_us / convert_to_micro(1, self.train_duration_unit_selector.value)
+        self.train_duration_slider.start = max(0, math.ceil(min_duration))  # Ensure minimum is not negative
 
     def _update_train_settings_visibility(self, event):
         is_external = self.accept_external_trigger.value
@@ -729,23 +748,8 @@ class DynamicStimGui:
         self.external_trigger_duration.value = np.random.randint(0, max_duration + 1)
     
     def _calculate_total_event_duration(self):
-        
-        # Assuming the pulse_duration_slider value is in the unit selected in pulse_duration_unit_selector
-        unit_multiplier = {'us': 1, 'ms': 1000, 's': 1000000}
-        if self.waveform_group.value == 'Monophasic':
-            pulse_duration_in_us = self.pulse_duration_slider.value * unit_multiplier[self.pulse_duration_unit_selector.value]
-        elif self.waveform_group.value == 'Biphasic':
-            pulse_duration_in_us = 2 * self.pulse_duration_slider.value * unit_multiplier[self.pulse_duration_unit_selector.value]
-        # Same for duration between events
-        if self.number_of_events_input.value > 1:
-            duration_between_events_in_us = self.duration_between_events_slider.value * unit_multiplier[self.duration_between_events_unit_selector.value]
-        else:
-            duration_between_events_in_us = 0
-
-        # Total duration of all events in microseconds
-        total_event_duration_in_us = (pulse_duration_in_us + duration_between_events_in_us) * self.number_of_events_input.value
-        print(total_event_duration_in_us)
-        return total_event_duration_in_us
+        # Length of one train of events in microseconds
+        return self._timeline().train_active_us
     
     def _convert_duration_and_unit(self, duration_microseconds):
         if duration_microseconds >= 1000000:  # More than 1 second
@@ -806,7 +810,6 @@ class DynamicStimGui:
             #amplitude_uA_uV = self.amplitude_slider.value * unit_multiplier_amp[self.amplitude_unit_selector.value]
             modulation_type_val = self.amplitude_unit_selector.value
         
-        delay_between_trains_us = self.train_duration_slider.value * unit_multiplier[self.train_duration_unit_selector.value]
         # Generate the single event plot
         single_event_plot = self.generate_single_event_plot(
             self.amplitude_slider.value, 
@@ -819,20 +822,8 @@ class DynamicStimGui:
             self.period_frequency_group.value,
             modulation_type_val
         )
-        full_sequence_plot = self.generate_full_sequence_plot(
-            self.amplitude_slider.value, 
-            2* pulse_duration_us if self.waveform_group.value=='Biphasic' else pulse_duration_us,
-            self.waveform_group.value,
-            self.number_of_events_input.value,
-            duration_between_events_us,
-            trigger_duration_us,
-            self.number_of_trains_input.value,
-            delay_between_trains_us,
-            self.period_frequency_value_input.value,
-            self.period_frequency_group.value,
-            modulation_type_val
-
-        )
+        # Every waveform, sampled sines included, is drawn from the compiled segments
+        full_sequence_plot = self.generate_full_sequence_plot(modulation_type_val)
 
         self.projected_graphs_layout.clear()
         self.projected_graphs_layout.extend([pn.panel(single_event_plot), pn.panel(full_sequence_plot)])
@@ -841,7 +832,7 @@ class DynamicStimGui:
         # Logic for single event plot generation adjusted for correct sine wave...
         if number_of_events == 1:
             duration_between_events = 0
-        event_duration = self._calculate_event_length(waveform_type, pulse_duration, duration_between_events, number_of_events)
+        event_duration = self._timeline().train_active_us
         time = np.linspace(-event_duration/10, event_duration+event_duration/10, 10000)
         pulse = np.zeros_like(time)
         #print(np.shape(pulse))
@@ -885,6 +876,8 @@ class DynamicStimGui:
         trigger_end = trigger_duration
         trigger[(time >= trigger_start) & (time <= trigger_end)] = trigger_height
 
+        import pandas as pd
+        import hvplot.pandas  # Registers df.hvplot
         df = pd.DataFrame({'Time': time, 'Pulse': pulse, 'Trigger': trigger})
         plot = df.hvplot.line(
             x='Time', y=['Pulse', 'Trigger'], color=['blue', 'red'], height=400, width=600,
@@ -895,98 +888,31 @@ class DynamicStimGui:
         return plot
 
 
-    def generate_full_sequence_plot(self, amplitude, pulse_duration, waveform_type, number_of_events, duration_between_events, trigger_duration, number_of_trains, delay_between_trains, period_frequency, period_frequency_type, modulation_type):
-        if number_of_events == 1:
-            duration_between_events = 0
-        if waveform_type == 'Sinusoidal':
-            # Calculate waveform duration based on input type (period or frequency)
-            if period_frequency_type == 'Period':
-                wave_duration = period_frequency
-            else:  # Frequency given
-                wave_duration = 1 / period_frequency if period_frequency != 0 else 0
-            event_duration = number_of_events * (wave_duration + duration_between_events)
-            total_duration = number_of_trains * (number_of_events * (wave_duration + duration_between_events) - duration_between_events) + (number_of_trains - 1) * delay_between_trains
-            time = np.linspace(0, total_duration, int(10000 * total_duration / event_duration))
-            pulse = np.zeros_like(time)
-            trigger = np.zeros_like(time)
-            trigger_height = amplitude if amplitude > 0 else -amplitude
-
-            for n in range(number_of_trains):
-                train_start_time = n * (number_of_events * (wave_duration + duration_between_events) - duration_between_events + delay_between_trains)
-                for i in range(number_of_events):
-                    start_time = train_start_time + i * (wave_duration + duration_between_events)
-                    end_time = start_time + wave_duration
-                    mask = (time >= start_time) & (time < end_time)
-                    num_points = np.sum(mask)
-                    sine_wave = amplitude * np.sin(2 * np.pi * np.linspace(0, wave_duration, num_points) / wave_duration)
-                    pulse[mask] = sine_wave
-
-            # Setting up the trigger for each event
-            for n in range(number_of_trains):
-                for i in range(number_of_events):
-                    trigger_start_time = n * (number_of_events * (wave_duration + duration_between_events) - duration_between_events + delay_between_trains) + i * (wave_duration + duration_between_events)
-                    trigger_end_time = trigger_start_time + trigger_duration
-                    trigger[(time >= trigger_start_time) & (time < trigger_end_time)] = trigger_height
-            total_simulation_duration=total_duration
-        else:
-        # Determine the total duration of a single train including delays between events
-            single_train_duration = self._calculate_event_length(waveform_type, pulse_duration, duration_between_events, number_of_events)
-            
-            # Total simulation time includes all trains and delays between them
-            total_simulation_duration = number_of_trains * single_train_duration + (number_of_trains - 1) * delay_between_trains
-            
-            time = np.linspace(0, total_simulation_duration, 100000 * number_of_trains)
-            pulse = np.zeros_like(time)
-
-            for n in range(number_of_trains):
-                train_start_time = n * (single_train_duration + delay_between_trains)
-                
-                for i in range(number_of_events):                
-                    if waveform_type == 'Monophasic':
-                        event_start_time = train_start_time + i * (pulse_duration + duration_between_events)
-                        event_end_time = event_start_time + pulse_duration
-                        pulse[(time >= event_start_time) & (time < event_end_time)] = amplitude
-                    elif waveform_type == 'Biphasic':
-                        event_start_time = train_start_time + i * (pulse_duration + duration_between_events)
-                        event_end_time = event_start_time + pulse_duration
-                        pulse[(time >= event_start_time) & (time < event_start_time + pulse_duration/2)] = amplitude
-                        pulse[(time >= event_start_time + pulse_duration/2) & (time < event_end_time)] = -amplitude            
-            # Assuming the trigger starts with the first event of each train and lasts for 'trigger_duration'
-                trigger = np.zeros_like(time)
-                for n in range(number_of_trains):
-                    train_start_time = n * (single_train_duration + delay_between_trains)
-                    trigger_start_time = train_start_time
-                    trigger_end_time = trigger_start_time + trigger_duration
-                    trigger[(time >= trigger_start_time) & (time <= trigger_end_time)] = amplitude if amplitude > 0 else -amplitude
-
-        df = pd.DataFrame({'Time': time, 'Pulse': pulse, 'Trigger': trigger})
-        plot = df.hvplot.line(
-            x='Time', y='Pulse', color='blue', height=400, width=800,
-            xlim=(0, total_simulation_duration),
-            ylim=(-1.1 * abs(amplitude), 1.1 * abs(amplitude)),
-            xlabel='Time (us)', ylabel=f'Amplitude ({modulation_type})'
-        ).opts(title="Full Sequence Plot", framewise=True, shared_axes=False) * \
-        df.hvplot.line(x='Time', y='Trigger', color='red', height=400, width=800).opts(framewise=True, shared_axes=False)
-        return plot
-
-
-
-    def _calculate_event_length(self, waveform_type, pulse_duration, duration_between_events, number_of_events):
-        # Here's a basic calculation. Adjust according to your waveform definitions.
-        if number_of_events == 1:
-            duration_between_events = 0
-        if waveform_type == 'Monophasic':
-            return (pulse_duration + duration_between_events) * number_of_events 
-        elif waveform_type == 'Biphasic':
-            return (pulse_duration + duration_between_events)  * number_of_events   # Considering both phases
-        elif waveform_type == 'Sinusoidal':
-            # Assuming 'pulse_duration' represents one full cycle of the sine wave
-            return (pulse_duration + duration_between_events)  * number_of_events
-        else:
-            return 0  # Default case, should not happen
-
-
-
+    def generate_full_sequence_plot(self, modulation_type):
+        # Drawn from the breakpoints of the compiled pulse train as a step function,
+        # decimated to the plot width and re-queried whenever the x range changes
+        import holoviews as hv
+        protocol = self.controller.compiled_protocol()
+        (stim_times, stim_values), (sync_times, sync_values) = protocol.breakpoints
+        # The protocol is shared by every unit spelling of the same settings, scale to the selected unit
+        amplitude = self.amplitude_slider.value
+        stim_values = stim_values / convert_to_micro(1, self.amplitude_unit_selector.value)
+        sync_values = sync_values * abs(amplitude)
+        total_duration = protocol.timeline.total_us
+
+        def render(x_range=None, width=None, height=None, scale=1.0):
+            pixels = int(width or 800)
+            pulse = hv.Curve(decimate_steps(stim_times, stim_values, x_range, pixels), 'Time', 'Amplitude')
+            trigger = hv.Curve(decimate_steps(sync_times, sync_values, x_range, pixels), 'Time', 'Amplitude')
+            return pulse.opts(color='blue') * trigger.opts(color='red')
+
+        plot = hv.DynamicMap(render, streams=[hv.streams.RangeX(), hv.streams.PlotSize()])
+        return plot.opts(
+            hv.opts.Curve(height=400, width=800, xlim=(0, total_duration),
+                          ylim=(-1.1 * abs(amplitude), 1.1 * abs(amplitude)),
+                          xlabel='Time (us)', ylabel=f'Amplitude ({modulation_type})'),
+            hv.opts.Overlay(title="Full Sequence Plot", shared_axes=False)
+        )
 
     def randomize_cathode_anode(self, event=None):
         # First, ensure all channels are reset to 'Floating'
@@ -1002,12 +928,14 @@ class DynamicStimGui:
 
     def get_serial_ports(self):
         """Returns a list of serial ports (COM ports) available on the system."""
+        import serial.tools.list_ports
         ports = serial.tools.list_ports.comports()
         port_list = [port.device for port in ports]  # Extracts port names
         return port_list
 
     # Function to display selected port's details
     def show_port_info(self, event):
+        import serial.tools.list_ports
         selected_port = event.new
         ports = serial.tools.list_ports.comports()
         for port in ports:
@@ -1021,6 +949,14 @@ class DynamicStimGui:
 
 
     def _setup_finalize_tab(self):
+        self.finalize_tab_layout = pn.Row()
+        self.finalize_built = False
+        self.tabs.param.watch(self._on_final_tab_active, 'active')
+        self.tabs.append(('Finalize', self.finalize_tab_layout))
+        if not self.lazy_tabs:
+            self._build_finalize_tab()
+
+    def _build_finalize_tab(self):
         self.comment_input = pn.widgets.TextInput(name="Comments", 
                                                   placeholder="Add any comment here...")
         self.save_config_button = pn.widgets.Button(name="Save Configuration", 
@@ -1031,7 +967,9 @@ class DynamicStimGui:
                                                         button_type="primary")
         self.back_button = pn.widgets.Button(name="Back", button_type="danger", 
                                              visible=False)
-        self.directory_selector = pn.widgets.FileSelector(os.path.join(os.environ['USERPROFILE'], 'Desktop'))
+        self.cancel_run = pn.widgets.Button(name="Cancel Stimulation", button_type="danger",
+                                            visible=False)
+        self.directory_selector = pn.widgets.FileSelector(os.path.join(os.environ.get('USERPROFILE', os.path.expanduser('~')), 'Desktop'))
         self.download_json = pn.widgets.Button(name="Download .JSON", 
                                                button_type="success", visible=False)
         self.download_dat = pn.widgets.Button(name="Download .DAT", 
@@ -1041,9 +979,10 @@ class DynamicStimGui:
         self.filename_input = pn.widgets.TextInput(name="Filename", 
                                                    placeholder="Enter filename here", 
                                                    visible=False)
+        # Settings the STG cannot play, or will play rounded
+        self.validation_alert = pn.pane.Alert("", alert_type='danger', visible=False)
         self.file_extension_label_json = pn.pane.Markdown(".json", visible=False)  # Default to .json; adjust as needed
         self.file_extension_label_dat = pn.pane.Markdown(".dat", visible=False)  # Default to .dat; adjust as needed    
-        self.file_extension_label_csv = pn.pane.Markdown(".csv", visible=False)  # Default to .csv; adjust as needed    
 
         # Setup the FileDownload widget without a file for now
         self.file_download = pn.widgets.FileDownload(filename='', 
@@ -1063,11 +1002,12 @@ class DynamicStimGui:
         self.download_json.on_click(self.download_configuration)
         self.download_dat.on_click(self.download_dat_file)
         self.start_run.on_click(self.run_stimulation)
+        self.cancel_run.on_click(self.cancel_stimulation)
         self.upload_settings_button.param.watch(self.load_settings_from_file, 'value')
-        self.comment_input.param.watch(lambda event: self.comment_added(event.new), 'value')
         #self.debug.param.watch(self.running_program())
         
         self.dynamic_finalize_layout = pn.Column(
+            self.validation_alert,
             self.comment_input,
             self.save_config_button,
             self.save_dat_button,
@@ -1075,19 +1015,23 @@ class DynamicStimGui:
             self.upload_settings_button,
             #self.file_download  # Include the FileDownload widget in the layout
         )
-        self.table = pn.pane.DataFrame(pd.DataFrame())
-        self.finalize_tab_layout = pn.Row(self.table, self.dynamic_finalize_layout)
-        #self.update_table_data(None)
-        self.tabs.param.watch(self._on_final_tab_active, 'active')
-        self.tabs.append(('Finalize', self.finalize_tab_layout))        
+        self.table_model = TableModel(width=500, height=460)
+        self._channel_values = None
+        self.table = pn.pane.Bokeh(self.table_model.view)
+        self.finalize_tab_layout.extend([self.table, self.dynamic_finalize_layout])
+        self.changes.watch(self.comment_input, self.update_table_data)
+        self.finalize_built = True
 
     def _on_final_tab_active(self, event):
         # Check if the "Projected Graphs" tab is currently active
         if self.tabs.active == 5:
+            if not self.finalize_built:
+                self._build_finalize_tab()
             self.final_tab_active = True
             # Call the update functions for the projected graphs
             #self.on_any_change(None)  # Assuming this function is correctly defined elsewhere
             self.update_table_data(None)  # Assuming this function is correctly defined elsewhere
+            self.update_validation()
             
         else:
             self.final_tab_active = False
@@ -1121,23 +1065,6 @@ class DynamicStimGui:
         self.directory_selector.visible = True
         self.download_dat.visible = True
         self.file_extension_label_dat.visible = True
-    def download_csv_file(self,event):
-        selected_directory = self.directory_selector.value[0]  # Assuming the directory is the first selected item
-        now = pendulum.now()
-        date_str =  now.format("YYYY-MM-DD_HH-mm-ss")
-        filename = f"{self.filename_input.value}{date_str}.csv"
-        config = self.get_updated_data()
-        df = pd.DataFrame(list(config.items()), columns=['Name', 'Value'])
-        # Exporting the DataFrame to a CSV file
-        csv_path = os.path.join(selected_directory, filename)  # Combine into a full path
-        df_T = df.T
-        print(df_T.head())
-        print(df_T.iloc[0])
-        df_T.columns = df_T.iloc[0]
-        # Remove the first row from the DataFrame
-        df_T = df_T[1:].reset_index(drop=True)
-        df_T.to_csv(csv_path, index=False)
-
     def download_configuration(self, event):
         # Save the current configuration to a JSON file
         selected_directory = self.directory_selector.value[0]  # Assuming the directory is the first selected item
@@ -1219,6 +1146,7 @@ class DynamicStimGui:
     def show_original_finalize_layout(self, event=None):
         self.dynamic_finalize_layout.clear()
         self.dynamic_finalize_layout.extend([
+            self.validation_alert,
             self.comment_input,
             self.save_config_button,
             self.save_dat_button,
@@ -1230,56 +1158,48 @@ class DynamicStimGui:
         self.download_json.visible = False
         self.download_dat.visible = False
     def on_any_change(self, event):
+        # Registered once through the scheduler, so calling this again adds no watchers
         watched_widgets = [
             self.waveform_group, self.modulation_type_group, self.amplitude_slider, 
             self.pulse_duration_slider, self.pulse_duration_unit_selector, self.number_of_events_input,
             self.duration_between_events_slider, self.duration_between_events_unit_selector,
             self.period_frequency_group, self.period_frequency_value_input, self.number_of_trains_input,
             self.train_duration_slider, self.accept_external_trigger, self.external_trigger_duration,
-            self.external_trigger_duration_unit_selector, self.comment_input,
+            self.external_trigger_duration_unit_selector,
+            *self.channel_select_widgets,
             # Include any other widgets that affect the table data
         ]
-
-        for widget in watched_widgets:
-            widget.param.watch(self.on_any_change, 'value')
-    def setup_bb_map(self):
-        widget_vals = {(i, widget.value) for i, widget in enumerate(self.channel_select_widgets)}
-        sorted_widget_vals = sorted(list(widget_vals))
-
-        # Define the mapping for the values
+        self.changes.watch_all(watched_widgets, [self.update_table_data, self.update_projected_graphs,
+                                                 self.update_validation])
+
+    def _call_later(self, delay_ms, callback):
+        # Run on the session's event loop when served, so recomputes never race widget events
+        doc = pn.state.curdoc
+        if doc is not None and doc.session_context is not None:
+            doc.add_timeout_callback(callback, delay_ms)
+        else:
+            timer_call_later(delay_ms, callback)
+    def channel_letters(self):
+        # One of 'F', 'C', 'A', 'G' per channel, in channel order
         value_map = {
             'Floating': 'F',
             'Ground': 'G',
             'Cathode': 'C',
             'Anode': 'A'
         }
+        return [value_map[widget.value] for widget in self.channel_select_widgets]
 
-        # Initialize an empty list to store the mapped values
-        mapped_values = []
-
-        # Iterate through the sorted widget values and apply the mapping
-        for index, value in sorted_widget_vals:
-            mapped_values.append(value_map[value])
-
-        # Convert the mapped values list to a string and format it as requested
-        formatted_output_with_index = "["
-
-        # Iterate through the sorted widget values and include the index in hexadecimal format followed by its mapped value
-        for index, value in sorted_widget_vals:
-            formatted_output_with_index += f"{index:X}{value_map[value]}"
-
-        # Close the formatted string
-        formatted_output_with_index += "]"
-
-        return formatted_output_with_index
+    def setup_bb_map(self):
+        # ASCII form of the channel map, e.g. "[0F1G2C...FA]"
+        return ascii_channel_map(self.channel_letters())
 
 
     def set_run(self, event):
         self.dynamic_finalize_layout.clear()
         self.dynamic_finalize_layout.extend([
-            pn.pane.Markdown('You are almost there! Set the file location for your .csv file.'),
+            pn.pane.Markdown('You are almost there! Name the run and pick the folder for the session archive.'),
             self.back_button,
-            pn.Row(self.filename_input,self.file_extension_label_csv),
+            self.filename_input,
             self.directory_selector,
             self.start_run
         ])
@@ -1287,23 +1207,104 @@ class DynamicStimGui:
         self.directory_selector.visible = True
         self.start_run.visible = True
         self.filename_input.visible = True
-        self.file_extension_label_csv.visible = True
+    def update_validation(self, event=None):
+        # Cheap enough for every change: only the train block and timeline are checked
+        if not self.final_tab_active or not hasattr(self, 'controller'):
+            return []
+        issues = self.controller.validate()
+        self.validation_alert.object = "\n".join(f"- **{issue.level}**: {issue.message}" for issue in issues)
+        self.validation_alert.alert_type = 'danger' if errors(issues) else 'warning'
+        self.validation_alert.visible = bool(issues)
+        self.run_stimulation_button.disabled = bool(errors(issues))
+        return issues
+
     def run_stimulation(self, event):
+        if self.runner.busy():
+            self.logger.debug("A stimulation is already running.")
+            return
+        problems = errors(self.controller.validate())
+        if problems:
+            for issue in problems:
+                self.logger.error(issue.message)
+            self.show_original_finalize_layout()
+            self.update_validation()
+            return
         self._update_visibility_and_content()
-        self.download_csv_file(None)
         self.running_program(None)
         self.update_table_data(None)  # Update any GUI components as necessary after starting the stimulation
-        if self.port_selector.value != 'None':
-            self.brainsboard.connect(self.port_selector.value)
-            print(self.setup_bb_map())
-            self.brainsboard.send_command(self.setup_bb_map())
-        self.controller.start_stimulation()  # Assuming start_stimulation is implemented
-        if self.port_selector.value != 'None':
-            self.brainsboard.close()
+        # Progress is pushed back through this session's document from the worker thread
+        self._doc = pn.state.curdoc
+        port = self.port_selector.value
+        bb_map = self.channel_letters()
+        # The run is recorded with the protocol that gets uploaded, see _on_stimulation_done
+        protocol = self.controller.compiled_protocol()
+        try:
+            archive = self.session_archive(self.directory_selector.value[0])
+        except Exception:
+            self.logger.exception("Could not open the session archive, the run will not be recorded")
+            archive = None
+        label = self.filename_input.value
+        self.stimulation_job = self.runner.submit(
+            lambda job: self._run_stimulation_job(job, port, bb_map, protocol),
+            on_done=lambda job: self._on_stimulation_done(job, archive, label, protocol,
+                                                          bb_map if port != 'None' else None))
+
+    def _run_stimulation_job(self, job, port, bb_map, protocol=None):
+        self.last_latch_ms = float('nan')
+        if port != 'None':
+            self.brainsboard.connect(port)
+            latency = self.brainsboard.send_channel_map(bb_map)
+            if latency is not None:
+                self.last_latch_ms = latency * 1e3
+        try:
+            self.controller.start_stimulation(job, protocol)
+        finally:
+            if port != 'None':
+                self.brainsboard.close()
+
+    def session_archive(self, directory):
+        # One archive per output folder, shared by every run and browser session saving there
+        return get_session_archive(os.path.join(directory, SESSION_ARCHIVE_DIRECTORY))
+
+    def _on_stimulation_done(self, job, archive=None, label='', protocol=None, bb_map=None):
+        self.logger.debug(f"Stimulation {job.status}.")
+        # A failed job may never have reached the device, only runs that played are archived
+        if archive is not None and job.status != FAILED:
+            # A failed write must not leave the window in the running state
+            try:
+                # The upload may have resampled a sine at the device's resolution
+                protocol = self.controller.last_protocol or protocol
+                run_ms = (job.finished_at - job.started_at) * 1e3
+                run = archive.append(protocol, bb_map, label, job.status, job.started_at,
+                                     upload_ms=self.controller.last_upload_ms, latch_ms=self.last_latch_ms,
+                                     run_ms=run_ms)
+                self.logger.debug(f"Run {run} archived in {archive.directory}")
+            except Exception:
+                self.logger.exception(f"Could not archive the run in {archive.directory}")
+        def callback():
+            self.cancel_run.visible = False
+        if self._doc is not None:
+            self._doc.add_next_tick_callback(callback)
+        else:
+            callback()
+
+    def cancel_stimulation(self, event=None):
+        if self.stimulation_job is not None and self.stimulation_job.cancel():
+            self.logger.debug("Cancelling stimulation...")
+
+    def schedule_progress_update(self, progress):
+        """Schedules a progress bar update on the next tick."""
+        def callback():
+            self.progress_bar.value = int(progress)
+            self.progress_percent.value = int(progress)
+        if self._doc is not None:
+            self._doc.add_next_tick_callback(callback)
+        else:
+            callback()
 
         
 
-    def update_table_data(self, event):
+    def update_table_data(self, event=None):
         if not self.final_tab_active:
         # If the tab is not active, skip the update
             return
@@ -1336,19 +1337,25 @@ class DynamicStimGui:
             ]
             }
 
-        # Collect channel configurations
-        channel_configs = {"Floating": [], "Cathode": [], "Anode": [], "Ground": []}
-        for i, widget in enumerate(self.channel_select_widgets, start=1):
-            channel_configs[widget.value].append(str(i))
-        
         # Append channel configurations to the data dictionary
-        for config, channels in channel_configs.items():
+        for config, channels in self._channel_rows():
             data["Parameter"].append(config)
-            data["Value"].append(", ".join(channels) if channels else "None")
-
-        # Create DataFrame and update the table
-        self.df = pd.DataFrame(data)
-        self.table.object = self.df#.to_dict('list')  # Update the DataFrame widget with new data
+            data["Value"].append(channels)
+
+        # Only the cells that changed are sent to the table
+        self.table_model.update(list(zip(data["Parameter"], data["Value"])))
+
+    def _channel_rows(self):
+        # Channel grouping is only recomputed when a channel setting changed
+        values = tuple(widget.value for widget in self.channel_select_widgets)
+        if values != self._channel_values:
+            channel_configs = {"Floating": [], "Cathode": [], "Anode": [], "Ground": []}
+            for i, value in enumerate(values, start=1):
+                channel_configs[value].append(str(i))
+            self._channel_values = values
+            self._channel_rows_cache = [(config, ", ".join(channels) if channels else "None")
+                                        for config, channels in channel_configs.items()]
+        return self._channel_rows_cache
     def comment_added(self, event):
         self.update_table_data(None)
     def load_settings_from_file(self, event):
@@ -1391,9 +1398,11 @@ class DynamicStimGui:
             pn.pane.Markdown('Running file.'),
             self.back_button,
             pn.Row(self.progress_bar, self.progress_percent),
+            self.cancel_run,
             self.debugger,
         ])
         self.back_button.visible = True
+        self.cancel_run.visible = True
         self.debugger.visible = True
         self.progress_bar.visible = True
         self.progress_percent.visible = True
@@ -1403,9 +1412,11 @@ class DynamicStimGui:
         return self.tabs
 
 # To use the class and display the GUI in a notebook or as a Panel app
-stim_gui = DynamicStimGui(logger=logger)
-brainsboard = BRAINSBoard(stim_gui, logger=logger)
-controller = STGDeviceController(stim_gui, logger=logger)
-stim_gui.controller = controller
-stim_gui.brainsboard = brainsboard
-stim_gui.show().servable().show('Stimulation Gui')
\ No newline at end of file
+# (guarded so benchmarks can import the controller without starting a server)
+if __name__ == "__main__" or __name__.startswith("bokeh"):
+    stim_gui = DynamicStimGui(logger=logger)
+    brainsboard = BRAINSBoard(stim_gui, logger=logger)
+    controller = STGDeviceController(stim_gui, logger=logger)
+    stim_gui.controller = controller
+    stim_gui.brainsboard = brainsboard
+    stim_gui.show().servable().show('Stimulation Gui')
\ No newline at end of file
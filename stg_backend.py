@@ -0,0 +1,356 @@
+import ctypes
+import functools
+import os
+import threading
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+
+# Selects the API used to talk to the MCS STG.
+#   STG_BACKEND=mcs        (default) McsUsbNet.dll through pythonnet, Windows only
+#   STG_BACKEND=simulated  pure-Python stand-in that records every call and
+#                          models the USB transfer cost, runs anywhere
+# MCS_USB_DLL overrides the location of McsUsbNet.dll for the mcs backend.
+#
+# Both namespaces provide from_numpy(values, element_type), which turns a NumPy
+# array into the array type the device calls expect in one bulk copy.
+
+DEFAULT_DLL_PATH = r"C:\Users\denma\Documents\GitHub\McsUsbNet_Examples-master\McsUsbNet\x64\McsUsbNet.dll"
+
+
+def load_backend(name=None):
+    """Return a namespace with the Mcs.Usb classes and System array types for `name`."""
+    name = name or os.environ.get('STG_BACKEND', 'mcs')
+    if name == 'simulated':
+        return SimpleNamespace(
+            name='simulated',
+            CMcsUsbListNet=SimulatedUsbList,
+            DeviceEnumNet=SimulatedDeviceEnum,
+            CStg200xDownloadNet=SimulatedStg200x,
+            STG_DestinationEnumNet=SimulatedDestinationEnum,
+            Array=Array, UInt16=UInt16, UInt32=UInt32, Int32=Int32, UInt64=UInt64,
+            from_numpy=simulated_from_numpy,
+        )
+    if name == 'mcs':
+        import clr
+        clr.AddReference(os.environ.get('MCS_USB_DLL', DEFAULT_DLL_PATH))
+        from System import Array as NetArray, UInt16 as NetUInt16, UInt32 as NetUInt32
+        from System import Int32 as NetInt32, UInt64 as NetUInt64
+        from System.Runtime.InteropServices import GCHandle, GCHandleType
+        from Mcs.Usb import CMcsUsbListNet, DeviceEnumNet, CStg200xDownloadNet, STG_DestinationEnumNet
+        dtypes = {NetUInt16: np.uint16, NetUInt32: np.uint32, NetInt32: np.int32, NetUInt64: np.uint64}
+
+        def from_numpy(values, element_type):
+            # Pin a new .NET array and memmove the NumPy buffer into it, no per-element marshalling
+            values = np.ascontiguousarray(values, dtype=dtypes[element_type])
+            net_array = NetArray.CreateInstance(element_type, len(values))
+            if len(values):
+                handle = GCHandle.Alloc(net_array, GCHandleType.Pinned)
+                try:
+                    ctypes.memmove(handle.AddrOfPinnedObject().ToInt64(), values.ctypes.data, values.nbytes)
+                finally:
+                    handle.Free()
+            return net_array
+
+        return SimpleNamespace(
+            name='mcs',
+            CMcsUsbListNet=CMcsUsbListNet,
+            DeviceEnumNet=DeviceEnumNet,
+            CStg200xDownloadNet=CStg200xDownloadNet,
+            STG_DestinationEnumNet=STG_DestinationEnumNet,
+            Array=NetArray, UInt16=NetUInt16, UInt32=NetUInt32, Int32=NetInt32, UInt64=NetUInt64,
+            from_numpy=from_numpy,
+        )
+    raise ValueError(f"Unknown STG backend {name!r}, expected 'mcs' or 'simulated'")
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend(name=None):
+    """load_backend() once per process, on first use."""
+    return load_backend(name)
+
+
+### SYSTEM TYPES
+# Integer "constructors" and Array[T](values) mimic the pythonnet System types
+# closely enough for the upload code, and remember the element size so the
+# simulated device can account for transferred bytes.
+
+def UInt16(value):
+    return int(value) & 0xFFFF
+
+
+def UInt32(value):
+    return int(value) & 0xFFFFFFFF
+
+
+def Int32(value):
+    return int(value)
+
+
+def UInt64(value):
+    return int(value) & 0xFFFFFFFFFFFFFFFF
+
+
+_ITEM_SIZES = {UInt16: 2, UInt32: 4, Int32: 4, UInt64: 8}
+
+
+class SimulatedArray(list):
+    def __init__(self, values, itemsize):
+        super().__init__(values)
+        self.itemsize = itemsize
+
+    @property
+    def Length(self):
+        return len(self)
+
+
+class _ArrayFactory:
+    def __getitem__(self, element_type):
+        itemsize = _ITEM_SIZES[element_type]
+        return lambda values: SimulatedArray((element_type(v) for v in values), itemsize)
+
+
+Array = _ArrayFactory()
+
+_DTYPES = {UInt16: np.uint16, UInt32: np.uint32, Int32: np.int32, UInt64: np.uint64}
+
+
+def simulated_from_numpy(values, element_type):
+    # The stand-in device works on the NumPy buffer directly
+    return np.ascontiguousarray(values, dtype=_DTYPES[element_type])
+
+
+### MCS.USB STAND-INS
+
+SimulatedDeviceEnum = SimpleNamespace(MCS_DEVICE_USB='MCS_DEVICE_USB')
+SimulatedDestinationEnum = SimpleNamespace(channeldata_current='channeldata_current',
+                                           channeldata_voltage='channeldata_voltage',
+                                           syncoutdata='syncoutdata')
+
+UsbListEntry = namedtuple('UsbListEntry', ['DeviceName', 'SerialNumber'])
+
+
+class SimulatedUsbList:
+    # Serial numbers of the simulated devices, one entry per "plugged in" STG
+    devices = [UsbListEntry('STG5008 (simulated)', 'SIM-0001')]
+
+    def __init__(self, device_enum=None):
+        self.entries = list(self.devices)
+
+    @property
+    def Count(self):
+        return len(self.entries)
+
+    def GetUsbListEntry(self, index):
+        return self.entries[index]
+
+
+CallRecord = namedtuple('CallRecord', ['name', 'start', 'end', 'nbytes', 'args'])
+
+
+class _PollStatusEvent:
+    # Supports the `device.Stg200xPollStatusEvent += handler` syntax of pythonnet events
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def __call__(self, *args):
+        for handler in list(self.handlers):
+            handler(*args)
+
+
+class SimulatedStg200x:
+    """Pure-Python CStg200xDownloadNet with a simple USB cost model.
+
+    Every call sleeps for `call_latency` seconds plus the payload size divided
+    by `bytes_per_second`, and is appended to `calls` with its timestamps.
+    """
+
+    def __init__(self, call_latency=0.0005, bytes_per_second=1_000_000, segment_bytes=10,
+                 trigger_inputs=4, poll_interval=0.1,
+                 current_range_na=16_000_000, current_resolution_na=8_000,
+                 voltage_range_uv=8_000_000, voltage_resolution_uv=4_000):
+        self.call_latency = call_latency
+        self.bytes_per_second = bytes_per_second
+        self.segment_bytes = segment_bytes  # Bytes per amplitude/duration pair sent by PrepareAndSendData
+        self.trigger_inputs = trigger_inputs
+        self.poll_interval = poll_interval
+        self.current_range_na = current_range_na
+        self.current_resolution_na = current_resolution_na
+        self.voltage_range_uv = voltage_range_uv
+        self.voltage_resolution_uv = voltage_resolution_uv
+
+        self.Stg200xPollStatusEvent = _PollStatusEvent()
+        self.calls = []
+        self.connected = False
+        self.serial_number = None
+        self.mode = None
+        self.channel_data = {}
+        self.sync_data = {}
+        self.channelmap = [0] * trigger_inputs
+        self.syncoutmap = [0] * trigger_inputs
+        self.repeat = [0] * trigger_inputs
+        self.trigger_started = [None] * trigger_inputs
+        self._lock = threading.Lock()
+        self._poll_thread = None
+
+    ### Cost model and bookkeeping
+    def _record(self, name, nbytes=0, *args):
+        start = time.perf_counter()
+        cost = self.call_latency + nbytes / self.bytes_per_second
+        if cost > 0:
+            time.sleep(cost)
+        with self._lock:
+            self.calls.append(CallRecord(name, start, time.perf_counter(), nbytes, args))
+
+    @staticmethod
+    def _payload_bytes(values):
+        return len(values) * getattr(values, 'itemsize', 8)
+
+    @property
+    def bytes_sent(self):
+        return sum(call.nbytes for call in self.calls)
+
+    def calls_named(self, name):
+        return [call for call in self.calls if call.name == name]
+
+    ### Connection
+    def Connect(self, entry):
+        self.serial_number = getattr(entry, 'SerialNumber', None)
+        self.connected = True
+        self._record('Connect', 0, self.serial_number)
+        if self.poll_interval and self._poll_thread is None:
+            self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self._poll_thread.start()
+        return 0
+
+    def Disconnect(self):
+        self._record('Disconnect')
+        self.connected = False
+
+    def IsConnected(self):
+        return self.connected
+
+    ### Device information
+    def GetNumberOfTriggerInputs(self):
+        self._record('GetNumberOfTriggerInputs')
+        return self.trigger_inputs
+
+    def GetCurrentRangeInNanoAmp(self, channel):
+        self._record('GetCurrentRangeInNanoAmp', 0, channel)
+        return self.current_range_na
+
+    def GetCurrentResolutionInNanoAmp(self, channel):
+        self._record('GetCurrentResolutionInNanoAmp', 0, channel)
+        return self.current_resolution_na
+
+    def GetVoltageRangeInMicroVolt(self, channel):
+        self._record('GetVoltageRangeInMicroVolt', 0, channel)
+        return self.voltage_range_uv
+
+    def GetVoltageResolutionInMicroVolt(self, channel):
+        self._record('GetVoltageResolutionInMicroVolt', 0, channel)
+        return self.voltage_resolution_uv
+
+    ### Configuration and data
+    def SetCurrentMode(self):
+        self._record('SetCurrentMode')
+        self.mode = 'current'
+
+    def SetVoltageMode(self):
+        self._record('SetVoltageMode')
+        self.mode = 'voltage'
+
+    def SetupTrigger(self, first_trigger, channelmap, syncoutmap, repeat):
+        first_trigger = int(first_trigger)
+        for offset in range(len(channelmap)):
+            trigger = first_trigger + offset
+            if trigger >= self.trigger_inputs:
+                break
+            self.channelmap[trigger] = int(channelmap[offset])
+            self.syncoutmap[trigger] = int(syncoutmap[offset])
+            self.repeat[trigger] = int(repeat[offset])
+        self._record('SetupTrigger', 12 * len(channelmap), first_trigger)
+
+    def ClearChannelData(self, channel):
+        self.channel_data.pop(int(channel), None)
+        self._record('ClearChannelData', 0, int(channel))
+
+    def ClearSyncData(self, sync):
+        self.sync_data.pop(int(sync), None)
+        self._record('ClearSyncData', 0, int(sync))
+
+    def PrepareAndSendData(self, channel, amplitudes, durations, destination):
+        amplitudes = np.asarray(amplitudes, dtype=np.int64)
+        durations = np.asarray(durations, dtype=np.int64)
+        if destination == SimulatedDestinationEnum.syncoutdata:
+            self.sync_data[int(channel)] = (amplitudes, durations)
+        else:
+            self.channel_data[int(channel)] = (amplitudes, durations)
+        self._record('PrepareAndSendData', len(durations) * self.segment_bytes, int(channel), destination)
+
+    def SendChannelData(self, channel, pData, tData):
+        self.channel_data[int(channel)] = (np.asarray(pData, dtype=np.int64), np.asarray(tData, dtype=np.int64))
+        self._record('SendChannelData', self._payload_bytes(pData) + self._payload_bytes(tData), int(channel))
+
+    def SendSyncData(self, sync, pData, tData):
+        self.sync_data[int(sync)] = (np.asarray(pData, dtype=np.int64), np.asarray(tData, dtype=np.int64))
+        self._record('SendSyncData', self._payload_bytes(pData) + self._payload_bytes(tData), int(sync))
+
+    ### Playback
+    def SendStart(self, trigger_mask):
+        now = time.perf_counter()
+        for trigger in range(self.trigger_inputs):
+            if int(trigger_mask) & (1 << trigger):
+                self.trigger_started[trigger] = now
+        self._record('SendStart', 0, int(trigger_mask))
+
+    def SendStop(self, trigger_mask):
+        for trigger in range(self.trigger_inputs):
+            if int(trigger_mask) & (1 << trigger):
+                self.trigger_started[trigger] = None
+        self._record('SendStop', 0, int(trigger_mask))
+
+    def trigger_duration_us(self, trigger):
+        """Length of one pass over the data mapped on `trigger`, in microseconds."""
+        durations = []
+        for index, data in self.channel_data.items():
+            if self.channelmap[trigger] & (1 << index):
+                durations.append(int(data[1].sum()))
+        for index, data in self.sync_data.items():
+            if self.syncoutmap[trigger] & (1 << index):
+                durations.append(int(data[1].sum()))
+        return max(durations, default=0)
+
+    def trigger_status(self):
+        """One flag per trigger input, 1 while its data is still being played."""
+        now = time.perf_counter()
+        status = []
+        for trigger, started in enumerate(self.trigger_started):
+            if started is None:
+                status.append(0)
+                continue
+            repeat = self.repeat[trigger]
+            running = repeat == 0 or (now - started) * 1e6 < self.trigger_duration_us(trigger) * repeat
+            if not running:
+                self.trigger_started[trigger] = None
+            status.append(1 if running else 0)
+        return status
+
+    def _poll_loop(self):
+        # Mirrors the polling thread of McsUsbNet that raises Stg200xPollStatusEvent
+        while self.connected:
+            status = self.trigger_status()
+            mask = sum(flag << trigger for trigger, flag in enumerate(status))
+            self.Stg200xPollStatusEvent(mask, SimpleNamespace(TiggerStatus=status), list(range(self.trigger_inputs)))
+            time.sleep(self.poll_interval)
+        self._poll_thread = None
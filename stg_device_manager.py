@@ -0,0 +1,148 @@
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+# Keeps STG connections open between runs instead of enumerating, connecting
+# and disconnecting every time. Devices are keyed by the serial number from
+# GetUsbListEntry, checked before reuse and reconnected when the check fails.
+# The range/resolution queries never change for a connected device, so they
+# are asked once and cached.
+#
+# The manager (and so each device) is shared by every GUI session in the
+# process. A session holds the device's run lock from the start of the upload
+# to the end of the run, a second session asking meanwhile is refused.
+
+_shared_managers = {}
+_shared_lock = threading.Lock()
+
+
+class DeviceBusyError(RuntimeError):
+    pass
+
+
+class DeviceNotFoundError(RuntimeError):
+    pass
+
+
+def get_device_manager(backend, logger=None, poll_handler=None):
+    """Return the process-wide manager for `backend`, shared by every GUI session."""
+    with _shared_lock:
+        manager = _shared_managers.get(backend.name)
+        if manager is None:
+            manager = STGDeviceManager(backend, logger, poll_handler)
+            _shared_managers[backend.name] = manager
+            atexit.register(manager.close_all)
+        return manager
+
+
+class STGDeviceManager:
+    def __init__(self, backend, logger=None, poll_handler=None):
+        self.backend = backend
+        self.logger = logger or logging.getLogger(__name__)
+        self.poll_handler = poll_handler
+        self.devices = {}     # serial number -> connected CStg200xDownloadNet
+        self._info = {}       # serial number -> cached device queries
+        self._serials = {}    # id(device) -> serial number
+        self._run_locks = {}  # serial number -> lock held for a whole upload and run
+        self._lock = threading.RLock()
+        self.connects = 0
+
+    def list_entries(self):
+        device_list = self.backend.CMcsUsbListNet(self.backend.DeviceEnumNet.MCS_DEVICE_USB)
+        return [device_list.GetUsbListEntry(i) for i in range(device_list.Count)]
+
+    def get(self, serial_number=None):
+        """Return a connected device, reusing the open connection when it is still healthy.
+
+        With no serial number the first device seen (or the first one plugged in) is used.
+        Returns None when no device is found.
+        """
+        with self._lock:
+            if serial_number is None and self.devices:
+                serial_number = next(iter(self.devices))
+            device = self.devices.get(serial_number)
+            if device is not None:
+                if self.is_healthy(device):
+                    return device
+                self.logger.debug(f"STG {serial_number} stopped responding, reconnecting")
+                self.release(serial_number)
+            return self._connect(serial_number)
+
+    def _connect(self, serial_number):
+        entries = self.list_entries()
+        if serial_number is not None:
+            entries = [entry for entry in entries if entry.SerialNumber == serial_number]
+        if not entries:
+            self.logger.debug("No devices found")
+            return None
+        entry = entries[0]
+        device = self.backend.CStg200xDownloadNet()
+        if self.poll_handler is not None:
+            device.Stg200xPollStatusEvent += self.poll_handler
+        device.Connect(entry)
+        self.connects += 1
+        self.devices[entry.SerialNumber] = device
+        self._serials[id(device)] = entry.SerialNumber
+        self.logger.debug(f"Connected to {entry.DeviceName} ({entry.SerialNumber})")
+        return device
+
+    @contextmanager
+    def running(self, device):
+        """Hold `device` for one upload-and-run, raising DeviceBusyError if another session has it."""
+        with self._lock:
+            serial_number = self._serials.get(id(device), id(device))
+            run_lock = self._run_locks.setdefault(serial_number, threading.Lock())
+        if not run_lock.acquire(blocking=False):
+            raise DeviceBusyError(f"STG {serial_number} is running a stimulation from another session")
+        try:
+            yield device
+        finally:
+            run_lock.release()
+
+    def is_healthy(self, device):
+        try:
+            if hasattr(device, 'IsConnected'):
+                return bool(device.IsConnected())
+            device.GetNumberOfTriggerInputs()
+            return True
+        except Exception:
+            return False
+
+    def info(self, device):
+        """Trigger count and output ranges of `device`, queried once per connection."""
+        with self._lock:
+            serial_number = self._serials.get(id(device))
+            info = self._info.get(serial_number)
+            if info is None:
+                info = {
+                    "trigger_inputs": device.GetNumberOfTriggerInputs(),
+                    "current_range_na": device.GetCurrentRangeInNanoAmp(0),
+                    "current_resolution_na": device.GetCurrentResolutionInNanoAmp(0),
+                    "voltage_range_uv": device.GetVoltageRangeInMicroVolt(0),
+                    "voltage_resolution_uv": device.GetVoltageResolutionInMicroVolt(0),
+                }
+                if serial_number is not None:
+                    self._info[serial_number] = info
+            return info
+
+    def cached_info(self):
+        """info() of a device queried earlier, or None before any device has been seen."""
+        with self._lock:
+            return next(iter(self._info.values()), None)
+
+    def release(self, serial_number):
+        with self._lock:
+            device = self.devices.pop(serial_number, None)
+            self._info.pop(serial_number, None)
+            if device is None:
+                return
+            self._serials.pop(id(device), None)
+            try:
+                device.Disconnect()
+            except Exception:
+                self.logger.debug(f"Disconnect of {serial_number} failed")
+
+    def close_all(self):
+        for serial_number in list(self.devices):
+            self.release(serial_number)
@@ -0,0 +1,93 @@
+import threading
+import time
+
+# Waits for a running STG protocol to finish without spinning a core.
+# Completion comes from the trigger status reported through
+# Stg200xPollStatusEvent when the device provides it, with a timer on the
+# expected protocol duration as the fallback. The timer never ends the wait
+# while a recent status still reports the trigger running, only a device that
+# stopped reporting (for `stale_after_s`) falls back to it. Progress is pushed
+# to the GUI at no more than `max_rate_hz`.
+
+
+class CompletionMonitor:
+    def __init__(self, total_duration_us, on_progress=None, trigger=0, max_rate_hz=10,
+                 clock=time.perf_counter, stale_after_s=1.0):
+        self.total_duration_s = total_duration_us / 1_000_000
+        self.on_progress = on_progress
+        self.trigger = trigger
+        self.interval = 1 / max_rate_hz
+        self.clock = clock
+        self.start_time = None
+        self.seen_running = False
+        self.running = False
+        self.last_status = None  # Clock time of the last poll status
+        self.stale_after_s = stale_after_s
+        self.finished_by_device = False
+        self.cancelled = False
+        self.progress_updates = 0
+        self._done = threading.Event()
+
+    ### Device status
+    def attach(self, device):
+        device.Stg200xPollStatusEvent += self.poll_handler
+
+    def detach(self, device):
+        try:
+            device.Stg200xPollStatusEvent -= self.poll_handler
+        except ValueError:
+            pass
+
+    def poll_handler(self, status, stgStatusNet, index_list):
+        # Called from the driver's polling thread, only flips flags
+        running = bool(stgStatusNet.TiggerStatus[self.trigger])
+        self.running = running
+        self.last_status = self.clock()
+        if running:
+            self.seen_running = True
+        elif self.seen_running and self.start_time is not None:
+            # Only trust "not running" once the trigger has been seen running,
+            # the first poll after SendStart can still report the old status
+            self.finished_by_device = True
+            self._done.set()
+
+    ### Waiting
+    def start(self):
+        self.start_time = self.clock()
+
+    def cancel(self):
+        self.cancelled = True
+        self._done.set()
+
+    def device_running(self):
+        """True while a recent poll status reports the trigger running."""
+        return (self.running and self.last_status is not None
+                and self.clock() - self.last_status < self.stale_after_s)
+
+    def elapsed(self):
+        return self.clock() - self.start_time if self.start_time is not None else 0.0
+
+    def progress(self):
+        if self.finished_by_device or self.total_duration_s <= 0:
+            return 100.0
+        return min(100.0, self.elapsed() / self.total_duration_s * 100)
+
+    def _report(self, progress):
+        if self.on_progress is not None:
+            self.on_progress(progress)
+            self.progress_updates += 1
+
+    def wait(self):
+        """Block until the protocol ends or is cancelled, return True if it ran to completion."""
+        if self.start_time is None:
+            self.start()
+        while not self._done.is_set():
+            remaining = self.total_duration_s - self.elapsed()
+            if remaining <= 0 and not self.device_running():
+                break
+            self._report(self.progress())
+            # Sleeps on the event so a status change or cancel wakes us immediately
+            self._done.wait(min(self.interval, remaining) if remaining > 0 else self.interval)
+        if not self.cancelled:
+            self._report(100.0)
+        return not self.cancelled
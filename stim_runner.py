@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+# Runs a stimulation protocol on a worker thread so the Panel server thread is
+# free while the STG plays. The job handle reports status, can be cancelled,
+# and calls back once the work has finished.
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+class StimulationJob:
+    def __init__(self):
+        self.status = PENDING
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = threading.Event()
+        self._finished = threading.Event()
+        self._cancel_hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_requested.is_set()
+
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def on_cancel(self, hook):
+        """Register `hook` to run when the job is cancelled (immediately if it already was)."""
+        with self._lock:
+            if not self.cancelled:
+                self._cancel_hooks.append(hook)
+                return
+        hook()
+
+    def cancel(self):
+        """Request cancellation, returns False if the job had already finished."""
+        with self._lock:
+            if self.done() or self.cancelled:
+                return False
+            self._cancel_requested.set()
+            hooks, self._cancel_hooks = self._cancel_hooks, []
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                logging.getLogger(__name__).exception("Cancel hook failed")
+        return True
+
+
+class StimulationRunner:
+    """Runs one stimulation job at a time on a daemon worker thread."""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.current_job = None
+
+    def busy(self):
+        return self.current_job is not None and not self.current_job.done()
+
+    def submit(self, work, on_done=None):
+        """Start `work(job)` in the background and return its StimulationJob."""
+        if self.busy():
+            raise RuntimeError("A stimulation is already running")
+        job = StimulationJob()
+        self.current_job = job
+        threading.Thread(target=self._run, args=(job, work, on_done),
+                         name='stimulation-runner', daemon=True).start()
+        return job
+
+    def _run(self, job, work, on_done):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            work(job)
+            job.status = CANCELLED if job.cancelled else DONE
+        except Exception as error:
+            job.status = FAILED
+            job.error = error
+            self.logger.exception("Stimulation failed")
+        finally:
+            job.finished_at = time.time()
+            job._finished.set()
+            if on_done is not None:
+                on_done(job)
@@ -0,0 +1,83 @@
+from gpio_pins import open_pins
+from precise_timing import precise_sleep_us
+
+# Raspberry Pi side of the BRAINSBoard switch matrix, shared by GPIO.py and
+# rest_api.py. The 16 channels are 4 latch groups of 4. The two SP3T selector
+# pins for the nth channel of a group are shared by all groups, and a group's
+# latch takes them on a pulse of its LE pin. Like apply() in the firmware,
+# only the groups whose channels changed since the last latch are
+# reprogrammed and pulsed, and selector pins already at the right level are
+# not written again.
+#
+# Pins are written through a gpio_pins bank. On the masked banks (lgpio,
+# pigpio) a group's selector pins change in one write, so a group costs three
+# writes: selectors, LE high, LE low.
+
+NUM_CHANNELS = 16
+GROUP_SIZE = 4
+
+state2pin_logic_map = {
+    "C": [1, 0],
+    "A": [0, 1],
+    "G": [1, 1],
+    "F": [0, 0]
+}
+
+
+class SwitchLatcher:
+    def __init__(self, oe_pin, le_pins, selector_pins, pins=None, le_pulse_us=1000):
+        self.oe_pin = oe_pin
+        self.le_pins = list(le_pins)
+        self.selector_pins = selector_pins  # [channel in group][pin]
+        self.pins = pins if pins is not None else open_pins(
+            [oe_pin] + self.le_pins + [pin for pair in selector_pins for pin in pair])
+        self.le_pulse_us = le_pulse_us
+        self.latched = [None] * NUM_CHANNELS  # None until a group has been latched once
+        self._levels = {}  # pin -> level last written
+        self.updates = 0
+        self.writes = 0
+        self.last_writes = 0
+
+    def dirty_groups(self, channels):
+        return [group for group in range(NUM_CHANNELS // GROUP_SIZE)
+                if channels[group * GROUP_SIZE:(group + 1) * GROUP_SIZE]
+                != self.latched[group * GROUP_SIZE:(group + 1) * GROUP_SIZE]]
+
+    def _write(self, levels, force=False):
+        if not force:
+            levels = {pin: level for pin, level in levels.items() if self._levels.get(pin) != level}
+        self._levels.update(levels)
+        return self.pins.write(levels) if levels else 0
+
+    def apply(self, channels):
+        """Latch `channels` (16 of 'F', 'C', 'A', 'G') and return the number of GPIO writes it took."""
+        for state in channels:
+            if state not in state2pin_logic_map:
+                raise ValueError(f"Invalid channel state {state!r}")
+        channels = list(channels)
+        writes = 0
+        dirty = self.dirty_groups(channels)
+        if dirty:
+            writes += self._write({self.oe_pin: 1}, force=True)
+            for group in dirty:
+                group_channels = slice(group * GROUP_SIZE, (group + 1) * GROUP_SIZE)
+                selectors = {}
+                for rch, state in enumerate(channels[group_channels]):
+                    selectors.update(zip(self.selector_pins[rch], state2pin_logic_map[state]))
+                writes += self._write(selectors)
+                writes += self._write({self.le_pins[group]: 1}, force=True)
+                if self.le_pulse_us:
+                    precise_sleep_us(self.le_pulse_us)
+                writes += self._write({self.le_pins[group]: 0}, force=True)
+                self.latched[group_channels] = channels[group_channels]
+            writes += self._write({self.oe_pin: 0}, force=True)
+        self.updates += 1
+        self.writes += writes
+        self.last_writes = writes
+        return writes
+
+    def stats(self):
+        return {'updates': self.updates, 'gpio_writes': self.writes, 'last_gpio_writes': self.last_writes}
+
+    def close(self):
+        self.pins.close()
@@ -0,0 +1,76 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from precise_timing import JitterHistogram
+
+# Single owner of the switch hardware for the REST API. Request threads never
+# touch the GPIO pins; they merge their changes into the desired channel map
+# and wait on a Future, while one worker thread latches the desired map. Every
+# request that arrives while a latch is in progress is served by the next
+# latch, so a burst of updates collapses into one latch of the newest map.
+
+
+class SwitchWorker:
+    def __init__(self, apply, channels):
+        self.apply = apply  # apply(channels) latches a 16-channel map and returns the GPIO writes
+        self.desired = list(channels)
+        self.latched = list(channels)
+        self.latency = JitterHistogram(resolution_ns=10000)  # submit to latched, 10 us bins
+        self.submitted = 0
+        self.latches = 0
+        self.last_gpio_writes = 0
+        self._waiting = []  # (future, submit time in ns)
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="switch-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, changes):
+        """Merge {channel index: state} into the desired map.
+
+        Returns a Future that resolves to (latched channels, GPIO writes) once
+        a latch includes the change.
+        """
+        future = Future()
+        with self._condition:
+            for channel, state in changes.items():
+                self.desired[channel] = state
+            self.submitted += 1
+            self._waiting.append((future, time.perf_counter_ns()))
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._waiting:
+                    self._condition.wait()
+                waiting, self._waiting = self._waiting, []
+                channels = list(self.desired)
+            try:
+                writes = self.apply(channels)
+            except Exception as error:
+                for future, _ in waiting:
+                    future.set_exception(error)
+                continue
+            done = time.perf_counter_ns()
+            with self._condition:
+                self.latched = channels
+                self.latches += 1
+                self.last_gpio_writes = writes
+                for _, submitted in waiting:
+                    self.latency.record(submitted, done)
+            for future, _ in waiting:
+                future.set_result((channels, writes))
+
+    def metrics(self):
+        with self._condition:
+            latency = self.latency.summary()
+            return {
+                'queue_depth': len(self._waiting),
+                'submitted': self.submitted,
+                'latches': self.latches,
+                'collapsed': self.latency.count - self.latches,  # requests served by another request's latch
+                'last_gpio_writes': self.last_gpio_writes,
+                'latch_latency_us': {key: value for key, value in latency.items() if key != 'count'},
+            }
@@ -0,0 +1,38 @@
+from bokeh.models import ColumnDataSource, DataTable, TableColumn
+
+# Dict-backed model for the Finalize tab's parameter table. Rows are compared
+# cell by cell with what the browser already shows, and only the changed cells
+# are sent as a ColumnDataSource patch, so typing a comment updates one cell
+# instead of re-serializing a whole DataFrame.
+
+
+class TableModel:
+    def __init__(self, columns=('Parameter', 'Value'), **table_options):
+        self.columns = list(columns)
+        self.source = ColumnDataSource({column: [] for column in self.columns})
+        self.view = DataTable(source=self.source, index_position=None,
+                              columns=[TableColumn(field=column, title=column) for column in self.columns],
+                              **table_options)
+        self.patches = 0
+        self.rebuilds = 0
+
+    def update(self, rows):
+        """Show `rows` (tuples in column order) and return the patch that was sent, if any."""
+        new = {column: [str(value) for value in values]
+               for column, values in zip(self.columns, zip(*rows))} if rows else {column: [] for column in self.columns}
+        old = self.source.data
+        if len(new[self.columns[0]]) != len(old[self.columns[0]]):
+            # Row count changed, replace the data outright
+            self.source.data = new
+            self.rebuilds += 1
+            return None
+        patch = {}
+        for column in self.columns:
+            changed = [(index, value) for index, (current, value) in enumerate(zip(old[column], new[column]))
+                       if current != value]
+            if changed:
+                patch[column] = changed
+        if patch:
+            self.source.patch(patch)
+            self.patches += 1
+        return patch